@@ -1,26 +1,50 @@
 #!/usr/bin/env python3
 
+import os
+import importlib
 import time
 import datetime
 import json
 from typing import Dict, Any, Optional, List
 import uuid
+import sqlite3
+import re
 import threading
 from queue import Queue, Empty
-from concurrent.futures import ThreadPoolExecutor
+import random
+import sys
+import contextvars
+from contextlib import contextmanager, nullcontext
+import functools
+import hashlib
+from logging.handlers import QueueHandler, QueueListener
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import logging
+from functools import lru_cache
 
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import gspread
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.tools import Tool
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, messages_from_dict, messages_to_dict
+from langchain_core.callbacks import BaseCallbackHandler
 from langgraph.prebuilt import create_react_agent
 from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.base import empty_checkpoint
 from langgraph.graph import MessagesState
+from pydantic import BaseModel, Field, create_model
+
+# Import SQLite checkpointer (persistent LangGraph memory)
+try:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    SQLITE_CHECKPOINTS_AVAILABLE = True
+except ImportError:
+    SQLITE_CHECKPOINTS_AVAILABLE = False
 
 # Import scroll component
 try:
@@ -38,6 +62,11 @@ import streamlit as st
 
 # App Configuration
 SPREADSHEET_NAME = "n8nTest"
+
+# Alternative backend for offline runs (benchmarks, load tests): a module path providing
+# sheets_client() and chat_model(task, temperature, provider, callbacks). When set, no secrets are read
+# and neither Google nor the LLM providers are contacted, e.g. QUIZ_APP_BACKEND=bench.fakes
+APP_BACKEND = os.environ.get("QUIZ_APP_BACKEND", "")
 THRESHOLD_SCORE = 8.0  # completion threshold (1-10 scale)
 
 # Google Doc IDs for prompts
@@ -82,22 +111,587 @@ DEFAULT_MODEL = {
     "openai": "gpt-4o-mini-2024-07-18",
     "gemini": "gemini-2.5-flash"
 }
+
+# Provider failover: a circuit breaker trips on a provider that keeps erroring or is too slow,
+# and calls are routed to the other provider until a half-open probe succeeds
+CIRCUIT_WINDOW = 20  # Recent calls considered per provider
+CIRCUIT_MIN_CALLS = 5  # Calls needed in the window before the breaker can trip
+CIRCUIT_ERROR_RATE = 0.5  # Trip when this share of recent calls failed...
+CIRCUIT_SLOW_CALL_SECONDS = 30  # ...or took longer than this
+CIRCUIT_OPEN_SECONDS = 30  # How long a tripped provider is skipped before a probe call
+
+# Have the provider constrain grading and evaluation replies to their JSON schema (OpenAI json_schema
+# response_format, Gemini response_schema) and validate them against it. Replies are streamed either way, so stop
+# sequences, stopping once the JSON object is complete and mid-stream cancellation apply in both modes
+USE_STRUCTURED_OUTPUT = True
+
+# Per-task output limits; a two-field grading reply never needs thousands of tokens
+MAX_OUTPUT_TOKENS = {
+    "grading": 1024,
+    "evaluation": 4000,
+    "conversation": 2000,
+    "summary": 512
+}
+# Stop generation if the model starts echoing the prompt's structure back after its answer
+STOP_SEQUENCES = {
+    "grading": ["</output_format>", "<instructions>", "<data>"],
+    "evaluation": ["</output_format>", "<instructions>", "<data>"],
+    "conversation": ["<current_student_question>", "<instructions>"]
+}
+
+# Conversation context: recent exchanges are kept verbatim within this budget, older ones are summarized
+CONVERSATION_CONTEXT_TOKEN_BUDGET = 3000
+CONVERSATION_MIN_RECENT_MESSAGES = 4  # Always kept verbatim, even over budget
+
+# Persistent assignment memory (LangGraph SQLite checkpointer), keyed by (student_id, assignment_id)
+CHECKPOINT_DB_PATH = "quiz_memory.sqlite"
+
+# Per-session memory: one AssignmentMemoryManager per execution_id, held in a bounded LRU
+MEMORY_MAX_SESSIONS = 200  # Least recently used sessions are evicted beyond this
+MEMORY_IDLE_SECONDS = 3600  # Sessions idle this long are evicted
+MEMORY_SWEEP_SECONDS = 60  # How often idle sessions are swept even when no session is looked up
+MEMORY_MAX_MESSAGES_PER_SESSION = 400  # Oldest messages are dropped beyond this
+MEMORY_MAX_CONTEXT_CHARS = 20000  # Oldest response/feedback entries are dropped from a question context beyond this
+
+# Compacted memory snapshots (latest state + bounded history summary), stored in CHECKPOINT_DB_PATH
+MEMORY_SNAPSHOT_SUMMARY_CHARS = 2000  # Cap on the compacted history summary
+MEMORY_SNAPSHOT_SCORE_HISTORY = 10  # Most recent scores kept per question
+MEMORY_SNAPSHOT_RECENT_EXCHANGES = 5  # Conversation exchanges kept verbatim in a snapshot
+MEMORY_COMPACT_AFTER_DELTAS = 20  # Re-compact once a restore replays this many records newer than the snapshot
+
+# Session restore (previous answers/feedback/conversation) is memoized per browser session
+SESSION_RESTORE_MAX_AGE = 120  # Seconds before a memoized restore is re-read even without a write from this process
+
+# Per-call LLM accounting (tokens, latency, retries, cost), persisted for per-student/assignment rollups
+LLM_METRICS_DB_PATH = "llm_metrics.sqlite"
+# USD per 1M (input, output) tokens
+MODEL_PRICING = {
+    "gpt-4o-mini-2024-07-18": (0.15, 0.60),
+    "gemini-2.5-flash": (0.30, 2.50)
+}
+
+# Grading scheduler
+GRADING_DEADLINE_SECONDS = 60  # Time budget for grading a whole submission
+BACKGROUND_GRADING_DEADLINE_SECONDS = 180  # Time budget for re-grading late questions in the background
+BACKGROUND_GRADING_RETENTION_SECONDS = 3600  # Re-grading results no session collected are dropped after this
+
+# Grading job queue: submissions are graded off the script thread and polled by the page
+GRADING_JOB_WORKERS = 8  # Submissions graded at once across the process; each fans out under the AIMD limit
+GRADING_JOB_RETENTION_SECONDS = 3600  # Finished jobs are kept this long for sessions that reconnect
+GRADING_POLL_SECONDS = 1.0  # How often the page checks a running job's progress
+
+# Adaptive (AIMD) grading concurrency, shared by every session in the process
+AIMD_INITIAL_LIMIT = 10  # Starting number of concurrent grading calls
+AIMD_MIN_LIMIT = 1
+AIMD_MAX_LIMIT = 25
+AIMD_LATENCY_TARGET_SECONDS = 15  # Calls slower than this don't earn an increase
+AIMD_DECREASE_FACTOR = 0.5  # Multiplicative cut on 429s / timeouts
+AIMD_DECREASE_COOLDOWN_SECONDS = 2  # A burst of 429s from one overload only cuts once
+
+# Hedged grading requests: fire a duplicate call when a question runs past the observed p95 latency
+ENABLE_HEDGED_REQUESTS = False
+HEDGE_BUDGET_FRACTION = 0.2  # At most this share of a submission's questions may be hedged
+HEDGE_MIN_SAMPLES = 20  # Latency samples needed before p95 is trusted
+
+# Logging: leveled per subsystem, sampled, and written by a background queue listener.
+# Any of these can be overridden from a [logging] section in secrets (level, subsystems, sample_rates, format)
+# to get debug detail on demand without a redeploy.
+LOG_LEVEL = "INFO"  # Default for every quiz_app.* logger
+LOG_SUBSYSTEM_LEVELS = {  # Per-rerun render tracing and sheet I/O detail are off in production
+    "ui": "WARNING",
+    "sheets": "WARNING",
+    "prompts": "WARNING"
+}
+LOG_SAMPLE_RATES = {}  # Fraction of below-WARNING records kept per subsystem, e.g. {"grading": 0.1}
+LOG_FORMAT = "text"  # "text" or "json" (one object per line)
+LOG_STREAM = os.environ.get("QUIZ_APP_LOG_STREAM", "stdout")  # "stdout" or "stderr"
+
+# Tracing: parent/child spans around rerun phases, sheet I/O, LLM calls and background writes
+TRACING_ENABLED = True
+TRACE_EXPORT_PATH = "traces.jsonl"  # One OTLP-style span per line
+TRACE_SAMPLE_RATE = float(os.environ.get("QUIZ_APP_TRACE_SAMPLE_RATE", 0.01))  # Fraction of traces (root spans) exported
+TRACE_MAX_BYTES = int(os.environ.get("QUIZ_APP_TRACE_MAX_BYTES", 50 * 1024 * 1024))  # Rotate to traces.jsonl.1 past this; 0 = never
+
+# Optional cache/state tier shared by every replica behind a load balancer: sheet snapshots, prompts,
+# LLM rate-limit buckets and session memory. Off by default (per-process caches only). A [shared_cache]
+# section in secrets (backend, path) overrides these.
+SHARED_CACHE_BACKEND = ""  # "", "sqlite", "file", or a dotted path to a SharedCache subclass
+SHARED_CACHE_PATH = "shared_cache.sqlite"  # SQLite file (or directory for "file") on storage every replica mounts
+SHARED_LLM_CALLS_PER_MINUTE = {}  # Cluster-wide call rate per provider, e.g. {"gemini": 900}; needs the shared tier
+SHARED_RATE_LIMIT_MAX_WAIT = 30  # Seconds a call waits for a cluster-wide token before going ahead anyway
+
+
+# ===========================
+# Logging
+# ===========================
+
+LOG_SUBSYSTEMS = ("ui", "sheets", "prompts", "memory", "llm", "grading", "conversation")
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a random fraction of records below WARNING; warnings and errors always pass."""
+    
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+    
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "subsystem": record.name.rpartition(".")[2],
+            "thread": record.threadName,
+            "msg": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread instead of the caller."""
+    
+    def prepare(self, record):
+        return record
+
+
+def secrets_section(name: str) -> dict:
+    """An optional [name] table from secrets.toml, or {} if it is missing or there is no secrets file at all."""
+    try:
+        return st.secrets[name] if name in st.secrets else {}
+    except FileNotFoundError:  # StreamlitSecretNotFoundError subclasses it
+        return {}
+
+
+@st.cache_resource
+def configure_logging():
+    """Route quiz_app.* loggers through a queue to a stdout (or stderr) listener thread. Runs once per process."""
+    overrides = secrets_section("logging")
+    levels = {**LOG_SUBSYSTEM_LEVELS, **overrides.get("subsystems", {})}
+    sample_rates = {**LOG_SAMPLE_RATES, **overrides.get("sample_rates", {})}
+    
+    stream_handler = logging.StreamHandler(sys.stderr if overrides.get("stream", LOG_STREAM) == "stderr" else sys.stdout)
+    if overrides.get("format", LOG_FORMAT) == "json":
+        stream_handler.setFormatter(JsonLogFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    log_queue = Queue()
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    
+    root = logging.getLogger("quiz_app")
+    root.setLevel(overrides.get("level", LOG_LEVEL))
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.propagate = False
+    for subsystem in LOG_SUBSYSTEMS:
+        logger = logging.getLogger(f"quiz_app.{subsystem}")
+        if subsystem in levels:
+            logger.setLevel(levels[subsystem])
+        if subsystem in sample_rates:
+            logger.addFilter(SamplingFilter(float(sample_rates[subsystem])))
+    return listener
+
+configure_logging()
+
+ui_log = logging.getLogger("quiz_app.ui")
+sheets_log = logging.getLogger("quiz_app.sheets")
+prompts_log = logging.getLogger("quiz_app.prompts")
+memory_log = logging.getLogger("quiz_app.memory")
+llm_log = logging.getLogger("quiz_app.llm")
+grading_log = logging.getLogger("quiz_app.grading")
+conversation_log = logging.getLogger("quiz_app.conversation")
+
+
+# ===========================
+# Tracing
+# ===========================
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "attributes", "sampled", "status")
+    
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.sampled = parent.sampled if parent else random.random() < TRACE_SAMPLE_RATE
+        self.attributes = attributes
+        self.status = "ok"
+        self.start_ns = time.time_ns()
+
+
+_current_span = contextvars.ContextVar("quiz_app_current_span", default=None)
+
+
+class Tracer:
+    """
+    Minimal span tracer. The current span lives in a contextvar, so nesting within a thread is automatic;
+    work handed to another thread passes tracer.current() as an explicit parent.
+    Finished spans of sampled traces are written as JSON lines by a background thread.
+    """
+    
+    def __init__(self, export_path: str = TRACE_EXPORT_PATH, enabled: bool = TRACING_ENABLED):
+        self.enabled = enabled
+        self.export_path = export_path
+        self._queue = Queue()
+        if enabled:
+            threading.Thread(target=self._export_worker, daemon=True, name="trace-exporter").start()
+    
+    def current(self) -> Optional[Span]:
+        return _current_span.get()
+    
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes) -> tuple:
+        """Open a span as a child of parent (default: the current span). Returns (span, token) for end_span."""
+        if not self.enabled:
+            return None, None
+        span = Span(name, parent or _current_span.get(), attributes)
+        return span, _current_span.set(span)
+    
+    def end_span(self, span: Optional[Span], token, error: Optional[BaseException] = None):
+        if span is None:
+            return
+        end_ns = time.time_ns()
+        _current_span.reset(token)
+        if error is not None:
+            span.status = "error"
+            span.attributes["error"] = repr(error)
+        if span.sampled:
+            self._queue.put({
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id,
+                "name": span.name,
+                "startTimeUnixNano": span.start_ns,
+                "endTimeUnixNano": end_ns,
+                "durationMs": round((end_ns - span.start_ns) / 1e6, 3),
+                "thread": threading.current_thread().name,
+                "status": span.status,
+                "attributes": span.attributes
+            })
+    
+    @contextmanager
+    def span(self, name: str, parent: Optional[Span] = None, **attributes):
+        span, token = self.start_span(name, parent, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            # st.rerun()/st.stop() unwind with control-flow exceptions; those are not failures
+            if type(e).__name__ in ("RerunException", "StopException"):
+                self.annotate(control_flow=type(e).__name__)
+                self.end_span(span, token)
+            else:
+                self.end_span(span, token, e)
+            raise
+        else:
+            self.end_span(span, token)
+    
+    def annotate(self, **attributes):
+        """Add attributes to the current span, if any."""
+        span = _current_span.get()
+        if span is not None:
+            span.attributes.update(attributes)
+    
+    def traced(self, name: str):
+        """Decorator wrapping every call of a function in a span."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+    
+    def _export_worker(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            try:
+                if TRACE_MAX_BYTES and os.path.exists(self.export_path) and os.path.getsize(self.export_path) >= TRACE_MAX_BYTES:
+                    os.replace(self.export_path, self.export_path + ".1")  # Keep one previous file
+                with open(self.export_path, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(record, default=str) + "\n" for record in batch)
+            except Exception as e:
+                logging.getLogger("quiz_app").error("Failed to export %s trace span(s): %s", len(batch), e)
+
+
+@st.cache_resource
+def get_tracer():
+    return Tracer()
+
+tracer = get_tracer()
+
+# ===========================
+# Shared Cache Tier
+# ===========================
+
+class SharedCache:
+    """
+    Cache/state tier shared by every replica. Values are JSON-serializable and each (namespace, key) carries a
+    version that every write or invalidation bumps, so a replica can check its local copy with one cheap read.
+    Subclasses implement storage; SQLiteSharedCache and FileSharedCache are local implementations for a
+    shared volume or for testing, and SHARED_CACHE_BACKEND can name any other subclass (e.g. one over Redis).
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+    
+    def get(self, namespace: str, key: str) -> Optional[tuple]:
+        """(version, value, updated_at) for a live entry, or None if missing or invalidated."""
+        raise NotImplementedError
+    
+    def version(self, namespace: str, key: str) -> int:
+        """Current version of an entry (0 if it was never written)."""
+        raise NotImplementedError
+    
+    def set(self, namespace: str, key: str, value: Any) -> int:
+        """Store a value and return its new version."""
+        raise NotImplementedError
+    
+    def set_if_version(self, namespace: str, key: str, value: Any, expected_version: int) -> Optional[int]:
+        """Store a value only if the entry is still at expected_version (compare-and-set). Returns the new version, or None."""
+        raise NotImplementedError
+    
+    def invalidate(self, namespace: str, key: str) -> int:
+        """Drop the value and bump the version, so every replica's copy is stale. Returns the new version."""
+        raise NotImplementedError
+    
+    def take_token(self, bucket: str, rate_per_second: float, capacity: float) -> bool:
+        """Atomically take one token from a token bucket refilled at rate_per_second up to capacity."""
+        raise NotImplementedError
+
+
+class SQLiteSharedCache(SharedCache):
+    """SharedCache in one SQLite file; safe across processes on the same host or a shared volume that supports locking."""
+    
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._lock = threading.Lock()
+        # Autocommit mode; writes take an immediate (write) lock so read-modify-write is atomic across processes
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_cache ("
+                "namespace TEXT, key TEXT, version INTEGER, value TEXT, updated_at REAL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS rate_buckets (name TEXT PRIMARY KEY, tokens REAL, updated_at REAL)")
+    
+    def get(self, namespace: str, key: str) -> Optional[tuple]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, value, updated_at FROM shared_cache WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        if not row or row[1] is None:
+            return None
+        return row[0], json.loads(row[1]), row[2]
+    
+    def version(self, namespace: str, key: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM shared_cache WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return row[0] if row else 0
+    
+    def _write(self, namespace: str, key: str, value: Optional[str], expected_version: Optional[int] = None) -> Optional[int]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if expected_version is not None:
+                    row = self._conn.execute(
+                        "SELECT version FROM shared_cache WHERE namespace = ? AND key = ?", (namespace, key)
+                    ).fetchone()
+                    if (row[0] if row else 0) != expected_version:
+                        self._conn.execute("COMMIT")
+                        return None
+                self._conn.execute(
+                    "INSERT INTO shared_cache VALUES (?, ?, 1, ?, ?) ON CONFLICT (namespace, key) DO UPDATE SET "
+                    "version = version + 1, value = excluded.value, updated_at = excluded.updated_at",
+                    (namespace, key, value, time.time())
+                )
+                version = self._conn.execute(
+                    "SELECT version FROM shared_cache WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()[0]
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return version
+    
+    def set(self, namespace: str, key: str, value: Any) -> int:
+        return self._write(namespace, key, json.dumps(value, default=str))
+    
+    def set_if_version(self, namespace: str, key: str, value: Any, expected_version: int) -> Optional[int]:
+        return self._write(namespace, key, json.dumps(value, default=str), expected_version)
+    
+    def invalidate(self, namespace: str, key: str) -> int:
+        return self._write(namespace, key, None)
+    
+    def take_token(self, bucket: str, rate_per_second: float, capacity: float) -> bool:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute("SELECT tokens, updated_at FROM rate_buckets WHERE name = ?", (bucket,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate_per_second)
+                taken = tokens >= 1
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_buckets VALUES (?, ?, ?)", (bucket, tokens - 1 if taken else tokens, now)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return taken
+
+
+class FileSharedCache(SharedCache):
+    """SharedCache as one JSON file per entry under a directory. Meant for tests and single-host setups."""
+    
+    def __init__(self, path: str):
+        super().__init__(path)
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def _locked(self):
+        # A lock file serializes writers across processes where flock exists; threads share self._lock
+        with self._lock, open(os.path.join(self.path, ".lock"), "a") as lock_file:
+            try:
+                import fcntl
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            except ImportError:
+                pass
+            yield
+    
+    def _file(self, namespace: str, key: str) -> str:
+        return os.path.join(self.path, f"{namespace}.{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json")
+    
+    def _version_file(self, filename: str) -> str:
+        # Kept beside the entry so version checks don't read (possibly large) values
+        return filename[:-len(".json")] + ".version"
+    
+    def _read(self, filename: str) -> Any:
+        try:
+            with open(filename, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _replace(self, filename: str, entry: Any):
+        tmp = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, default=str)
+        os.replace(tmp, filename)
+    
+    def get(self, namespace: str, key: str) -> Optional[tuple]:
+        entry = self._read(self._file(namespace, key))
+        if not entry or entry["value"] is None:
+            return None
+        return entry["version"], entry["value"], entry["updated_at"]
+    
+    def version(self, namespace: str, key: str) -> int:
+        return self._read(self._version_file(self._file(namespace, key))) or 0
+    
+    def set(self, namespace: str, key: str, value: Any) -> int:
+        return self._write(namespace, key, value)
+    
+    def set_if_version(self, namespace: str, key: str, value: Any, expected_version: int) -> Optional[int]:
+        return self._write(namespace, key, value, expected_version)
+    
+    def _write(self, namespace: str, key: str, value: Any, expected_version: Optional[int] = None) -> Optional[int]:
+        filename = self._file(namespace, key)
+        with self._locked():
+            current = self._read(self._version_file(filename)) or 0
+            if expected_version is not None and current != expected_version:
+                return None
+            version = current + 1
+            self._replace(filename, {"version": version, "value": value, "updated_at": time.time()})
+            self._replace(self._version_file(filename), version)
+        return version
+    
+    def invalidate(self, namespace: str, key: str) -> int:
+        return self.set(namespace, key, None)
+    
+    def take_token(self, bucket: str, rate_per_second: float, capacity: float) -> bool:
+        filename = self._file("rate_bucket", bucket)
+        with self._locked():
+            now = time.time()
+            entry = self._read(filename)
+            tokens = capacity if entry is None else min(capacity, entry["tokens"] + (now - entry["updated_at"]) * rate_per_second)
+            taken = tokens >= 1
+            self._replace(filename, {"tokens": tokens - 1 if taken else tokens, "updated_at": now})
+        return taken
+
+
+@st.cache_resource
+def get_shared_cache() -> Optional[SharedCache]:
+    """The configured shared tier, or None when every cache stays per-process."""
+    overrides = secrets_section("shared_cache")
+    backend = overrides.get("backend", SHARED_CACHE_BACKEND)
+    path = overrides.get("path", SHARED_CACHE_PATH)
+    if not backend:
+        return None
+    if backend == "sqlite":
+        cache = SQLiteSharedCache(path)
+    elif backend == "file":
+        cache = FileSharedCache(path)
+    else:
+        module_name, _, class_name = backend.rpartition(".")
+        cache = getattr(importlib.import_module(module_name), class_name)(path)
+    logging.getLogger("quiz_app").info("Shared cache tier enabled: %s at %s", type(cache).__name__, path)
+    return cache
+
+shared_cache = get_shared_cache()
+
+
+def shared_rate_limit(provider: str, cancel_event: Optional[threading.Event] = None, max_wait: float = SHARED_RATE_LIMIT_MAX_WAIT):
+    """
+    Wait for a cluster-wide token before calling provider, when the shared tier and a rate for it are configured.
+    Fails open: the call goes ahead after max_wait, once cancel_event is set, or if the shared tier errors.
+    """
+    rate = SHARED_LLM_CALLS_PER_MINUTE.get(provider)
+    if shared_cache is None or not rate:
+        return
+    give_up_at = time.time() + max_wait
+    while True:
+        try:
+            # Bursts of up to ten seconds' worth of calls are allowed
+            if shared_cache.take_token(f"llm.{provider}", rate / 60.0, capacity=max(1.0, rate / 6.0)):
+                return
+        except Exception as e:
+            llm_log.warning("Shared rate limit unavailable, not limiting %s: %s", provider, e)
+            return
+        if (cancel_event is not None and cancel_event.is_set()) or time.time() >= give_up_at:
+            return
+        time.sleep(0.05)
+
 # ===========================
 # Prompt Manager (from prompt_manager.py)
 # ===========================
 
-import json
-
 class PromptManager:
-    def __init__(self, credentials_dict: dict, sheets_manager=None):
-        """Initialize the prompt manager with Google credentials."""
-        self.credentials = Credentials.from_service_account_info(
-            credentials_dict,
-            scopes=['https://www.googleapis.com/auth/documents.readonly']
-        )
-        self.service = build('docs', 'v1', credentials=self.credentials)
+    def __init__(self, credentials_dict: Optional[dict], sheets_manager=None):
+        """Initialize the prompt manager with Google credentials (None: sheet prompts only, no Docs access)."""
+        self.service = None
+        if credentials_dict is not None:
+            self.credentials = Credentials.from_service_account_info(
+                credentials_dict,
+                scopes=['https://www.googleapis.com/auth/documents.readonly']
+            )
+            self.service = build('docs', 'v1', credentials=self.credentials)
         self.sheets_manager = sheets_manager
         self._prompts_cache = {}
+        self._prompt_versions = {}  # cache_key -> shared-tier version of the cached prompt
     
     def get_prompt_from_doc(self, doc_id: str, prompt_name: str) -> Optional[str]:
         """
@@ -110,6 +704,8 @@ class PromptManager:
         Returns:
             The prompt text or None if not found
         """
+        if self.service is None:
+            return None
         try:
             # Get the document content
             document = self.service.documents().get(documentId=doc_id).execute()
@@ -195,16 +791,16 @@ class PromptManager:
             The prompt text or None if not found
         """
         if not self.sheets_manager:
-            print(f"[DEBUG] sheets_manager is None, cannot fetch prompt for assignment {assignment_id}")
+            prompts_log.debug("sheets_manager is None, cannot fetch prompt for assignment %s", assignment_id)
             return None
             
         try:
             # Get the assignment record using the fetch method
-            print(f"[DEBUG] Fetching assignment {assignment_id} for prompt type {prompt_type}")
+            prompts_log.debug("Fetching assignment %s for prompt type %s", assignment_id, prompt_type)
             assignment = self.sheets_manager.assignments.fetch(assignment_id)
             
             if not assignment:
-                print(f"[DEBUG] No assignment found for ID {assignment_id}")
+                prompts_log.debug("No assignment found for ID %s", assignment_id)
                 return None
             
             # Map prompt type to column name
@@ -216,21 +812,19 @@ class PromptManager:
             
             column_name = column_map.get(prompt_type)
             if not column_name:
-                print(f"[DEBUG] Invalid prompt type: {prompt_type}")
+                prompts_log.debug("Invalid prompt type: %s", prompt_type)
                 return None
             
             prompt = assignment.get(column_name, "").strip()
             if prompt:
-                print(f"[DEBUG] Successfully loaded {prompt_type} prompt (length: {len(prompt)})")
+                prompts_log.debug("Successfully loaded %s prompt (length: %s)", prompt_type, len(prompt))
             else:
-                print(f"[DEBUG] No prompt found in column {column_name} for assignment {assignment_id}")
+                prompts_log.debug("No prompt found in column %s for assignment %s", column_name, assignment_id)
             return prompt if prompt else None
             
         except Exception as e:
             st.error(f"Error loading prompt from assignments sheet: {e}")
-            print(f"[DEBUG] Exception loading prompt: {e}")
-            import traceback
-            traceback.print_exc()
+            prompts_log.exception("Exception loading prompt: %s", e)
             return None
     
     def get_prompt_cached(self, assignment_id: str, prompt_type: str) -> Optional[str]:
@@ -238,22 +832,34 @@ class PromptManager:
         Only caches successful prompt fetches, not None values."""
         cache_key = f"assignment_{assignment_id}_{prompt_type}"
         
-        # Check if we have a cached value
-        if cache_key in self._prompts_cache:
+        # Check if we have a cached value (and, with a shared tier, that no replica has invalidated it)
+        if cache_key in self._prompts_cache and (
+            shared_cache is None or shared_cache.version("prompt", cache_key) == self._prompt_versions.get(cache_key)
+        ):
             cached_value = self._prompts_cache[cache_key]
-            print(f"[DEBUG] Using cached {prompt_type} prompt for assignment {assignment_id} (cached length: {len(cached_value) if cached_value else 'None'})")
+            prompts_log.debug("Using cached %s prompt for assignment %s (cached length: %s)", prompt_type, assignment_id, len(cached_value) if cached_value else 'None')
             return cached_value
         
+        # Another replica may already have fetched it
+        if shared_cache is not None:
+            entry = shared_cache.get("prompt", cache_key)
+            if entry and entry[1]:
+                self._prompt_versions[cache_key], self._prompts_cache[cache_key] = entry[0], entry[1]
+                prompts_log.debug("Using shared cached %s prompt for assignment %s", prompt_type, assignment_id)
+                return entry[1]
+        
         # Fetch fresh prompt
-        print(f"[DEBUG] Cache miss - fetching fresh {prompt_type} prompt for assignment {assignment_id}")
+        prompts_log.debug("Cache miss - fetching fresh %s prompt for assignment %s", prompt_type, assignment_id)
         prompt = self.get_prompt_from_assignment(assignment_id, prompt_type)
         
         # Only cache if we successfully got a prompt (not None or empty)
         if prompt:
             self._prompts_cache[cache_key] = prompt
-            print(f"[DEBUG] Cached {prompt_type} prompt for assignment {assignment_id}")
+            if shared_cache is not None:
+                self._prompt_versions[cache_key] = shared_cache.set("prompt", cache_key, prompt)
+            prompts_log.debug("Cached %s prompt for assignment %s", prompt_type, assignment_id)
         else:
-            print(f"[DEBUG] Not caching empty/None prompt for {prompt_type} assignment {assignment_id}")
+            prompts_log.debug("Not caching empty/None prompt for %s assignment %s", prompt_type, assignment_id)
         
         return prompt
 
@@ -351,22 +957,40 @@ def get_orchestration_text() -> Dict[str, str]:
     }
 
 
-def get_grading_output_format(question_num: int) -> str:
-    """Get the required JSON output format for grading a single question."""
-    return f"""{{
-    "score{question_num}": <integer from 0-10>,
-    "feedback{question_num}": "<detailed feedback string>"
-}}"""
+@lru_cache(maxsize=32)
+def get_grading_output_format(question_num: int) -> type[BaseModel]:
+    """Get the output schema for grading a single question."""
+    return create_model(
+        f"GradingOutputQ{question_num}",
+        **{
+            f"score{question_num}": (int, Field(ge=0, le=10, description="integer from 0-10")),
+            f"feedback{question_num}": (str, Field(description="detailed feedback string")),
+        }
+    )
 
 
-def get_evaluation_output_format(num_questions: int) -> str:
-    """Get the required JSON output format for evaluation of multiple questions."""
-    fields = []
-    for i in range(1, num_questions + 1):
-        fields.append(f'    "new_score{i}": <integer from 0-10>,')
-        fields.append(f'    "new_feedback{i}": "<enhanced feedback string>"{"," if i < num_questions else ""}')
-    
-    return "{\n" + "\n".join(fields) + "\n}" 
+@lru_cache(maxsize=32)
+def get_evaluation_output_format(question_nums: tuple[int, ...]) -> type[BaseModel]:
+    """Get the output schema for evaluation of a set of questions."""
+    fields = {}
+    for i in question_nums:
+        fields[f"new_score{i}"] = (int, Field(ge=0, le=10, description="integer from 0-10"))
+        fields[f"new_feedback{i}"] = (str, Field(description="enhanced feedback string"))
+    return create_model(f"EvaluationOutputQ{'_'.join(str(i) for i in question_nums)}", **fields)
+
+
+def render_output_format(schema: type[BaseModel]) -> str:
+    """Render an output schema as the JSON skeleton shown in the <output_format> prompt section."""
+    lines = []
+    fields = list(schema.model_fields.items())
+    for idx, (name, field) in enumerate(fields):
+        if field.annotation is int:
+            placeholder = f"<{field.description}>"
+        else:
+            placeholder = f'"<{field.description}>"'
+        lines.append(f'    "{name}": {placeholder}{"," if idx < len(fields) - 1 else ""}')
+    return "{\n" + "\n".join(lines) + "\n}"
+
 # ===========================
 # Main Application (from source_app.py)
 # ===========================
@@ -483,13 +1107,37 @@ def rerun():
     else:
         st.experimental_rerun()
 
+# Fragments rerun on their own when a widget inside them changes; older Streamlit renders them inline
+FRAGMENTS_AVAILABLE = hasattr(st, "fragment") or hasattr(st, "experimental_fragment")
+if hasattr(st, "fragment"):
+    fragment = st.fragment
+elif hasattr(st, "experimental_fragment"):
+    fragment = st.experimental_fragment
+else:
+    def fragment(func=None, **kwargs):
+        return func if func is not None else (lambda f: f)
+
+def rerun_fragment():
+    """Rerun only the enclosing fragment; a full rerun where fragment-scoped reruns are unsupported."""
+    try:
+        st.rerun(scope="fragment")
+    except (TypeError, StreamlitAPIException):
+        rerun()
+
 # Get credentials and initialize prompt manager
-OPENAI_API_KEY = get_openai_api_key()
-GCP_CREDENTIALS = get_gcp_credentials()
+if APP_BACKEND:
+    offline_backend = importlib.import_module(APP_BACKEND)
+    OPENAI_API_KEY = "offline"
+    GCP_CREDENTIALS = None
+else:
+    OPENAI_API_KEY = get_openai_api_key()
+    GCP_CREDENTIALS = get_gcp_credentials()
 
 # Get Gemini API key if using Gemini
 GEMINI_API_KEY = None
-if LLM_PROVIDER == "gemini":
+if APP_BACKEND:
+    GEMINI_API_KEY = "offline"
+elif LLM_PROVIDER == "gemini":
     try:
         GEMINI_API_KEY = get_gemini_api_key()
     except:
@@ -502,10 +1150,14 @@ prompt_manager = None
 # Generic Google Sheets wrapper with caching
 class Sheet:
     def __init__(self, client, title: str, headers: list[str]):
+        self.title = title
         self.headers = headers
         self._cache = {}
         self._cache_timestamp = 0
         self._cache_ttl = 10  # Cache for only 10 seconds to ensure fresher data
+        self._write_versions = {}  # (student_id, assignment_id) -> rows appended by this process
+        self._versions_lock = threading.Lock()
+        self._shared_version = 0  # Shared-tier version of the records in self._cache
         ss = client.open(SPREADSHEET_NAME)
         try:
             self.ws = ss.worksheet(title)
@@ -513,11 +1165,23 @@ class Sheet:
             self.ws = ss.add_worksheet(title=title, rows="1000", cols=str(len(headers)))
             self.ws.append_row(headers)
 
+    @tracer.traced("sheets.get_all")
     def get_all(self) -> list[dict]:
         """Get all records with caching."""
         current_time = time.time()
-        if (current_time - self._cache_timestamp) < self._cache_ttl and self._cache:
+        if (current_time - self._cache_timestamp) < self._cache_ttl and self._cache and self._shared_current():
+            tracer.annotate(sheet=self.title, cache_hit=True)
             return self._cache
+        # Another replica may have fetched the sheet recently
+        if shared_cache is not None:
+            entry = shared_cache.get("sheet", self.title)
+            if entry and current_time - entry[2] < self._cache_ttl:
+                self._shared_version, self._cache, self._cache_timestamp = entry
+                tracer.annotate(sheet=self.title, cache_hit=True, shared_hit=True)
+                return self._cache
+        tracer.annotate(sheet=self.title, cache_hit=False)
+        # Version before reading; if a writer invalidates the sheet meanwhile, this read may miss its row
+        fetch_version = shared_cache.version("sheet", self.title) if shared_cache is not None else 0
         
         # Fetch fresh data
         try:
@@ -529,40 +1193,93 @@ class Sheet:
             # If there are empty headers, use expected_headers parameter
             if len(filtered_headers) < len(actual_headers):
                 empty_count = len(actual_headers) - len(filtered_headers)
-                print(f"[DEBUG] Found {empty_count} empty header(s) in sheet, using expected_headers parameter")
+                sheets_log.debug("Found %s empty header(s) in sheet, using expected_headers parameter", empty_count)
                 self._cache = self.ws.get_all_records(expected_headers=self.headers)
             else:
                 self._cache = self.ws.get_all_records()
             self._cache_timestamp = current_time
         except Exception as e:
-            print(f"[ERROR] get_all_records() failed: {e}")
+            sheets_log.error("get_all_records() failed: %s", e)
             # If there's a header uniqueness issue, try with expected_headers parameter
             try:
-                print(f"[DEBUG] Attempting get_all_records() with expected_headers")
+                sheets_log.debug("Attempting get_all_records() with expected_headers")
                 self._cache = self.ws.get_all_records(expected_headers=self.headers)
                 self._cache_timestamp = current_time
-                print(f"[DEBUG] Successfully fetched records with expected_headers parameter")
+                sheets_log.debug("Successfully fetched records with expected_headers parameter")
             except Exception as e2:
-                print(f"[ERROR] get_all_records() with expected_headers also failed: {e2}")
+                sheets_log.error("get_all_records() with expected_headers also failed: %s", e2)
                 # Last resort: check actual headers
                 try:
                     actual_headers = self.ws.row_values(1)
-                    print(f"[ERROR] Actual headers from sheet: {actual_headers}")
+                    sheets_log.error("Actual headers from sheet: %s", actual_headers)
                     from collections import Counter
                     header_counts = Counter(actual_headers)
                     duplicates = [h for h, c in header_counts.items() if c > 1 and h != '']
                     empty_count = actual_headers.count('')
                     if duplicates:
-                        print(f"[ERROR] ❌ DUPLICATE HEADERS IN GOOGLE SHEET: {duplicates}")
+                        sheets_log.error("❌ DUPLICATE HEADERS IN GOOGLE SHEET: %s", duplicates)
                     if empty_count > 0:
-                        print(f"[ERROR] ❌ EMPTY COLUMN HEADERS IN GOOGLE SHEET: {empty_count} empty headers")
+                        sheets_log.error("❌ EMPTY COLUMN HEADERS IN GOOGLE SHEET: %s empty headers", empty_count)
                 except Exception as e3:
-                    print(f"[ERROR] Could not diagnose header issue: {e3}")
+                    sheets_log.error("Could not diagnose header issue: %s", e3)
                 self._cache = []
                 self._cache_timestamp = current_time
         
+        if shared_cache is not None and self._cache:
+            # Publish only if nothing changed since the read started; otherwise the next get_all reads again
+            published = shared_cache.set_if_version("sheet", self.title, self._cache, fetch_version)
+            self._shared_version = published if published is not None else fetch_version
         return self._cache
 
+    @tracer.traced("sheets.get_records_since")
+    def get_records_since(self, row_count: int) -> tuple[list[dict], int]:
+        """
+        Records after the first row_count data rows, plus the sheet's current number of data rows.
+        Rows are only ever appended, so this reads just the new ones: from the cache when it is fresh,
+        otherwise with one range read.
+        """
+        if row_count == 0:
+            # A full read; get_all caches it for the rest of the rerun
+            records = self.get_all()
+            return records, len(records)
+        current_time = time.time()
+        # A cached copy shorter than row_count predates rows another process appended
+        if ((current_time - self._cache_timestamp) < self._cache_ttl and len(self._cache) >= row_count and self._cache
+                and self._shared_current()):
+            tracer.annotate(sheet=self.title, cache_hit=True)
+            return self._cache[row_count:], len(self._cache)
+        tracer.annotate(sheet=self.title, cache_hit=False, from_row=row_count)
+        try:
+            headers = self.ws.row_values(1)
+            first_cell = gspread.utils.rowcol_to_a1(row_count + 2, 1)
+            last_column = gspread.utils.rowcol_to_a1(1, len(headers))[:-1]
+            rows = self.ws.get_values(f"{first_cell}:{last_column}")
+            records = [
+                dict(zip(headers, gspread.utils.numericise_all(row + [""] * (len(headers) - len(row)))))
+                for row in rows
+            ]
+            return records, row_count + len(rows)
+        except Exception as e:
+            sheets_log.error("Range read of %s from row %s failed, reading the whole sheet: %s", self.title, row_count + 2, e)
+            records = self.get_all()
+            return records[row_count:], len(records)
+
+    def _shared_current(self) -> bool:
+        """False once another replica has refreshed or invalidated this sheet (always True without a shared tier)."""
+        return shared_cache is None or shared_cache.version("sheet", self.title) == self._shared_version
+
+    def invalidate_cache(self):
+        """Drop the cached records here and, with a shared tier, on every replica."""
+        self._cache = {}
+        self._cache_timestamp = 0
+        if shared_cache is not None:
+            shared_cache.invalidate("sheet", self.title)
+
+    def write_version(self, student_id: str, assignment_id: str) -> int:
+        """How many rows for this student/assignment were appended through this process; a free change probe."""
+        with self._versions_lock:
+            return self._write_versions.get((student_id.strip(), assignment_id.strip()), 0)
+
     def is_duplicate(self, data: dict[str, any]) -> bool:
         # Only check for duplicates based on unique keys (e.g., execution_id, assignment_id, student_id)
         # If all keys in headers are present and match, consider it a duplicate
@@ -571,25 +1288,29 @@ class Sheet:
                 return True
         return False
 
+    @tracer.traced("sheets.append_row")
     def append_row(self, data: dict[str, Any]) -> None:
+        tracer.annotate(sheet=self.title)
         try:
             if not self.is_duplicate(data):
                 row = [data.get(h, "") for h in self.headers]
                 # Debug: Show first 10 values being written in order
-                print(f"[DEBUG] Writing row with {len(row)} values in order: {row[:10]}...")
+                sheets_log.debug("Writing row with %s values in order: %s...", len(row), row[:10])
                 self.ws.append_row(row)
                 # Invalidate cache after successful write
-                self._cache = {}
-                self._cache_timestamp = 0
-                print(f"[DEBUG] Cache invalidated after successful write")
+                self.invalidate_cache()
+                key = (str(data.get("student_id", "")).strip(), str(data.get("assignment_id", "")).strip())
+                with self._versions_lock:
+                    self._write_versions[key] = self._write_versions.get(key, 0) + 1
+                sheets_log.debug("Cache invalidated after successful write")
         except Exception as e:
-            print(f"[ERROR] Failed to append row: {e}")
+            sheets_log.error("Failed to append row: %s", e)
             # Try to diagnose the issue
             try:
                 actual_headers = self.ws.row_values(1)
-                print(f"[DEBUG] Expected {len(self.headers)} columns, sheet has {len(actual_headers)} columns")
-                print(f"[DEBUG] Expected headers: {self.headers}")
-                print(f"[DEBUG] Actual headers: {actual_headers}")
+                sheets_log.debug("Expected %s columns, sheet has %s columns", len(self.headers), len(actual_headers))
+                sheets_log.debug("Expected headers: %s", self.headers)
+                sheets_log.debug("Actual headers: %s", actual_headers)
             except:
                 pass
             raise  # Re-raise the exception after logging
@@ -630,6 +1351,63 @@ class StudentAssignmentsSheet(Sheet):
             "student_id", "student_first_name", "student_last_name",
             "assignment_id", "assignment_due", "started", "completed", "priority"
         ])
+        self._catalog = (None, {}, {})  # (records it was built from, by student_id, by (student_id, assignment_id))
+
+    def catalog(self) -> tuple[Dict[str, List[Dict[str, Any]]], Dict[tuple, Dict[str, Any]]]:
+        """
+        Index of the sheet, rebuilt only when get_all() returns a refreshed record list.
+        Returns (by_student, by_key): each student's entries pre-sorted by priority (highest first) then
+        due date (soonest first), and the first entry for each (student_id, assignment_id). An entry holds
+        the record, its sheet row number, the parsed due date and priority, and the completed flag.
+        """
+        records = self.get_all()
+        source, by_student, by_key = self._catalog
+        if source is records:
+            return by_student, by_key
+        
+        by_student, by_key = {}, {}
+        for i, rec in enumerate(records):
+            sid = str(rec.get("student_id", "")).strip()
+            aid = str(rec.get("assignment_id", "")).strip()
+            
+            # Parse due date
+            due_str = str(rec.get("assignment_due", "")).strip()
+            due = None
+            for fmt in ("%Y-%m-%d", "%m/%d/%Y"):  # ISO or US
+                try:
+                    due = datetime.datetime.strptime(due_str, fmt).date()
+                    break
+                except ValueError:
+                    due = None
+            
+            # Parse priority (default to 0 if not set)
+            try:
+                priority = int(rec.get("priority", 0)) if rec.get("priority") else 0
+            except (ValueError, TypeError):
+                priority = 0
+            
+            entry = {
+                "record": rec,
+                "row": i + 2,  # +2 because sheets are 1-indexed and we have a header row
+                "assignment_id": aid,
+                "due_date": due,
+                "priority": priority,
+                "completed": str(rec.get("completed", "FALSE")).strip().upper() == "TRUE"
+            }
+            by_student.setdefault(sid, []).append(entry)
+            by_key.setdefault((sid, aid), entry)
+        
+        # Sort by priority (descending), then by due date (ascending); stable, so sheet order breaks ties
+        for entries in by_student.values():
+            entries.sort(key=lambda x: (-x["priority"], x["due_date"] if x["due_date"] else datetime.date.max))
+        
+        self._catalog = (records, by_student, by_key)
+        sheets_log.debug("Built student assignment catalog: %s students, %s rows", len(by_student), len(records))
+        return by_student, by_key
+
+    def lookup(self, student_id: str, assignment_id: str) -> Optional[Dict[str, Any]]:
+        """Catalog entry for a student's assignment, or None if it is not assigned to them."""
+        return self.catalog()[1].get((student_id.strip(), assignment_id.strip()))
 
     def fetch_current(self, student_id: str) -> dict[str, Any]:
         """
@@ -643,68 +1421,27 @@ class StudentAssignmentsSheet(Sheet):
         5. Return the top assignment
         """
         sid = student_id.strip()
-        today = datetime.date.today()
-        
-        # Get all assignments for this student
-        student_assignments = []
-        for rec in self.get_all():
-            if str(rec.get("student_id", "")).strip() == sid:
-                aid = str(rec.get("assignment_id", "")).strip()
-                
-                # Exclude debate assignments (ending with _da)
-                if aid.endswith("_da"):
-                    print(f"[DEBUG] Skipping debate assignment: {aid}")
-                    continue
-                
-                # Only include incomplete assignments
-                completed_status = str(rec.get("completed", "FALSE")).strip().upper()
-                if completed_status == "TRUE":
-                    print(f"[DEBUG] Skipping completed assignment: {aid}")
-                    continue
-                
-                # Parse due date
-                due_str = str(rec.get("assignment_due", "")).strip()
-                due = None
-                for fmt in ("%Y-%m-%d", "%m/%d/%Y"):  # ISO or US
-                    try:
-                        due = datetime.datetime.strptime(due_str, fmt).date()
-                        break
-                    except ValueError:
-                        due = None
-                
-                # Parse priority (default to 0 if not set)
-                try:
-                    priority = int(rec.get("priority", 0)) if rec.get("priority") else 0
-                except (ValueError, TypeError):
-                    priority = 0
-                
-                student_assignments.append({
-                    "record": rec,
-                    "assignment_id": aid,
-                    "due_date": due,
-                    "priority": priority
-                })
-        
-        if not student_assignments:
-            print(f"[DEBUG] No eligible assignments found for student {sid}")
-            return {}
-        
-        # Sort by priority (descending), then by due date (ascending)
-        student_assignments.sort(key=lambda x: (-x["priority"], x["due_date"] if x["due_date"] else datetime.date.max))
         
-        selected = student_assignments[0]
-        print(f"[DEBUG] Selected assignment: {selected['assignment_id']} (priority={selected['priority']}, due={selected['due_date']})")
+        # The student's entries are already in priority/due order, so the first eligible one wins
+        for entry in self.catalog()[0].get(sid, []):
+            if entry["assignment_id"].endswith("_da") or entry["completed"]:
+                continue
+            sheets_log.debug("Selected assignment: %s (priority=%s, due=%s)", entry['assignment_id'], entry['priority'], entry['due_date'])
+            return entry["record"]
         
-        return selected["record"]
+        sheets_log.debug("No eligible assignments found for student %s", sid)
+        return {}
 
 class DataSheets:
-    def __init__(self, creds: dict):
-        scopes = [
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive"
-        ]
-        creds_obj = Credentials.from_service_account_info(creds, scopes=scopes)
-        client = gspread.authorize(creds_obj)
+    def __init__(self, creds: Optional[dict], client=None):
+        """Open every sheet through a gspread client, authorized from creds unless one is given."""
+        if client is None:
+            scopes = [
+                "https://www.googleapis.com/auth/spreadsheets",
+                "https://www.googleapis.com/auth/drive"
+            ]
+            creds_obj = Credentials.from_service_account_info(creds, scopes=scopes)
+            client = gspread.authorize(creds_obj)
         self.assignments = AssignmentsSheet(client)
         self.student_assignments = StudentAssignmentsSheet(client)
         
@@ -720,7 +1457,7 @@ class DataSheets:
         # Group feedback columns first, then score columns (to match Google Sheet format)
         grading_columns = feedback_columns + score_columns
         grading_headers = ["execution_id", "assignment_id", "student_id"] + grading_columns + ["timestamp"]
-        print(f"[INIT] Grading sheet headers (GROUPED format): {grading_headers[:10]}...{grading_headers[-5:]}")
+        sheets_log.debug("[INIT] Grading sheet headers (GROUPED format): %s...%s", grading_headers[:10], grading_headers[-5:])
         
         self.grading = Sheet(client, "feedback+grading", grading_headers)
         
@@ -730,7 +1467,7 @@ class DataSheets:
         # Group new_feedback columns first, then new_score columns (to match Google Sheet format)
         eval_columns = new_feedback_columns + new_score_columns
         eval_headers = ["execution_id", "assignment_id", "student_id"] + eval_columns + ["timestamp"]
-        print(f"[INIT] Evaluation sheet headers (GROUPED format): {eval_headers[:10]}...{eval_headers[-5:]}")
+        sheets_log.debug("[INIT] Evaluation sheet headers (GROUPED format): %s...%s", eval_headers[:10], eval_headers[-5:])
         
         self.evaluation = Sheet(client, "feedback_evaluation", eval_headers)
         
@@ -841,6 +1578,18 @@ class DataSheets:
         all_conversations.sort(key=lambda x: x.get("timestamp", ""))
         return all_conversations
     
+    def get_records_for_memory(self, sheet: "Sheet", student_id: str, assignment_id: str, row_count: int = 0) -> tuple[List[dict[str, Any]], int]:
+        """A student's records for an assignment among the rows after row_count (in timestamp order), plus the sheet's row count."""
+        sid = student_id.strip()
+        aid = assignment_id.strip()
+        records, total_rows = sheet.get_records_since(row_count)
+        matching = [
+            rec for rec in records
+            if str(rec.get("student_id", "")).strip() == sid and str(rec.get("assignment_id", "")).strip() == aid
+        ]
+        matching.sort(key=lambda x: x.get("timestamp", ""))
+        return matching, total_rows
+    
     # --- EXECUTION_ID-AWARE METHODS FOR CURRENT SESSION ---
     # These methods enforce execution_id matching to prevent cross-contamination between concurrent sessions
     
@@ -862,18 +1611,18 @@ class DataSheets:
                         latest_record = rec
             
             if latest_record:
-                print(f"[EXEC_ID] Found matching answer record for exec_id={eid}")
+                sheets_log.debug("[EXEC_ID] Found matching answer record for exec_id=%s", eid)
                 return latest_record
             
             # No matching record found - repoll
             if attempt < max_retries - 1:
-                print(f"[EXEC_ID] No matching answers for exec_id={eid}, repolling... (attempt {attempt + 1}/{max_retries})")
+                sheets_log.debug("[EXEC_ID] No matching answers for exec_id=%s, repolling... (attempt %s/%s)", eid, attempt + 1, max_retries)
                 time.sleep(0.5)  # Brief delay before repoll
                 # Force cache refresh
                 self.answers._cache = {}
                 self.answers._cache_timestamp = 0
         
-        print(f"[EXEC_ID] No matching answers found after {max_retries} attempts for exec_id={eid}")
+        sheets_log.debug("[EXEC_ID] No matching answers found after %s attempts for exec_id=%s", max_retries, eid)
         return {}
     
     def get_current_session_grading(self, execution_id: str, student_id: str, assignment_id: str, max_retries: int = 3) -> dict[str, Any]:
@@ -894,18 +1643,18 @@ class DataSheets:
                         latest_record = rec
             
             if latest_record:
-                print(f"[EXEC_ID] Found matching grading record for exec_id={eid}")
+                sheets_log.debug("[EXEC_ID] Found matching grading record for exec_id=%s", eid)
                 return latest_record
             
             # No matching record found - repoll
             if attempt < max_retries - 1:
-                print(f"[EXEC_ID] No matching grading for exec_id={eid}, repolling... (attempt {attempt + 1}/{max_retries})")
+                sheets_log.debug("[EXEC_ID] No matching grading for exec_id=%s, repolling... (attempt %s/%s)", eid, attempt + 1, max_retries)
                 time.sleep(0.5)
                 # Force cache refresh
                 self.grading._cache = {}
                 self.grading._cache_timestamp = 0
         
-        print(f"[EXEC_ID] No matching grading found after {max_retries} attempts for exec_id={eid}")
+        sheets_log.debug("[EXEC_ID] No matching grading found after %s attempts for exec_id=%s", max_retries, eid)
         return {}
     
     def get_current_session_conversations(self, execution_id: str, student_id: str, assignment_id: str) -> List[dict[str, Any]]:
@@ -921,45 +1670,34 @@ class DataSheets:
         
         # Sort by timestamp to maintain chronological order
         all_conversations.sort(key=lambda x: x.get("timestamp", ""))
-        print(f"[EXEC_ID] Found {len(all_conversations)} conversation(s) for exec_id={eid}")
+        sheets_log.debug("[EXEC_ID] Found %s conversation(s) for exec_id=%s", len(all_conversations), eid)
         return all_conversations
     
     def update_started_status(self, student_id: str, assignment_id: str, started: str):
         """Update the started status for a student assignment."""
-        sid = student_id.strip()
-        aid = assignment_id.strip()
-        
-        # Find the row to update
-        for i, rec in enumerate(self.student_assignments.get_all()):
-            if (str(rec.get("student_id", "")).strip() == sid and 
-                str(rec.get("assignment_id", "")).strip() == aid):
-                # Update the started field
-                row_num = i + 2  # +2 because sheets are 1-indexed and we have a header row
-                self.student_assignments.ws.update_cell(row_num, 6, started)  # Column 6 is "started"
-                print(f"[DEBUG] Updated started status to {started} for student {sid}, assignment {aid}")
-                break
+        entry = self.student_assignments.lookup(student_id, assignment_id)
+        if entry:
+            self.student_assignments.ws.update_cell(entry["row"], 6, started)  # Column 6 is "started"
+            # Keep the cached record in step, so reruns within the cache TTL see the assignment as started
+            entry["record"]["started"] = started
+            if shared_cache is not None:
+                shared_cache.invalidate("sheet", self.student_assignments.title)
+            sheets_log.debug("Updated started status to %s for student %s, assignment %s", started, student_id, assignment_id)
     
     def update_completed_status(self, student_id: str, assignment_id: str, completed: str):
         """Update the completed status for a student assignment."""
-        sid = student_id.strip()
-        aid = assignment_id.strip()
-        
-        # Find the row to update
-        for i, rec in enumerate(self.student_assignments.get_all()):
-            if (str(rec.get("student_id", "")).strip() == sid and 
-                str(rec.get("assignment_id", "")).strip() == aid):
-                # Update the completed field
-                row_num = i + 2  # +2 because sheets are 1-indexed and we have a header row
-                self.student_assignments.ws.update_cell(row_num, 7, completed)  # Column 7 is "completed"
-                print(f"[DEBUG] Updated completed status to {completed} for student {sid}, assignment {aid}")
-                # Invalidate cache
-                self.student_assignments._cache = {}
-                self.student_assignments._cache_timestamp = 0
-                break
+        entry = self.student_assignments.lookup(student_id, assignment_id)
+        if entry:
+            self.student_assignments.ws.update_cell(entry["row"], 7, completed)  # Column 7 is "completed"
+            sheets_log.debug("Updated completed status to %s for student %s, assignment %s", completed, student_id, assignment_id)
+            # Invalidate cache (the catalog is rebuilt with it)
+            self.student_assignments.invalidate_cache()
 
 # Initialize sheets
 @st.cache_resource(show_spinner="Loading...")
 def get_sheets() -> DataSheets:
+    if APP_BACKEND:
+        return DataSheets(None, client=offline_backend.sheets_client())
     return DataSheets(GCP_CREDENTIALS)
 
 sheets = get_sheets()
@@ -1055,14 +1793,34 @@ class AssignmentState(MessagesState):
     conversation_ready: bool
     
     # Legacy compatibility fields (for smooth transition)
-    question_contexts: Dict[str, str]  # Maintains question-specific context for backward compatibility
+    question_contexts: Dict[str, List[str]]  # Per-question fragments: [<question_text> header, <response_n>... entries]
+    context_versions: Dict[str, int]  # Bumped whenever a rendered context must be rebuilt rather than appended to
+    
+    # Running summary of messages that no longer fit the conversation context budget
+    conversation_summary: Dict[str, Any]  # {"text": "...", "upto": <index of first message not summarized>}
+    messages_trimmed: int  # Messages dropped by the size cap so far; anchors indexes taken before a trim
+    
+    # Per-question grading round counters and an append-only log of structured events
+    question_counters: Dict[str, int]  # {"q1": 2, "q5": 1}
+    events: List[Dict[str, Any]]  # [{"type": "answer" | "grading" | "conversation", ...}]
+    score_history: Dict[str, List[int]]  # Most recent scores per question, carried across compaction
 
 # Initialize memory system
 @st.cache_resource
 def get_memory_system():
-    """Initialize LangGraph memory system with persistence."""
+    """Initialize LangGraph memory system with persistence (SQLite when available, in-process otherwise)."""
+    if SQLITE_CHECKPOINTS_AVAILABLE:
+        conn = sqlite3.connect(CHECKPOINT_DB_PATH, check_same_thread=False)
+        memory_log.info("[MEMORY] Using SQLite checkpointer at %s", CHECKPOINT_DB_PATH)
+        return SqliteSaver(conn)
+    memory_log.info("[MEMORY] langgraph-checkpoint-sqlite not installed, assignment memory will not survive restarts")
     return MemorySaver()
 
+
+def checkpoint_config(student_id: str, assignment_id: str) -> dict:
+    """LangGraph config addressing the checkpoint thread for a student's assignment."""
+    return {"configurable": {"thread_id": f"{student_id.strip()}:{assignment_id.strip()}", "checkpoint_ns": ""}}
+
 memory_system = get_memory_system()
 
 # Global state manager for the assignment session
@@ -1072,12 +1830,16 @@ class AssignmentMemoryManager:
     def __init__(self):
         self.memory = memory_system
         self.current_state = None
+        # Held while the state is trimmed or serialized, and by background workers that write into it
+        self.lock = threading.RLock()
+        # Rendered contexts keyed by "q{n}" / "conversation": {"version", "count", "text"}
+        self._rendered = {}
     
     def initialize_assignment_session(self, exec_id: str, sid: str, aid: str, questions: Dict[str, str]) -> AssignmentState:
         """Initialize a new assignment session with variable number of questions."""
         # Initialize answers and question_contexts dynamically based on provided questions
         answers = {q_key: "" for q_key in questions.keys()}
-        question_contexts = {q_key: "" for q_key in questions.keys()}
+        question_contexts = {q_key: [""] for q_key in questions.keys()}
         
         state = {
             "messages": [SystemMessage(content=f"Assignment session for student {sid} with {len(questions)} questions")],
@@ -1094,62 +1856,125 @@ class AssignmentMemoryManager:
                 "num_questions": len(questions)
             },
             "conversation_ready": True,
-            "question_contexts": question_contexts
+            "question_contexts": question_contexts,
+            "conversation_summary": {"text": "", "upto": 0},
+            "messages_trimmed": 0,
+            "question_counters": {q_key: 0 for q_key in questions.keys()},
+            "events": [],
+            "context_versions": {},
+            "score_history": {}
         }
         self.current_state = state
+        self._rendered = {}
         return state
     
+    def _log_event(self, event_type: str, **fields):
+        """Append a structured event to the session's event log."""
+        self.current_state["events"].append({"type": event_type, "at": datetime.datetime.now().isoformat(), **fields})
+    
     def add_student_answer(self, question_num: str, answer: str):
         """Add a student's answer to the current state."""
         if self.current_state:
             self.current_state["answers"][f"q{question_num}"] = answer
+            self._log_event("answer", question=f"q{question_num}", answer=answer)
             # Add to conversation history
             self.current_state["messages"].append(HumanMessage(content=f"Student answered Q{question_num}: {answer[:100]}..."))
     
     def add_grading_result(self, question_num: str, score: int, feedback: str):
         """Add grading results for a question."""
         if self.current_state:
-            self.current_state["scores"][f"q{question_num}"] = score
-            self.current_state["feedback"][f"q{question_num}"] = feedback
+            q_key = f"q{question_num}"
+            self.current_state["scores"][q_key] = score
+            self.current_state["feedback"][q_key] = feedback
+            
+            # Per-question round counter: O(1), and Q1 no longer matches Q10-Q19
+            counters = self.current_state["question_counters"]
+            counters[q_key] = counters.get(q_key, 0) + 1
+            counter = counters[q_key]
+            self._log_event("grading", question=q_key, round=counter, score=score, feedback=feedback)
+            history = self.current_state.setdefault("score_history", {}).setdefault(q_key, [])
+            history.append(score)
+            del history[:-MEMORY_SNAPSHOT_SCORE_HISTORY]
             
             # Add to conversation history
             self.current_state["messages"].append(AIMessage(content=f"Q{question_num} graded: {score}/10 - {feedback[:100]}..."))
             
-            # Update question context for backward compatibility
-            q_key = f"q{question_num}"
-            if q_key not in self.current_state["question_contexts"]:
-                self.current_state["question_contexts"][q_key] = ""
-            
-            # Add response and feedback to question context (maintaining backward compatibility)
-            counter = len([msg for msg in self.current_state["messages"] if f"Q{question_num}" in msg.content])
+            # Append the response and feedback as a new fragment of the question context
             score_text = f" (Score: {score})"
-            new_content = f"<response_{counter}>{self.current_state['answers'][f'q{question_num}']}</response_{counter}><feedback_{counter}>{feedback}{score_text}</feedback_{counter}>"
-            self.current_state["question_contexts"][q_key] += new_content
+            new_content = f"<response_{counter}>{self.current_state['answers'].get(q_key, '')}</response_{counter}><feedback_{counter}>{feedback}{score_text}</feedback_{counter}>"
+            self.current_state["question_contexts"].setdefault(q_key, [""]).append(new_content)
     
     def add_conversation(self, question: str, response: str):
         """Add a conversation exchange to the memory."""
         if self.current_state:
+            self._log_event("conversation", question=question, response=response)
             # Add to conversation history
             self.current_state["messages"].append(HumanMessage(content=question))
             self.current_state["messages"].append(AIMessage(content=response))
     
+    def _bump_context_version(self, key: str):
+        """Invalidate the rendered context for a question or the conversation."""
+        versions = self.current_state.setdefault("context_versions", {})
+        versions[key] = versions.get(key, 0) + 1
+    
+    def _render_incremental(self, key: str, parts: List[str], separator: str) -> str:
+        """Join parts, reusing the cached rendering and appending only parts added since it was built."""
+        version = self.current_state.get("context_versions", {}).get(key, 0)
+        cached = self._rendered.get(key)
+        if cached is None or cached["version"] != version or cached["count"] > len(parts):
+            cached = {"version": version, "count": len(parts), "text": separator.join(parts)}
+        elif cached["count"] < len(parts):
+            new_text = separator.join(parts[cached["count"]:])
+            cached = {
+                "version": version,
+                "count": len(parts),
+                "text": cached["text"] + separator + new_text if cached["count"] else new_text,
+            }
+        self._rendered[key] = cached
+        return cached["text"]
+    
+    def set_question_header(self, question_num: str, question_text: str):
+        """Set a question's <question_text> header, keeping its graded history."""
+        if not self.current_state:
+            return
+        q_key = f"q{question_num}"
+        header = f"<question_text>{question_text}</question_text>"
+        fragments = self.current_state["question_contexts"].setdefault(q_key, [""])
+        if fragments[0] != header:
+            fragments[0] = header
+            self._bump_context_version(q_key)
+    
     def get_question_context(self, question_num: str) -> str:
         """Get question-specific context (backward compatibility)."""
         if self.current_state:
-            return self.current_state["question_contexts"].get(f"q{question_num}", "")
+            q_key = f"q{question_num}"
+            fragments = self.current_state["question_contexts"].get(q_key)
+            if not fragments:
+                return ""
+            return self._render_incremental(q_key, fragments, "")
         return ""
     
     def get_conversation_context(self) -> str:
         """Get conversation context from messages (backward compatibility)."""
         if self.current_state:
-            # Convert messages to conversation context format for backward compatibility
-            conversation_parts = []
-            for msg in self.current_state["messages"]:
+            messages = self.current_state["messages"]
+            version = self.current_state.get("context_versions", {}).get("conversation", 0)
+            cached = self._rendered.get("conversation")
+            if cached is None or cached["version"] != version or cached["count"] > len(messages):
+                cached = {"version": version, "count": 0, "text": ""}
+            # Convert only messages added since the last call; the rendered prefix is reused
+            new_parts = []
+            for msg in messages[cached["count"]:]:
                 if isinstance(msg, HumanMessage):
-                    conversation_parts.append(f"Student: {msg.content}")
+                    new_parts.append(f"Student: {msg.content}")
                 elif isinstance(msg, AIMessage):
-                    conversation_parts.append(f"AI: {msg.content}")
-            return "\n".join(conversation_parts)
+                    new_parts.append(f"AI: {msg.content}")
+            if new_parts:
+                new_text = "\n".join(new_parts)
+                cached["text"] = f"{cached['text']}\n{new_text}" if cached["text"] else new_text
+            cached["count"] = len(messages)
+            self._rendered["conversation"] = cached
+            return cached["text"]
         return ""
     
     def get_full_conversation_history(self) -> List:
@@ -1161,49 +1986,320 @@ class AssignmentMemoryManager:
     def clear_session(self):
         """Clear the current session."""
         self.current_state = None
+        self._rendered = {}
     
     def get_current_state(self) -> AssignmentState:
         """Get the current assignment state."""
         return self.current_state
-
-# Initialize assignment memory manager
-@st.cache_resource
-def get_assignment_memory_manager():
-    return AssignmentMemoryManager()
-
-assignment_memory = get_assignment_memory_manager()
-
-def load_previous_session_data(student_id: str, assignment_id: str) -> tuple[Dict[str, str], Dict[str, Any], str]:
-    """
-    Load previous session data for a student and assignment.
-    Returns: (previous_answers, previous_feedback, latest_conversation_response)
     
-    Note: No caching to ensure fresh data on every page load/refresh
-    """
-    try:
-        print(f"[SESSION RESTORE] Loading FRESH data for student {student_id}, assignment {assignment_id}")
-        
-        # Get all data in one go to minimize API calls
-        all_answers = sheets.get_all_answers_for_memory(student_id, assignment_id)
-        all_grading = sheets.get_all_grading_for_memory(student_id, assignment_id)
-        all_conversations = sheets.get_all_conversations_for_memory(student_id, assignment_id)
+    def enforce_size_cap(self):
+        """Drop the oldest messages and question-context entries once the session exceeds its size cap."""
+        if not self.current_state:
+            return
+        with self.lock:
+            messages = self.current_state["messages"]
+            overflow = len(messages) - MEMORY_MAX_MESSAGES_PER_SESSION
+            if overflow > 0:
+                # Keep the session's system message at index 0
+                del messages[1:overflow + 1]
+                self.current_state["messages_trimmed"] = self.current_state.get("messages_trimmed", 0) + overflow
+                self._bump_context_version("conversation")
+                summary = self.current_state.get("conversation_summary")
+                if summary:
+                    summary["upto"] = max(0, summary["upto"] - overflow)
         
-        # Find the most recent answers record
-        latest_answers = {}
-        if all_answers:
-            latest_answers = max(all_answers, key=lambda x: x.get("timestamp", ""))
-            print(f"[DEBUG] Latest answers record: {latest_answers}")
+            events = self.current_state.get("events", [])
+            if len(events) > MEMORY_MAX_MESSAGES_PER_SESSION:
+                del events[:len(events) - MEMORY_MAX_MESSAGES_PER_SESSION]
         
-        # Find the matching feedback record with the same execution_id
-        matching_feedback = {}
-        if latest_answers and all_grading:
-            execution_id = latest_answers.get("execution_id")
-            print(f"[DEBUG] Looking for feedback with execution_id: {execution_id}")
-            
-            for grading_record in all_grading:
-                if grading_record.get("execution_id") == execution_id:
-                    matching_feedback = grading_record
-                    print(f"[DEBUG] Found matching feedback record: {matching_feedback}")
+            for q_key, fragments in self.current_state["question_contexts"].items():
+                total = sum(len(f) for f in fragments)
+                if total > MEMORY_MAX_CONTEXT_CHARS:
+                    # Keep the <question_text> header at index 0 and drop the oldest graded entries
+                    while len(fragments) > 1 and total > MEMORY_MAX_CONTEXT_CHARS:
+                        total -= len(fragments.pop(1))
+                    self._bump_context_version(q_key)
+    
+    @tracer.traced("memory.save_checkpoint")
+    def save_checkpoint(self):
+        """Cap the session size and persist the state under (student_id, assignment_id)."""
+        if not self.current_state:
+            return
+        with self.lock:
+            self.enforce_size_cap()
+            config = checkpoint_config(self.current_state["student_id"], self.current_state["assignment_id"])
+            checkpoint = empty_checkpoint()
+            checkpoint["channel_values"] = dict(self.current_state)
+            try:
+                # Only the latest checkpoint is ever read, so replace rather than accumulate history
+                self.memory.delete_thread(config["configurable"]["thread_id"])
+                # Savers that store channel values per version (MemorySaver) only keep the channels listed here
+                version = self.memory.get_next_version(None, None)
+                new_versions = {channel: version for channel in checkpoint["channel_values"]}
+                checkpoint["channel_versions"] = dict(new_versions)
+                self.memory.put(config, checkpoint, {"source": "update", "step": -1, "parents": {}}, new_versions)
+            except Exception as e:
+                memory_log.error("Failed to save memory checkpoint: %s", e)
+            if shared_cache is not None:
+                # Mirrored so a student's next rerun can land on any replica
+                try:
+                    shared_state = dict(self.current_state, messages=messages_to_dict(self.current_state["messages"]))
+                    shared_cache.set("memory", config["configurable"]["thread_id"], shared_state)
+                except Exception as e:
+                    memory_log.error("Failed to share memory checkpoint: %s", e)
+    
+    @tracer.traced("memory.restore_checkpoint")
+    def restore_checkpoint(self, exec_id: str, sid: str, aid: str, questions: Optional[Dict[str, str]]) -> bool:
+        """
+        Load a student's saved assignment state with one indexed read. Returns False if there is none.
+        questions=None keeps the saved questions.
+        """
+        config = checkpoint_config(sid, aid)
+        state = self._restore_shared(config["configurable"]["thread_id"])
+        if state is None:
+            try:
+                saved = self.memory.get_tuple(config)
+            except Exception as e:
+                memory_log.error("Failed to read memory checkpoint: %s", e)
+                return False
+            if not saved or not saved.checkpoint.get("channel_values", {}).get("messages"):
+                return False
+            state = dict(saved.checkpoint["channel_values"])
+        
+        # The restored history belongs to this new execution; questions may have been edited since
+        state["execution_id"] = exec_id
+        if questions is not None:
+            state["questions"] = questions
+        questions = state["questions"]
+        for q_key, context in state["question_contexts"].items():
+            if isinstance(context, str):
+                # Checkpoints written before contexts were kept as fragments
+                header, _, history = context.partition("<response_")
+                entries = re.split(r"(?=<response_\d+>)", "<response_" + history) if history else []
+                state["question_contexts"][q_key] = [header] + [e for e in entries if e]
+        for q_key in questions:
+            state["answers"].setdefault(q_key, "")
+            state["question_contexts"].setdefault(q_key, [""])
+        state.setdefault("conversation_summary", {"text": "", "upto": 0})
+        state.setdefault("messages_trimmed", 0)
+        state.setdefault("question_counters", {})
+        state.setdefault("events", [])
+        state.setdefault("context_versions", {})
+        state.setdefault("score_history", {})
+        self.current_state = state
+        self._rendered = {}
+        memory_log.info("[MEMORY] Restored checkpoint for student %s, assignment %s (%s messages)", sid, aid, len(state['messages']))
+        return True
+    
+    def _restore_shared(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """The session state another replica last saved for thread_id, or None (also without a shared tier)."""
+        if shared_cache is None:
+            return None
+        try:
+            entry = shared_cache.get("memory", thread_id)
+            if not entry or not entry[1].get("messages"):
+                return None
+            return dict(entry[1], messages=messages_from_dict(entry[1]["messages"]))
+        except Exception as e:
+            memory_log.error("Failed to read shared memory checkpoint: %s", e)
+            return None
+    
+    def build_snapshot(self, row_counts: Dict[str, int]) -> Dict[str, Any]:
+        """
+        Collapse the session into its latest answers and scores plus a bounded history summary.
+        row_counts holds, per source sheet, how many data rows the snapshot covers.
+        """
+        state = self.current_state
+        self.enforce_size_cap()
+        lines = []
+        for q_key, rounds in sorted(state["question_counters"].items(), key=lambda kv: int(kv[0][1:])):
+            scores = state.get("score_history", {}).get(q_key, [])
+            if rounds:
+                lines.append(f"{q_key.upper()}: {rounds} graded attempt(s), recent scores {' -> '.join(str(x) for x in scores)}")
+        conversation_summary = state.get("conversation_summary", {}).get("text", "")
+        if conversation_summary:
+            lines.append(f"Conversation so far: {conversation_summary}")
+        history_summary = "\n".join(lines)[:MEMORY_SNAPSHOT_SUMMARY_CHARS]
+        
+        recent = [[e["question"], e["response"]] for e in state["events"] if e["type"] == "conversation"]
+        return {
+            "answers": state["answers"],
+            "scores": state["scores"],
+            "feedback": state["feedback"],
+            "question_counters": state["question_counters"],
+            "score_history": state.get("score_history", {}),
+            "question_contexts": state["question_contexts"],
+            "history_summary": history_summary,
+            "recent_conversation": recent[-MEMORY_SNAPSHOT_RECENT_EXCHANGES:],
+            "rows": row_counts,
+            "compacted_at": datetime.datetime.now().isoformat()
+        }
+    
+    def apply_snapshot(self, snapshot: Dict[str, Any]):
+        """Seed the freshly initialized state from a compacted snapshot instead of replaying history."""
+        if not self.current_state:
+            return
+        state = self.current_state
+        state["answers"].update(snapshot.get("answers", {}))
+        state["scores"].update(snapshot.get("scores", {}))
+        state["feedback"].update(snapshot.get("feedback", {}))
+        state["question_counters"].update(snapshot.get("question_counters", {}))
+        state["score_history"] = snapshot.get("score_history", {})
+        for q_key, fragments in snapshot.get("question_contexts", {}).items():
+            # Keep the current question header; the snapshot's may predate an edit
+            current_header = state["question_contexts"].get(q_key, [""])[0]
+            state["question_contexts"][q_key] = [current_header or fragments[0]] + fragments[1:]
+            self._bump_context_version(q_key)
+        if snapshot.get("history_summary"):
+            state["messages"].append(AIMessage(content=f"Earlier session history (compacted): {snapshot['history_summary']}"))
+        for question, response in snapshot.get("recent_conversation", []):
+            self.add_conversation(question, response)
+    
+    def approx_size(self) -> int:
+        """Approximate memory held by this session's state, in bytes of text."""
+        if not self.current_state:
+            return 0
+        size = sum(len(msg.content) for msg in self.current_state["messages"])
+        size += sum(len(f) for fragments in self.current_state["question_contexts"].values() for f in fragments)
+        size += sum(len(str(v)) for v in self.current_state["answers"].values())
+        size += sum(len(str(v)) for v in self.current_state["feedback"].values())
+        size += len(self.current_state.get("conversation_summary", {}).get("text", ""))
+        return size
+
+
+class SessionMemoryRegistry:
+    """
+    Bounded LRU of per-session AssignmentMemoryManagers keyed by execution_id, with idle-time eviction.
+    Eviction runs on every lookup and on a background sweep, so idle sessions go even when no one else arrives.
+    """
+    
+    def __init__(self, max_sessions: int = MEMORY_MAX_SESSIONS, idle_seconds: float = MEMORY_IDLE_SECONDS,
+                 sweep_seconds: float = MEMORY_SWEEP_SECONDS):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # {exec_id: [manager, last_used]}
+        threading.Thread(target=self._sweep_worker, args=(sweep_seconds,), daemon=True, name="memory-sweeper").start()
+    
+    def get(self, exec_id: str) -> AssignmentMemoryManager:
+        """Get (or create) the memory manager for a session and mark it as recently used."""
+        with self._lock:
+            now = time.time()
+            entry = self._sessions.get(exec_id)
+            if entry is None:
+                entry = [AssignmentMemoryManager(), now]
+                self._sessions[exec_id] = entry
+            entry[1] = now
+            self._sessions.move_to_end(exec_id)
+            self._evict(now)
+            return entry[0]
+    
+    def find(self, sid: str, aid: str) -> Optional[AssignmentMemoryManager]:
+        """The most recently used live manager holding this student's assignment, without marking it as used."""
+        with self._lock:
+            managers = [manager for manager, _ in reversed(self._sessions.values())]
+        for manager in managers:
+            state = manager.current_state
+            if state and state["student_id"].strip() == sid.strip() and state["assignment_id"].strip() == aid.strip():
+                return manager
+        return None
+    
+    def sweep(self):
+        """Evict idle and over-capacity sessions now."""
+        with self._lock:
+            self._evict(time.time())
+    
+    def _sweep_worker(self, interval: float):
+        while True:
+            time.sleep(interval)
+            self.sweep()
+    
+    def _evict(self, now: float):
+        # Oldest entries are at the front; stop at the first one that is still fresh
+        while self._sessions:
+            exec_id, (_, last_used) = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - last_used > self.idle_seconds:
+                self._sessions.popitem(last=False)
+                memory_log.info("[MEMORY] Evicted session memory for exec_id=%s", exec_id)
+            else:
+                break
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            managers = [manager for manager, _ in self._sessions.values()]
+        return {
+            "sessions": len(managers),
+            "approx_bytes": sum(manager.approx_size() for manager in managers)
+        }
+
+
+# Initialize per-session assignment memory
+@st.cache_resource
+def get_session_memory_registry():
+    return SessionMemoryRegistry()
+
+memory_registry = get_session_memory_registry()
+
+
+def current_session_memory() -> AssignmentMemoryManager:
+    """Memory manager for the current browser session (keyed by its execution_id)."""
+    return memory_registry.get(st.session_state['exec_id'])
+
+
+def record_grading_in_memory(exec_id: str, sid: str, aid: str, answers: Dict[str, str], grade_res: Dict[str, Any],
+                             question_nums: List[int]):
+    """
+    Record graded answers in the student's memory and checkpoint from the worker that graded them, so a
+    checkpoint restored later is complete even if no page was open to see the result. Goes into the student's
+    live session if there is one, otherwise into the saved checkpoint; without either, the next session replays
+    the grading sheet. answers holds the answers to record with the grades ({} if they already are).
+    """
+    manager = memory_registry.find(sid, aid)
+    if manager is None:
+        manager = AssignmentMemoryManager()
+        if not manager.restore_checkpoint(exec_id, sid, aid, None):
+            return
+    with manager.lock:
+        for q_key, answer in answers.items():
+            manager.add_student_answer(q_key.replace('q', ''), answer)
+        for q_num in question_nums:
+            score = grade_res.get(f'score{q_num}', '')
+            manager.add_grading_result(str(q_num), int(score) if str(score).isdigit() else 0, grade_res.get(f'feedback{q_num}', ''))
+        manager.save_checkpoint()
+
+@tracer.traced("phase.load_previous_session_data")
+def load_previous_session_data(student_id: str, assignment_id: str) -> tuple[Dict[str, str], Dict[str, Any], str]:
+    """
+    Load previous session data for a student and assignment.
+    Returns: (previous_answers, previous_feedback, latest_conversation_response)
+    
+    Note: No caching to ensure fresh data on every page load/refresh
+    """
+    try:
+        ui_log.debug("[SESSION RESTORE] Loading FRESH data for student %s, assignment %s", student_id, assignment_id)
+        
+        # Get all data in one go to minimize API calls
+        all_answers = sheets.get_all_answers_for_memory(student_id, assignment_id)
+        all_grading = sheets.get_all_grading_for_memory(student_id, assignment_id)
+        all_conversations = sheets.get_all_conversations_for_memory(student_id, assignment_id)
+        
+        # Find the most recent answers record
+        latest_answers = {}
+        if all_answers:
+            latest_answers = max(all_answers, key=lambda x: x.get("timestamp", ""))
+            ui_log.debug("Latest answers record: %s", latest_answers)
+        
+        # Find the matching feedback record with the same execution_id
+        matching_feedback = {}
+        if latest_answers and all_grading:
+            execution_id = latest_answers.get("execution_id")
+            ui_log.debug("Looking for feedback with execution_id: %s", execution_id)
+            
+            # Newest first: late questions re-graded in the background are written as a newer row
+            for grading_record in reversed(all_grading):
+                if grading_record.get("execution_id") == execution_id:
+                    matching_feedback = grading_record
+                    ui_log.debug("Found matching feedback record: %s", matching_feedback)
                     break
         
         # Find the most recent conversation record
@@ -1220,45 +2316,158 @@ def load_previous_session_data(student_id: str, assignment_id: str) -> tuple[Dic
                 answer_value = latest_answers[answer_key]
                 if answer_value:  # Only add non-empty answers
                     previous_answers[ui_key] = answer_value
-                    print(f"[DEBUG] Found {answer_key}: {answer_value[:50]}...")
+                    ui_log.debug("Found %s: %s...", answer_key, answer_value[:50])
             else:
-                print(f"[DEBUG] Missing {answer_key} in latest_answers")
+                ui_log.debug("Missing %s in latest_answers", answer_key)
         
         # Get latest conversation response for UI
         latest_conversation_response = latest_conversation.get("agent_msg", "") if latest_conversation else ""
         
-        print(f"[SESSION RESTORE] Found {len(all_answers)} answer records, {len(all_grading)} grading records, {len(all_conversations)} conversation records")
-        print(f"[SESSION RESTORE] Previous answers: {previous_answers}")
-        print(f"[SESSION RESTORE] Matching feedback: {matching_feedback}")
-        print(f"[SESSION RESTORE] Latest conversation response: {latest_conversation_response[:100]}..." if latest_conversation_response else "[SESSION RESTORE] No conversation response")
+        ui_log.debug("[SESSION RESTORE] Found %s answer records, %s grading records, %s conversation records", len(all_answers), len(all_grading), len(all_conversations))
+        ui_log.debug("[SESSION RESTORE] Previous answers: %s", previous_answers)
+        ui_log.debug("[SESSION RESTORE] Matching feedback: %s", matching_feedback)
+        ui_log.debug("[SESSION RESTORE] Latest conversation response: %.100s", latest_conversation_response or "(none)")
         
         return previous_answers, matching_feedback, latest_conversation_response
         
     except Exception as e:
-        print(f"[ERROR] Failed to load previous session data: {e}")
+        ui_log.error("Failed to load previous session data: %s", e)
         return {}, {}, ""
 
-def load_session_data_into_memory(student_id: str, assignment_id: str):
+def restore_previous_session(student_id: str, assignment_id: str) -> tuple[Dict[str, str], Dict[str, Any], str]:
+    """
+    load_previous_session_data, memoized in st.session_state so idle reruns (typing, widget changes)
+    do no Sheets work. Re-read once a row for this student/assignment is written through this process
+    (this session's submissions, conversations and late grading) or after SESSION_RESTORE_MAX_AGE,
+    which picks up edits made outside the app.
+    """
+    # Versions are read before loading, so a write landing mid-load still invalidates the result
+    versions = tuple(sheet.write_version(student_id, assignment_id)
+                     for sheet in (sheets.answers, sheets.grading, sheets.conversations))
+    memo = st.session_state.get('session_restore')
+    if (memo and memo['key'] == (student_id, assignment_id) and memo['versions'] == versions
+            and time.time() - memo['loaded_at'] < SESSION_RESTORE_MAX_AGE):
+        ui_log.debug("[SESSION RESTORE] Reusing memoized restore for student %s, assignment %s", student_id, assignment_id)
+        previous_answers, previous_feedback, latest_conversation_response = memo['data']
+    else:
+        previous_answers, previous_feedback, latest_conversation_response = load_previous_session_data(student_id, assignment_id)
+        # An empty result for a started assignment is usually a failed read (or a write still queued), so retry next rerun
+        if previous_answers or previous_feedback or latest_conversation_response:
+            st.session_state['session_restore'] = {
+                'key': (student_id, assignment_id),
+                'versions': versions,
+                'loaded_at': time.time(),
+                'data': (previous_answers, previous_feedback, latest_conversation_response)
+            }
+    # Copies, so the UI can adjust what it is given without touching the memo
+    return dict(previous_answers), dict(previous_feedback), latest_conversation_response
+
+class MemorySnapshotStore:
+    """Compacted memory snapshots keyed by (student_id, assignment_id), one row each in SQLite."""
+    
+    def __init__(self, db_path: str = CHECKPOINT_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS memory_snapshots ("
+                "student_id TEXT, assignment_id TEXT, snapshot TEXT, compacted_at TEXT, "
+                "PRIMARY KEY (student_id, assignment_id))"
+            )
+            self._conn.commit()
+    
+    def load(self, student_id: str, assignment_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            if shared_cache is not None:
+                entry = shared_cache.get("memory_snapshot", self._key(student_id, assignment_id))
+                if entry:
+                    return entry[1]
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT snapshot FROM memory_snapshots WHERE student_id = ? AND assignment_id = ?",
+                    (student_id.strip(), assignment_id.strip())
+                ).fetchone()
+            return json.loads(row[0]) if row else None
+        except Exception as e:
+            memory_log.error("Failed to read memory snapshot: %s", e)
+            return None
+    
+    def save(self, student_id: str, assignment_id: str, snapshot: Dict[str, Any]):
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO memory_snapshots VALUES (?, ?, ?, ?)",
+                    (student_id.strip(), assignment_id.strip(), json.dumps(snapshot), snapshot["compacted_at"])
+                )
+                self._conn.commit()
+            if shared_cache is not None:
+                shared_cache.set("memory_snapshot", self._key(student_id, assignment_id), snapshot)
+        except Exception as e:
+            memory_log.error("Failed to write memory snapshot: %s", e)
+    
+    def delete(self, student_id: str, assignment_id: str):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM memory_snapshots WHERE student_id = ? AND assignment_id = ?",
+                (student_id.strip(), assignment_id.strip())
+            )
+            self._conn.commit()
+        if shared_cache is not None:
+            shared_cache.invalidate("memory_snapshot", self._key(student_id, assignment_id))
+    
+    @staticmethod
+    def _key(student_id: str, assignment_id: str) -> str:
+        return f"{student_id.strip()}:{assignment_id.strip()}"
+
+
+@st.cache_resource
+def get_memory_snapshot_store():
+    return MemorySnapshotStore()
+
+snapshot_store = get_memory_snapshot_store()
+
+
+@tracer.traced("phase.load_session_data_into_memory")
+def load_session_data_into_memory(student_id: str, assignment_id: str, assignment_memory: Optional[AssignmentMemoryManager] = None):
     """
     Load all session data into memory system (separate from UI data loading).
-    This is called only once per session.
+    This is called only once per session. assignment_memory defaults to the current session's manager.
     """
     try:
-        print(f"[MEMORY LOAD] Loading data into memory for student {student_id}, assignment {assignment_id}")
+        memory_log.info("[MEMORY LOAD] Loading data into memory for student %s, assignment %s", student_id, assignment_id)
+        assignment_memory = assignment_memory or current_session_memory()
         
-        # Get all data for memory loading
-        all_answers = sheets.get_all_answers_for_memory(student_id, assignment_id)
-        all_grading = sheets.get_all_grading_for_memory(student_id, assignment_id)
-        all_conversations = sheets.get_all_conversations_for_memory(student_id, assignment_id)
+        # Start from the compacted snapshot and replay only the rows appended after it
+        snapshot = snapshot_store.load(student_id, assignment_id)
+        row_marks = snapshot.get("rows") if snapshot else None
+        if snapshot and row_marks is None:
+            memory_log.info("[MEMORY LOAD] Snapshot predates row watermarks, replaying the full history")
+            snapshot = None
         
-        # Load all answers and feedback into memory (supports up to 25 questions)
-        for answer_record in all_answers:
+        def read_new_records(marks: Dict[str, int]) -> tuple[Dict[str, List[dict]], Dict[str, int]]:
+            records, counts = {}, {}
+            for source, sheet in (("answers", sheets.answers), ("grading", sheets.grading), ("conversations", sheets.conversations)):
+                records[source], counts[source] = sheets.get_records_for_memory(sheet, student_id, assignment_id, marks.get(source, 0))
+            return records, counts
+        
+        new_records, row_counts = read_new_records(row_marks or {})
+        if snapshot and any(row_counts[source] < mark for source, mark in row_marks.items()):
+            # Rows were deleted from a sheet, so the snapshot's row counts no longer line up
+            memory_log.warning("[MEMORY LOAD] Sheets shrank since the snapshot, replaying the full history")
+            snapshot = None
+            new_records, row_counts = read_new_records({})
+        if snapshot:
+            assignment_memory.apply_snapshot(snapshot)
+        new_answers, new_grading, new_conversations = new_records["answers"], new_records["grading"], new_records["conversations"]
+        
+        # Load answers and feedback into memory (supports up to 25 questions)
+        for answer_record in new_answers:
             for i in range(1, 26):
                 answer_key = f"q{i}_answer"  # Use correct column name from Google Sheet
                 if answer_key in answer_record and answer_record[answer_key]:
                     assignment_memory.add_student_answer(str(i), answer_record[answer_key])
         
-        for grading_record in all_grading:
+        for grading_record in new_grading:
             for i in range(1, 26):
                 score_key = f"score{i}"
                 feedback_key = f"feedback{i}"
@@ -1268,29 +2477,37 @@ def load_session_data_into_memory(student_id: str, assignment_id: str):
                     if score and feedback:
                         assignment_memory.add_grading_result(str(i), int(score) if str(score).isdigit() else 0, feedback)
         
-        # Load all conversations into memory
-        for conv_record in all_conversations:
+        # Load conversations into memory
+        for conv_record in new_conversations:
             user_msg = conv_record.get("user_msg", "")
             agent_msg = conv_record.get("agent_msg", "")
             if user_msg and agent_msg:
                 assignment_memory.add_conversation(user_msg, agent_msg)
         
-        print(f"[MEMORY LOAD] Loaded {len(all_answers)} answer records, {len(all_grading)} grading records, {len(all_conversations)} conversation records into memory")
+        # Compact once the deltas since the last snapshot have grown enough to be worth folding in
+        deltas = len(new_answers) + len(new_grading) + len(new_conversations)
+        if snapshot is None or deltas >= MEMORY_COMPACT_AFTER_DELTAS:
+            snapshot_store.save(student_id, assignment_id, assignment_memory.build_snapshot(row_counts))
+            memory_log.info("[MEMORY LOAD] Compacted snapshot for student %s, assignment %s (%s new records folded in)", student_id, assignment_id, deltas)
+        
+        assignment_memory.save_checkpoint()
+        memory_log.info("[MEMORY LOAD] Applied %s%s answer, %s grading, %s conversation records", 'snapshot + ' if snapshot else '', len(new_answers), len(new_grading), len(new_conversations))
         
     except Exception as e:
-        print(f"[ERROR] Failed to load session data into memory: {e}")
+        memory_log.error("Failed to load session data into memory: %s", e)
 
 # Backward compatibility wrapper for existing code
 class ContextCache:
     """Backward compatibility wrapper that uses the new memory system."""
     
-    def __init__(self):
-        self.memory_manager = assignment_memory
+    @property
+    def memory_manager(self) -> AssignmentMemoryManager:
+        # Resolved per call so the shared wrapper always targets the current session
+        return current_session_memory()
     
     def initialize_question_cache(self, question_num: str, question_text: str):
         """Initialize question cache (maintains backward compatibility)."""
-        if self.memory_manager.current_state:
-            self.memory_manager.current_state["question_contexts"][f"q{question_num}"] = f"<question_text>{question_text}</question_text>"
+        self.memory_manager.set_question_header(question_num, question_text)
     
     def add_response_and_feedback(self, question_num: str, response: str, feedback: str, score: str = ""):
         """Add response and feedback (maintains backward compatibility)."""
@@ -1332,47 +2549,54 @@ class SimpleBackgroundWriter:
         def write_worker():
             sheet_obj = None
             try:
-                print(f"[WRITE] Starting write for {operation_type} with {len(data)} fields")
-                print(f"[WRITE] Data keys: {list(data.keys())[:15]}...")
+                sheets_log.debug("[WRITE] Starting write for %s with %s fields", operation_type, len(data))
+                sheets_log.debug("[WRITE] Data keys: %s...", list(data.keys())[:15])
                 
                 if operation_type == 'answers':
                     sheet_obj = self.sheets.answers
-                    print(f"[WRITE] Answers sheet expects {len(sheet_obj.headers)} columns")
+                    sheets_log.debug("[WRITE] Answers sheet expects %s columns", len(sheet_obj.headers))
                     sheet_obj.append_row(data)
                 elif operation_type == 'grading':
                     sheet_obj = self.sheets.grading
-                    print(f"[WRITE] Grading sheet expects {len(sheet_obj.headers)} columns")
-                    print(f"[WRITE] Grading sheet header order: {sheet_obj.headers[:10]}...{sheet_obj.headers[-5:]}")
+                    sheets_log.debug("[WRITE] Grading sheet expects %s columns", len(sheet_obj.headers))
+                    sheets_log.debug("[WRITE] Grading sheet header order: %s...%s", sheet_obj.headers[:10], sheet_obj.headers[-5:])
                     sheet_obj.append_row(data)
                 elif operation_type == 'evaluation':
                     sheet_obj = self.sheets.evaluation
-                    print(f"[WRITE] Evaluation sheet expects {len(sheet_obj.headers)} columns")
+                    sheets_log.debug("[WRITE] Evaluation sheet expects %s columns", len(sheet_obj.headers))
                     sheet_obj.append_row(data)
                 elif operation_type == 'conversations':
                     sheet_obj = self.sheets.conversations
                     sheet_obj.append_row(data)
-                print(f"[DEBUG] Successfully wrote {operation_type} data to sheets")
+                sheets_log.debug("Successfully wrote %s data to sheets", operation_type)
                 # Note: Cache is already invalidated in append_row() method
             except Exception as e:
-                print(f"[ERROR] Failed to write {operation_type} data: {e}")
+                sheets_log.error("Failed to write %s data: %s", operation_type, e)
+                tracer.annotate(error=repr(e))
                 # Try to get the actual headers from the sheet for debugging
                 if sheet_obj:
                     try:
                         actual_headers = sheet_obj.ws.row_values(1)
                         expected_headers = sheet_obj.headers
-                        print(f"[ERROR] Expected headers ({len(expected_headers)}): {expected_headers}")
-                        print(f"[ERROR] Actual headers ({len(actual_headers)}): {actual_headers}")
+                        sheets_log.error("Expected headers (%s): %s", len(expected_headers), expected_headers)
+                        sheets_log.error("Actual headers (%s): %s", len(actual_headers), actual_headers)
                         # Find duplicates
                         from collections import Counter
                         header_counts = Counter(actual_headers)
                         duplicates = [header for header, count in header_counts.items() if count > 1]
                         if duplicates:
-                            print(f"[ERROR] Duplicate headers found: {duplicates}")
+                            sheets_log.error("Duplicate headers found: %s", duplicates)
                     except Exception as debug_error:
-                        print(f"[ERROR] Could not retrieve headers for debugging: {debug_error}")
+                        sheets_log.error("Could not retrieve headers for debugging: %s", debug_error)
+        
+        # The write shows up in the submitting rerun's trace
+        parent_span = tracer.current()
+        def traced_write_worker():
+            with tracer.span("sheets.write_async", parent=parent_span, operation=operation_type):
+                write_worker()
         
         # Start background thread
-        thread = threading.Thread(target=write_worker, daemon=True)
+        thread = threading.Thread(target=traced_write_worker, daemon=True)
         thread.start()
         self.active_threads.append(thread)
         
@@ -1392,31 +2616,394 @@ def get_background_writer():
 
 background_writer = get_background_writer()
 
-# Initialize agent with streaming support
+class CircuitBreaker:
+    """Closed/open/half-open breaker over a provider's recent call outcomes."""
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self):
+        self.state = self.CLOSED
+        self.outcomes = deque(maxlen=CIRCUIT_WINDOW)  # (ok, latency)
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+    
+    def _refresh(self):
+        if self.state == self.OPEN and time.time() - self.opened_at >= CIRCUIT_OPEN_SECONDS:
+            self.state = self.HALF_OPEN
+            self.probe_in_flight = False
+    
+    def allow_request(self) -> bool:
+        """Whether a call may be routed here. Does not take the half-open probe; take_probe() does, when the call is made."""
+        self._refresh()
+        return self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self.probe_in_flight)
+    
+    def take_probe(self) -> bool:
+        """Claim the single half-open probe for a call about to be made. Returns True if this call is the probe."""
+        self._refresh()
+        if self.state == self.HALF_OPEN and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        return False
+    
+    def record(self, ok: bool, latency: float, probe: bool = False) -> Optional[str]:
+        """Record a call outcome (probe: the call held the half-open probe). Returns the new state if it changed."""
+        healthy = ok and latency < CIRCUIT_SLOW_CALL_SECONDS
+        if self.state == self.HALF_OPEN:
+            if not probe:
+                return None  # Only the probe decides whether a half-open breaker closes
+            self.probe_in_flight = False
+            if healthy:
+                self.state = self.CLOSED
+                self.outcomes.clear()
+            else:
+                self.state = self.OPEN
+                self.opened_at = time.time()
+            return self.state
+        
+        self.outcomes.append((ok, latency))
+        if self.state == self.CLOSED and len(self.outcomes) >= CIRCUIT_MIN_CALLS:
+            errors = sum(1 for call_ok, _ in self.outcomes if not call_ok)
+            slow = sum(1 for call_ok, call_latency in self.outcomes if call_ok and call_latency >= CIRCUIT_SLOW_CALL_SECONDS)
+            if errors / len(self.outcomes) >= CIRCUIT_ERROR_RATE or slow / len(self.outcomes) >= CIRCUIT_ERROR_RATE:
+                self.state = self.OPEN
+                self.opened_at = time.time()
+                return self.state
+        return None
+    
+    def stats(self) -> Dict[str, Any]:
+        calls = len(self.outcomes)
+        latencies = [latency for ok, latency in self.outcomes if ok]
+        return {
+            "state": self.state,
+            "error_rate": sum(1 for ok, _ in self.outcomes if not ok) / calls if calls else 0.0,
+            "avg_latency": sum(latencies) / len(latencies) if latencies else 0.0
+        }
+
+
+class ProviderRouter:
+    """Routes each LLM call to a healthy provider, preferring LLM_PROVIDER."""
+    
+    def __init__(self, providers: List[str]):
+        self.providers = providers
+        self._lock = threading.Lock()
+        self._breakers = {provider: CircuitBreaker() for provider in providers}
+    
+    def choose(self, avoid: Optional[str] = None) -> str:
+        """
+        Pick the first healthy provider, trying `avoid` last. Falls back to the primary if all are tripped.
+        Has no side effects; call begin_call() when the call is actually made.
+        """
+        ordered = [p for p in self.providers if p != avoid] + [p for p in self.providers if p == avoid]
+        with self._lock:
+            for provider in ordered:
+                if self._breakers[provider].allow_request():
+                    return provider
+        return self.providers[0]
+    
+    def begin_call(self, provider: str) -> bool:
+        """Note that a call to provider is starting. Returns True if it holds the half-open probe (pass it to record/release)."""
+        with self._lock:
+            return self._breakers[provider].take_probe()
+    
+    def record(self, provider: str, ok: bool, latency: float, probe: bool = False):
+        with self._lock:
+            new_state = self._breakers[provider].record(ok, latency, probe)
+        if new_state:
+            llm_log.info("[ROUTER] Circuit for %s is now %s", provider, new_state)
+    
+    def release(self, provider: str, probe: bool):
+        """Give back a probe whose call ended without a health signal (e.g. it was cancelled)."""
+        if probe:
+            with self._lock:
+                self._breakers[provider].probe_in_flight = False
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {provider: breaker.stats() for provider, breaker in self._breakers.items()}
+
+
 @st.cache_resource
-def get_agent():
-    """Get the appropriate LLM based on configuration."""
-    if LLM_PROVIDER == "gemini" and GEMINI_API_KEY:
-        llm = ChatGoogleGenerativeAI(
+def get_provider_router():
+    # Primary provider first; OpenAI is always configured, Gemini only with a key
+    providers = [LLM_PROVIDER] + [p for p in ("gemini", "openai") if p != LLM_PROVIDER]
+    return ProviderRouter([p for p in providers if p != "gemini" or GEMINI_API_KEY])
+
+provider_router = get_provider_router()
+
+
+def _is_overload_error(error: Exception) -> bool:
+    """True for provider rate-limit (429 / quota) and timeout errors."""
+    name = type(error).__name__
+    if name in ("RateLimitError", "ResourceExhausted", "APITimeoutError", "Timeout", "TimeoutError", "ReadTimeout", "DeadlineExceeded"):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in ("429", "rate limit", "resource exhausted", "quota", "timed out", "timeout"))
+
+
+class AdaptiveConcurrencyController:
+    """
+    AIMD limit on concurrent grading calls: grows additively (about +1 per window of healthy calls)
+    and is cut multiplicatively on 429s or timeouts, so the process settles at the quota it actually has.
+    """
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.limit = float(AIMD_INITIAL_LIMIT)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+    
+    def acquire(self, cancel_event: Optional[threading.Event] = None) -> bool:
+        """Wait for a slot. Returns False if cancel_event was set while waiting."""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                if cancel_event is not None and cancel_event.is_set():
+                    return False
+                self._cond.wait(timeout=0.25)
+            self.in_flight += 1
+            return True
+    
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+    
+    def on_success(self, latency: float):
+        with self._cond:
+            if latency <= AIMD_LATENCY_TARGET_SECONDS and self.limit < AIMD_MAX_LIMIT:
+                previous = int(self.limit)
+                self.limit = min(AIMD_MAX_LIMIT, self.limit + 1.0 / self.limit)
+                if int(self.limit) > previous:
+                    self._cond.notify()
+    
+    def on_overload(self):
+        with self._cond:
+            now = time.time()
+            if now - self._last_decrease < AIMD_DECREASE_COOLDOWN_SECONDS:
+                return
+            self._last_decrease = now
+            self.limit = max(AIMD_MIN_LIMIT, self.limit * AIMD_DECREASE_FACTOR)
+        llm_log.info("[AIMD] Provider overloaded, grading concurrency cut to %s", int(self.limit))
+
+
+@st.cache_resource
+def get_concurrency_controller():
+    return AdaptiveConcurrencyController()
+
+grading_concurrency = get_concurrency_controller()
+
+
+# --- LLM Call Accounting ---
+class LLMCallMetrics(BaseCallbackHandler):
+    """
+    Records model, task, tokens, time to first token, latency, retries, outcome and cost for every LLM call.
+    
+    Attached as a callback to every model from build_llm; call_with_failover opens a record on the calling
+    thread, so token counts reported by the model are attributed to the call that made the request.
+    Records go to an in-process window and a SQLite sink that serves the per-student/assignment rollups.
+    """
+    
+    def __init__(self, db_path: str = LLM_METRICS_DB_PATH, window: int = 1000):
+        super().__init__()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.recent = deque(maxlen=window)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_calls ("
+                "at TEXT, task TEXT, provider TEXT, model TEXT, execution_id TEXT, student_id TEXT, assignment_id TEXT, "
+                "question INTEGER, input_tokens INTEGER, output_tokens INTEGER, ttft REAL, latency REAL, "
+                "retries INTEGER, outcome TEXT, cost REAL)"
+            )
+            self._conn.commit()
+    
+    # Attribution: who the calls made on this thread are for
+    def attribute(self, **fields):
+        """Tag LLM calls made on the current thread with execution/student/assignment/question ids until clear_attribution()."""
+        self._local.attribution = {k: v for k, v in fields.items() if v is not None}
+    
+    def clear_attribution(self):
+        """Stop tagging calls on this thread; pool threads are reused for unrelated work."""
+        self._local.attribution = {}
+    
+    def start(self, task: str, retries: int = 0) -> Dict[str, Any]:
+        record = {
+            "at": datetime.datetime.now().isoformat(sep=' ', timespec='seconds'),
+            "task": task, "provider": None, "model": None,
+            "execution_id": None, "student_id": None, "assignment_id": None, "question": None,
+            "input_tokens": 0, "output_tokens": 0, "ttft": None, "latency": None,
+            "retries": retries, "outcome": None, "cost": 0.0,
+            "_start": time.time(), "_prompt_chars": 0, "_streamed_chars": 0
+        }
+        record.update(getattr(self._local, "attribution", {}))
+        self._local.record = record
+        return record
+    
+    def finish(self, record: Dict[str, Any], outcome: str):
+        self._local.record = None
+        record["outcome"] = outcome
+        record["latency"] = time.time() - record.pop("_start")
+        prompt_chars, streamed_chars = record.pop("_prompt_chars"), record.pop("_streamed_chars")
+        if not record["input_tokens"] and not record["output_tokens"] and streamed_chars:
+            # A stream closed early never reports usage; estimate it from what was sent and received (~4 chars per token)
+            record["input_tokens"] = prompt_chars // 4
+            record["output_tokens"] = streamed_chars // 4
+        price_in, price_out = MODEL_PRICING.get(record["model"], (0.0, 0.0))
+        record["cost"] = (record["input_tokens"] * price_in + record["output_tokens"] * price_out) / 1_000_000
+        self.recent.append(record)
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO llm_calls VALUES (:at, :task, :provider, :model, :execution_id, :student_id, :assignment_id, "
+                    ":question, :input_tokens, :output_tokens, :ttft, :latency, :retries, :outcome, :cost)",
+                    record
+                )
+                self._conn.commit()
+        except Exception as e:
+            llm_log.error("Failed to persist LLM call metrics: %s", e)
+    
+    # LangChain callbacks (run on the thread that made the call)
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        record = getattr(self._local, "record", None)
+        if record is not None:
+            record["_prompt_chars"] += sum(len(prompt) for prompt in prompts)
+    
+    def on_llm_new_token(self, token, **kwargs):
+        record = getattr(self._local, "record", None)
+        if record is None:
+            return
+        if record["ttft"] is None:
+            record["ttft"] = time.time() - record["_start"]
+        record["_streamed_chars"] += len(token) if isinstance(token, str) else 0
+    
+    def on_llm_end(self, response, **kwargs):
+        record = getattr(self._local, "record", None)
+        if record is None:
+            return
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    record["input_tokens"] += usage.get("input_tokens", 0)
+                    record["output_tokens"] += usage.get("output_tokens", 0)
+        if record["ttft"] is None:
+            # Non-streamed calls: the first token arrives with the whole response
+            record["ttft"] = time.time() - record["_start"]
+    
+    def totals(self, execution_id: str) -> Dict[str, Any]:
+        """Calls, tokens and cost so far for one execution, from the in-process window."""
+        records = [r for r in list(self.recent) if r["execution_id"] == execution_id]
+        return {
+            "calls": len(records),
+            "input_tokens": sum(r["input_tokens"] for r in records),
+            "output_tokens": sum(r["output_tokens"] for r in records),
+            "cost": round(sum(r["cost"] for r in records), 6)
+        }
+    
+    def rollup(self, by: str = "student_id") -> List[Dict[str, Any]]:
+        """Totals per student_id or assignment_id (and task) from the persisted call log."""
+        if by not in ("student_id", "assignment_id", "execution_id"):
+            raise ValueError(f"Unsupported rollup key: {by}")
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {by}, task, COUNT(*), SUM(input_tokens), SUM(output_tokens), SUM(cost), "
+                f"AVG(latency), AVG(ttft), SUM(retries), SUM(outcome != 'ok') "
+                f"FROM llm_calls GROUP BY {by}, task ORDER BY {by}, task"
+            ).fetchall()
+        keys = [by, "task", "calls", "input_tokens", "output_tokens", "cost", "avg_latency", "avg_ttft", "retries", "errors"]
+        return [dict(zip(keys, row)) for row in rows]
+
+
+@st.cache_resource
+def get_llm_call_metrics():
+    return LLMCallMetrics()
+
+llm_metrics = get_llm_call_metrics()
+
+
+def build_llm(task: str, temperature: float = 0, provider: Optional[str] = None):
+    """Build a chat model for a provider (default: LLM_PROVIDER) with the output limits for this task."""
+    provider = provider or LLM_PROVIDER
+    if APP_BACKEND:
+        return offline_backend.chat_model(task, temperature, provider, callbacks=[llm_metrics])
+    if provider == "gemini" and GEMINI_API_KEY:
+        return ChatGoogleGenerativeAI(
             model=DEFAULT_MODEL["gemini"],
-            temperature=0,
+            temperature=temperature,
             google_api_key=GEMINI_API_KEY,
             streaming=True,
-            max_output_tokens=4000,
-            request_timeout=60
+            max_output_tokens=MAX_OUTPUT_TOKENS[task],
+            request_timeout=60,
+            callbacks=[llm_metrics]
         )
-    else:
-        llm = ChatOpenAI(
-                model_name=DEFAULT_MODEL["openai"], 
-            temperature=0,
-            openai_api_key=OPENAI_API_KEY,
-            streaming=True,  # Enable streaming
-            max_tokens=4000,  # Increased limit to prevent truncation
-            request_timeout=60  # Increased timeout for longer responses
-        )
-    return llm
+    return ChatOpenAI(
+        model_name=DEFAULT_MODEL["openai"],
+        temperature=temperature,
+        openai_api_key=OPENAI_API_KEY,
+        streaming=True,  # Enable streaming
+        stream_usage=True,  # Token usage on streamed responses, for llm_metrics
+        max_tokens=MAX_OUTPUT_TOKENS[task],
+        request_timeout=60,
+        callbacks=[llm_metrics]
+    )
+
+# Initialize agent with streaming support
+@st.cache_resource
+def get_agent(task: str = "conversation", provider: Optional[str] = None):
+    """Get the shared LLM for a task (evaluation or conversation) on a provider."""
+    return build_llm(task, temperature=0, provider=provider)
+
+
+def call_with_failover(task: str, call, temperature: float = 0, retries: int = 0, cancel_event: Optional[threading.Event] = None):
+    """
+    Run call(llm) on the healthiest provider and record the outcome with the router.
+    If the call raises, it is retried once on the other provider (when one is healthy).
+    retries is how many times the caller has already retried this call, for llm_metrics.
+    A call that returns after cancel_event was set (deadline, lost hedge) is recorded as neither success nor failure.
+    """
+    provider = provider_router.choose()
+    record = llm_metrics.start(task, retries)
+    with tracer.span(f"llm.{task}", retries=retries):
+        for attempt in range(2):
+            # Temperature-0 models are shared; others get a dedicated instance per call
+            llm = get_agent(task, provider) if temperature == 0 else build_llm(task, temperature, provider)
+            record["provider"] = provider
+            record["model"] = DEFAULT_MODEL.get(provider)
+            # Waiting for a cluster-wide token is not provider latency, and a shared-tier error is not a provider failure
+            shared_rate_limit(provider, cancel_event)
+            probe = provider_router.begin_call(provider)
+            call_start = time.time()
+            try:
+                result = call(llm)
+            except Exception as e:
+                if cancel_event is not None and cancel_event.is_set():
+                    provider_router.release(provider, probe)
+                    llm_metrics.finish(record, "cancelled")
+                    raise
+                provider_router.record(provider, False, time.time() - call_start, probe)
+                if _is_overload_error(e):
+                    grading_concurrency.on_overload()
+                fallback = provider_router.choose(avoid=provider)
+                if attempt == 1 or fallback == provider:
+                    llm_metrics.finish(record, "overload" if _is_overload_error(e) else "error")
+                    raise
+                llm_log.info("[ROUTER] %s call failed on %s (%s), failing over to %s", task, provider, e, fallback)
+                provider = fallback
+                record["retries"] += 1
+                continue
+            if cancel_event is not None and cancel_event.is_set():
+                provider_router.release(provider, probe)
+                llm_metrics.finish(record, "cancelled")
+                return result
+            latency = time.time() - call_start
+            provider_router.record(provider, True, latency, probe)
+            grading_concurrency.on_success(latency)
+            llm_metrics.finish(record, "ok")
+            tracer.annotate(provider=provider, model=record["model"], input_tokens=record["input_tokens"], output_tokens=record["output_tokens"])
+            return result
 
-agent = get_agent()
 
 # Workflow functions
 
@@ -1428,6 +3015,7 @@ def prompt_student_id() -> Optional[str]:
     return sid.strip()
 
 
+@tracer.traced("phase.load_assignment")
 def load_assignment(sid: str) -> Optional[dict[str, Any]]:
     # Allow manual assignment selection with validation
     aid_input = st.text_input('Assignment ID (manual entry):', key='aid_input').strip()
@@ -1435,25 +3023,19 @@ def load_assignment(sid: str) -> Optional[dict[str, Any]]:
         st.info('Enter an Assignment ID to proceed.')
         return None
     # Validate the assignment is assigned to this student and not completed (ignore priority/due)
-    sid_key = sid.strip()
-    aid_key = aid_input.strip()
-    candidate = None
-    for rec in sheets.student_assignments.get_all():
-        if str(rec.get('student_id', '')).strip() == sid_key and str(rec.get('assignment_id', '')).strip() == aid_key:
-            candidate = rec
-            break
-    if not candidate:
+    entry = sheets.student_assignments.lookup(sid, aid_input)
+    if not entry:
         st.error('This assignment is not assigned to your Student ID.')
         return None
     # Optional checks: started/completed
-    completed = str(candidate.get('completed', 'FALSE')).strip().upper()
-    if completed == 'TRUE':
+    if entry['completed']:
         st.error('This assignment is already completed.')
         return None
     # Passed validation
-    return candidate
+    return entry['record']
 
 
+@tracer.traced("phase.load_questions")
 def load_questions(aid: str) -> Optional[dict[str, Any]]:
     """Load assignment record and return only active (filled) questions."""
     q = sheets.assignments.fetch(aid)
@@ -1471,8 +3053,8 @@ def load_questions(aid: str) -> Optional[dict[str, Any]]:
     q['active_questions'] = active_questions
     q['num_questions'] = len(active_questions)
     
-    print(f"[DEBUG] Loaded {len(active_questions)} active questions for assignment {aid}")
-    print(f"[DEBUG] Question keys: {list(active_questions.keys())}")
+    prompts_log.debug("Loaded %s active questions for assignment %s", len(active_questions), aid)
+    prompts_log.debug("Question keys: %s", list(active_questions.keys()))
     
     return q
 
@@ -1585,7 +3167,7 @@ def build_evaluation_metadata(all_questions: Dict[str, str], all_answers: Dict[s
 
 def build_conversation_metadata(all_questions: Dict[str, str], all_answers: Dict[str, str], 
                                 current_feedbacks: Dict[str, str] = None, current_scores: Dict[str, int] = None,
-                                conversation_history: List = None) -> str:
+                                conversation_history: List = None, conversation_summary: str = None) -> str:
     """Build metadata block for conversation agent (with conversation history)."""
     metadata_parts = []
     
@@ -1620,6 +3202,10 @@ def build_conversation_metadata(all_questions: Dict[str, str], all_answers: Dict
                 metadata_parts.append(f"  </grading_q{q_num}>")
         metadata_parts.append("</current_grading>")
     
+    # Summary of older history that no longer fits the context budget
+    if conversation_summary:
+        metadata_parts.append(f"<conversation_summary>{conversation_summary}</conversation_summary>")
+    
     # Conversation history
     if conversation_history:
         metadata_parts.append("<conversation_history>")
@@ -1635,6 +3221,277 @@ def build_conversation_metadata(all_questions: Dict[str, str], all_answers: Dict
     return "\n".join(metadata_parts)
 
 
+# --- Local JSON Repair ---
+# LLM replies usually fail json.loads for a handful of reasons: code fences, trailing commas,
+# unescaped quotes/newlines inside strings, or a truncated tail. These are fixed locally so
+# a retry (a full LLM call) is only spent on output that is genuinely unusable.
+
+_CODE_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_OPEN_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*", re.IGNORECASE)
+_STRING_END_RE = re.compile(r"\s*(?:[,:}\]]|$)")
+_LOOSE_STRING_END_RE = re.compile(r"\s*(?:[,}]|$)")
+
+
+def _strip_code_fences(text: str) -> str:
+    """Return the contents of the first code fence, or the text with an unterminated opening fence removed."""
+    match = _CODE_FENCE_RE.search(text)
+    if match:
+        return match.group(1)
+    return _OPEN_FENCE_RE.sub("", text)
+
+
+def _drop_trailing_comma(out: List[str]):
+    """Remove a dangling comma (and the whitespace after it) from the end of the output buffer."""
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j >= 0 and out[j] == ",":
+        del out[j:]
+
+
+def _repair_json_text(text: str) -> str:
+    """
+    Single pass over a JSON-ish object that escapes stray quotes and control characters inside
+    strings, drops trailing commas, and closes whatever a truncated reply left open.
+    """
+    out = []
+    closers = []
+    in_string = False
+    escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                out.append(ch)
+                escaped = False
+            elif ch == "\\":
+                out.append(ch)
+                escaped = True
+            elif ch == '"':
+                # Only treat the quote as closing if JSON structure follows it
+                if _STRING_END_RE.match(text, i + 1):
+                    in_string = False
+                    out.append(ch)
+                else:
+                    out.append('\\"')
+            elif ch == "\n":
+                out.append("\\n")
+            elif ch == "\r":
+                out.append("\\r")
+            elif ch == "\t":
+                out.append("\\t")
+            else:
+                out.append(ch)
+        elif ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            _drop_trailing_comma(out)
+            if closers:
+                closers.pop()
+            out.append(ch)
+            if not closers:
+                break  # Top-level object is complete; ignore any trailing chatter
+        else:
+            out.append(ch)
+    
+    # Close a reply that was cut off mid-way
+    if in_string:
+        if escaped:
+            out.pop()
+        out.append('"')
+    _drop_trailing_comma(out)
+    while closers:
+        out.append(closers.pop())
+    return "".join(out)
+
+
+def _read_loose_string(text: str, start: int) -> str:
+    """Read a JSON string value starting after its opening quote, tolerating stray quotes and truncation."""
+    i = start
+    escaped = False
+    while i < len(text):
+        ch = text[i]
+        if escaped:
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch == '"' and _LOOSE_STRING_END_RE.match(text, i + 1):
+            break
+        i += 1
+    raw = text[start:i]
+    try:
+        return json.loads(_repair_json_text('"' + raw + '"')).strip()
+    except json.JSONDecodeError:
+        return raw.strip()
+
+
+def _extract_fields(text: str, field_pairs: List[tuple]) -> Dict[str, Any]:
+    """Pull (score, feedback) fields out of text that cannot be parsed as an object at all."""
+    result = {}
+    for score_key, feedback_key in field_pairs:
+        score_match = re.search(rf'"{score_key}"\s*:\s*"?(\d+(?:\.\d+)?)', text)
+        if score_match:
+            result[score_key] = int(float(score_match.group(1)))
+        feedback_match = re.search(rf'"{feedback_key}"\s*:\s*"', text)
+        if feedback_match:
+            feedback = _read_loose_string(text, feedback_match.end())
+            if feedback:
+                result[feedback_key] = feedback
+    return result
+
+
+def repair_json_response(text: str, field_pairs: List[tuple]) -> tuple[Optional[Dict[str, Any]], str]:
+    """
+    Parse an LLM JSON reply as tolerantly as possible.
+    
+    Args:
+        text: Raw response text
+        field_pairs: Expected (score_key, feedback_key) pairs, e.g. [("score3", "feedback3")]
+    
+    Returns:
+        (parsed dict or None, strategy) where strategy is "direct", "repaired", "extracted" or "unusable"
+    """
+    if not text or not text.strip():
+        return None, "unusable"
+    
+    body = _strip_code_fences(text)
+    start = body.find("{")
+    if start != -1:
+        candidate = body[start:]
+        try:
+            # raw_decode ignores any chatter after the object
+            parsed, _ = json.JSONDecoder().raw_decode(candidate)
+            if isinstance(parsed, dict):
+                return parsed, "direct"
+        except json.JSONDecodeError:
+            pass
+        try:
+            parsed = json.loads(_repair_json_text(candidate))
+            if isinstance(parsed, dict):
+                return parsed, "repaired"
+        except json.JSONDecodeError:
+            pass
+    
+    fields = _extract_fields(body, field_pairs)
+    if fields:
+        return fields, "extracted"
+    return None, "unusable"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token) for budgeting prompts."""
+    return len(text) // 4 + 1
+
+
+class ConversationContextManager:
+    """
+    Keeps conversation prompts inside a token budget: the most recent messages are sent verbatim and
+    older ones are folded into a running summary that is produced in the background.
+    
+    The summary lives in the session state as {"text": ..., "upto": index of the first message not covered}.
+    """
+    
+    def __init__(self, token_budget: int = CONVERSATION_CONTEXT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self._lock = threading.Lock()
+        self._in_flight = set()  # ids of states with a summary being generated
+    
+    @staticmethod
+    def _message_tokens(msg) -> int:
+        return estimate_tokens(msg.content) if isinstance(msg, (HumanMessage, AIMessage)) else 0
+    
+    def build_window(self, state: dict, lock=None) -> tuple[List, str, Dict[str, int]]:
+        """
+        lock is the owning AssignmentMemoryManager's lock, taken by the summary worker when it writes into state.
+        Returns: (recent messages to send verbatim, summary text for older ones, size stats)
+        """
+        messages = state.get("messages", [])
+        summary = state.setdefault("conversation_summary", {"text": "", "upto": 0})
+        
+        # Walk back from the newest message until the budget is used up
+        used = 0
+        cutoff = len(messages)
+        while cutoff > 0:
+            msg_tokens = self._message_tokens(messages[cutoff - 1])
+            if used + msg_tokens > self.token_budget and len(messages) - cutoff >= CONVERSATION_MIN_RECENT_MESSAGES:
+                break
+            used += msg_tokens
+            cutoff -= 1
+        
+        # Messages before the cutoff that the summary doesn't cover yet get summarized in the background
+        if cutoff > summary["upto"]:
+            self._summarize_async(state, cutoff, lock)
+        
+        recent = messages[max(cutoff, 0):]
+        if summary["upto"] < cutoff:
+            # Summary is still catching up: keep the uncovered messages verbatim rather than dropping them
+            recent = messages[summary["upto"]:]
+        
+        full_tokens = sum(self._message_tokens(msg) for msg in messages)
+        sent_tokens = sum(self._message_tokens(msg) for msg in recent) + estimate_tokens(summary["text"])
+        stats = {
+            "history_tokens_full": full_tokens,
+            "history_tokens_sent": sent_tokens,
+            "history_tokens_saved": max(0, full_tokens - sent_tokens)
+        }
+        return recent, summary["text"], stats
+    
+    def _summarize_async(self, state: dict, cutoff: int, lock=None):
+        """Fold messages [summary.upto, cutoff) into the running summary on a background thread."""
+        with self._lock:
+            if id(state) in self._in_flight:
+                return
+            self._in_flight.add(id(state))
+        
+        summary = state["conversation_summary"]
+        to_fold = state["messages"][summary["upto"]:cutoff]
+        previous_summary = summary["text"]
+        # The size cap may trim messages while the summary is generated; the trim count re-anchors cutoff
+        trimmed_before = state.get("messages_trimmed", 0)
+        parent_span = tracer.current()
+        
+        def summarize_worker():
+            try:
+                llm_metrics.attribute(execution_id=state.get("execution_id"), student_id=state.get("student_id"), assignment_id=state.get("assignment_id"))
+                transcript = "\n".join(
+                    f"{'Student' if isinstance(msg, HumanMessage) else 'AI'}: {msg.content}"
+                    for msg in to_fold if isinstance(msg, (HumanMessage, AIMessage))
+                )
+                prompt = f"""Update the running summary of a tutoring session. Keep answers, scores, feedback themes and the student's open questions; drop pleasantries. Reply with the summary only, under 250 words.
+
+<previous_summary>{previous_summary}</previous_summary>
+<new_messages>
+{transcript}
+</new_messages>"""
+                with tracer.span("memory.summarize", parent=parent_span, messages=len(to_fold)):
+                    text = call_with_failover("summary", lambda llm: llm.invoke(prompt).content)
+                with lock or nullcontext():
+                    shift = state.get("messages_trimmed", 0) - trimmed_before
+                    summary = state["conversation_summary"]
+                    summary["text"] = text.strip()
+                    summary["upto"] = max(0, cutoff - shift)
+                memory_log.info("[CONTEXT] Summarized %s older message(s) into the running summary", len(to_fold))
+            except Exception as e:
+                memory_log.error("Conversation summarization failed: %s", e)
+            finally:
+                llm_metrics.clear_attribution()
+                with self._lock:
+                    self._in_flight.discard(id(state))
+        
+        thread = threading.Thread(target=summarize_worker, daemon=True)
+        thread.start()
+
+
+@st.cache_resource
+def get_conversation_context_manager():
+    return ConversationContextManager()
+
+conversation_context = get_conversation_context_manager()
+
+
 # Orchestration text is now imported from prompt_manager
 
 def is_valid_grading_response(response_data: dict, question_num: int) -> bool:
@@ -1654,76 +3511,514 @@ def is_valid_grading_response(response_data: dict, question_num: int) -> bool:
     except (ValueError, TypeError):
         return False
     
-    # Check if feedback is non-empty string
-    feedback = response_data[feedback_key]
-    if not isinstance(feedback, str) or not feedback.strip():
-        return False
+    # Check if feedback is non-empty string
+    feedback = response_data[feedback_key]
+    if not isinstance(feedback, str) or not feedback.strip():
+        return False
+    
+    # Check if feedback is not just error text or placeholder
+    if len(feedback.strip()) < 10:  # Too short to be real feedback
+        return False
+    
+    return True
+
+
+class ParseStats:
+    """Counts LLM output parse failures, retries and local repair saves per task and output mode ("structured" or "text")."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}  # {(task, mode): {"calls": n, "parse_failures": n, "retries": n}}
+    
+    def _bucket(self, task: str, mode: str) -> dict:
+        return self._counts.setdefault((task, mode), {"calls": 0, "parse_failures": 0, "retries": 0, "repair_saves": 0})
+    
+    def record(self, task: str, mode: str, parse_failed: bool = False, retried: bool = False, repaired: bool = False):
+        """Record one LLM response. repaired=True means local repair rescued a reply that strict parsing rejected."""
+        with self._lock:
+            bucket = self._bucket(task, mode)
+            bucket["calls"] += 1
+            if parse_failed:
+                bucket["parse_failures"] += 1
+            if retried:
+                bucket["retries"] += 1
+            if repaired:
+                bucket["repair_saves"] += 1
+    
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Failure and retry rates per task/mode, for comparing structured output against free-text parsing."""
+        with self._lock:
+            summary = {}
+            for (task, mode), bucket in self._counts.items():
+                calls = bucket["calls"] or 1
+                summary[f"{task}/{mode}"] = {
+                    **bucket,
+                    "parse_failure_rate": bucket["parse_failures"] / calls,
+                    "retry_rate": bucket["retries"] / calls,
+                    "repair_save_rate": bucket["repair_saves"] / calls
+                }
+            return summary
+
+
+@st.cache_resource
+def get_parse_stats():
+    return ParseStats()
+
+parse_stats = get_parse_stats()
+
+
+class JSONObjectStreamDetector:
+    """Incrementally tracks a streamed reply and reports when its first top-level JSON object is complete."""
+    
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._gave_up = False
+    
+    def feed(self, chunk: str) -> bool:
+        """Add a chunk; returns True once a complete, valid top-level object has been received."""
+        self.text += chunk
+        if self._gave_up:
+            return False
+        while self._pos < len(self.text):
+            ch = self.text[self._pos]
+            self._pos += 1
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                if self._start is not None:
+                    self._in_string = True
+            elif ch == "{":
+                if self._start is None:
+                    self._start = self._pos - 1
+                self._depth += 1
+            elif ch == "}" and self._start is not None:
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        json.loads(self.text[self._start:self._pos])
+                        return True
+                    except json.JSONDecodeError:
+                        # Malformed (e.g. stray quotes) - read the full reply and let repair handle it
+                        self._gave_up = True
+                        return False
+        return False
+
+
+def _stream_json_object(llm, prompt: str, task: str, cancel_event: Optional[threading.Event] = None,
+                        **options) -> tuple[str, bool]:
+    """
+    Stream a reply that should be a single JSON object, stopping generation as soon as the object is complete.
+    options are passed through to llm.stream (e.g. structured_output_options).
+    Returns: (response text, whether the stream was stopped early)
+    """
+    detector = JSONObjectStreamDetector()
+    stream = llm.stream(prompt, stop=STOP_SEQUENCES[task], **options)
+    try:
+        for chunk in stream:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if hasattr(chunk, 'content') and detector.feed(chunk.content):
+                return detector.text, True
+        return detector.text, False
+    finally:
+        # Closing the generator closes the underlying HTTP stream, which ends generation server-side
+        stream.close()
+
+
+_JSON_SCHEMA_TYPES = {int: "integer", float: "number", str: "string", bool: "boolean"}
+
+
+def structured_output_options(llm, schema: type[BaseModel]) -> dict:
+    """
+    Per-call stream options that make the provider generate output matching schema: response_mime_type and
+    response_schema in the Gemini generation config, otherwise a strict json_schema response_format (OpenAI).
+    """
+    properties = {
+        name: {"type": _JSON_SCHEMA_TYPES[field.annotation], "description": field.description}
+        for name, field in schema.model_fields.items()
+    }
+    if isinstance(llm, ChatGoogleGenerativeAI):
+        return {"generation_config": {
+            "response_mime_type": "application/json",
+            "response_schema": {
+                "type_": "OBJECT",
+                "properties": {name: {"type_": prop["type"].upper(), "description": prop["description"]} for name, prop in properties.items()},
+                "required": list(properties)
+            }
+        }}
+    return {"response_format": {
+        "type": "json_schema",
+        "json_schema": {
+            "name": schema.__name__,
+            "strict": True,
+            "schema": {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+        }
+    }}
+
+
+def _stream_structured(llm, schema: type[BaseModel], prompt: str, task: str,
+                       cancel_event: Optional[threading.Event] = None) -> tuple[Optional[dict], str, bool]:
+    """
+    Stream a reply constrained to schema by the provider, then validate its JSON object against schema
+    (which also enforces the bounds, e.g. 0-10 scores, that provider schemas cannot express).
+    Returns: (parsed dict or None if the output did not match the schema, response text, whether the stream was stopped early)
+    """
+    raw_text, stopped_early = _stream_json_object(llm, prompt, task, cancel_event=cancel_event,
+                                                  **structured_output_options(llm, schema))
+    start = raw_text.find("{")
+    if start < 0:
+        llm_log.warning("Structured output for %s contained no JSON object", schema.__name__)
+        return None, raw_text, stopped_early
+    try:
+        obj, _ = json.JSONDecoder().raw_decode(raw_text, start)
+        return schema.model_validate(obj).model_dump(), raw_text, stopped_early
+    except ValueError as e:  # JSONDecodeError and pydantic's ValidationError
+        llm_log.warning("Structured output did not match %s: %s", schema.__name__, e)
+        return None, raw_text, stopped_early
+
+
+class GradingLatencyTracker:
+    """Keeps recent grading call latencies (for the hedging threshold) and process-wide hedge counters."""
+    
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.hedges_fired = 0
+        self.hedge_wins = 0
+        self.questions = 0
+    
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+    
+    def p95(self) -> Optional[float]:
+        """Observed p95 latency, or None until there are enough samples to trust it."""
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    
+    def record_submission(self, questions: int, hedges_fired: int, hedge_wins: int):
+        with self._lock:
+            self.questions += questions
+            self.hedges_fired += hedges_fired
+            self.hedge_wins += hedge_wins
+    
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "hedge_rate": self.hedges_fired / self.questions if self.questions else 0.0,
+                "hedge_win_rate": self.hedge_wins / self.hedges_fired if self.hedges_fired else 0.0,
+                "hedges_fired": self.hedges_fired,
+                "hedge_wins": self.hedge_wins
+            }
+
+
+@st.cache_resource
+def get_grading_latency_tracker():
+    return GradingLatencyTracker()
+
+grading_latency = get_grading_latency_tracker()
+
+
+def _schedule_grading(prompts: List[tuple], deadline_seconds: float, max_workers: int, on_result=None, attribution: Optional[Dict[str, Any]] = None) -> tuple[Dict[int, Dict[str, Any]], List[int], Dict[str, Any]]:
+    """
+    Run grading calls against a single deadline for the whole submission.
+    
+    Results are consumed in completion order and passed to on_result(q_num, result, elapsed).
+    When the deadline runs out, queued calls are cancelled and running calls are told to stop.
+    With ENABLE_HEDGED_REQUESTS, a question still running past the observed p95 latency gets a
+    duplicate call; the first valid result wins and the other call is cancelled.
+    
+    attribution (execution/student/assignment ids) tags the calls in llm_metrics.
+    
+    Returns: (results keyed by question number, question numbers that missed the deadline, hedge info)
+    """
+    start_time = time.time()
+    deadline = start_time + deadline_seconds
+    prompt_by_qnum = dict(prompts)
+    parent_span = tracer.current()  # Worker threads don't inherit the caller's span
+    
+    hedge_delay = grading_latency.p95() if ENABLE_HEDGED_REQUESTS else None
+    hedge_budget = max(1, int(len(prompts) * HEDGE_BUDGET_FRACTION)) if hedge_delay is not None else 0
+    hedged_qnums = set()
+    hedge_futures = set()
+    hedge_wins = 0
+    
+    future_to_qnum = {}
+    attempts = {}  # {q_num: [future, ...]}
+    cancel_events = {}  # {future: threading.Event}
+    started_at = {}  # {q_num: time the first call actually started running}
+    results = {}
+    
+    def timed_call(question_num: int, prompt: str, cancel_event: threading.Event) -> Dict[str, Any]:
+        # The adaptive controller, not the pool size, decides how many calls run at once
+        if not grading_concurrency.acquire(cancel_event):
+            return {}
+        try:
+            llm_metrics.attribute(**(attribution or {}), question=question_num)
+            call_start = time.time()
+            started_at.setdefault(question_num, call_start)
+            with tracer.span("grading.question", parent=parent_span, question=question_num):
+                result = _make_single_api_call(question_num, prompt, cancel_event=cancel_event)
+            if result and not cancel_event.is_set():
+                grading_latency.record_latency(time.time() - call_start)
+            return result
+        finally:
+            llm_metrics.clear_attribution()
+            grading_concurrency.release()
+    
+    def submit(question_num: int):
+        cancel_event = threading.Event()
+        future = executor.submit(timed_call, question_num, prompt_by_qnum[question_num], cancel_event)
+        future_to_qnum[future] = question_num
+        attempts.setdefault(question_num, []).append(future)
+        cancel_events[future] = cancel_event
+        return future
+    
+    executor = ThreadPoolExecutor(max_workers=max_workers + hedge_budget, thread_name_prefix="grading")
+    try:
+        for question_num, _ in prompts:
+            submit(question_num)
+        
+        grading_log.info("[BENCHMARK] All %s API calls submitted at %.3fs", len(prompts), time.time() - start_time)
+        if hedge_delay is not None:
+            grading_log.info("[HEDGE] Hedging after %.2fs (p95), budget %s extra call(s)", hedge_delay, hedge_budget)
+        
+        pending = set(future_to_qnum)
+        while pending:
+            now = time.time()
+            remaining = deadline - now
+            if remaining <= 0:
+                break
+            
+            # Wake up for the next hedge as well as for completions
+            timeout = remaining
+            started = dict(started_at)  # Snapshot; worker threads add to it
+            hedge_candidates = [q for q in started if q not in results and q not in hedged_qnums]
+            if hedge_delay is not None and len(hedged_qnums) < hedge_budget and hedge_candidates:
+                next_hedge = min(started[q] for q in hedge_candidates) + hedge_delay
+                timeout = min(timeout, max(0.05, next_hedge - now))
+            
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                q_num = future_to_qnum[future]
+                if q_num in results or future.cancelled():
+                    continue  # Loser of a hedged pair
+                try:
+                    result = future.result()
+                except Exception as e:
+                    grading_log.error("Q%s API call failed: %s", q_num, e)
+                    result = {
+                        f"score{q_num}": 5,
+                        f"feedback{q_num}": f"API call failed: {str(e)}"
+                    }
+                
+                # An invalid result only counts if no other call for this question is still running
+                others = [f for f in attempts[q_num] if f is not future and not f.done()]
+                if others and not is_valid_grading_response(result, q_num):
+                    continue
+                
+                results[q_num] = result
+                if future in hedge_futures:
+                    hedge_wins += 1
+                    grading_log.info("[HEDGE] Q%s hedge call won", q_num)
+                for other in others:
+                    other.cancel()
+                    cancel_events[other].set()
+                    pending.discard(other)
+                if on_result:
+                    on_result(q_num, result, time.time() - start_time)
+            
+            # Fire hedges for questions that have run past p95
+            if hedge_delay is not None:
+                now = time.time()
+                started = dict(started_at)
+                for q_num in sorted(started, key=started.get):
+                    if len(hedged_qnums) >= hedge_budget:
+                        break
+                    if q_num in results or q_num in hedged_qnums or now - started[q_num] < hedge_delay:
+                        continue
+                    hedged_qnums.add(q_num)
+                    hedge_future = submit(q_num)
+                    hedge_futures.add(hedge_future)
+                    pending.add(hedge_future)
+                    grading_log.info("[HEDGE] Q%s still running after %.2fs, firing hedge call", q_num, now - started[q_num])
+        
+        late_qnums = sorted(q for q in prompt_by_qnum if q not in results)
+        if late_qnums:
+            grading_log.info("[SCHEDULER] Deadline of %ss reached, cancelling %s outstanding call(s): %s", deadline_seconds, len(late_qnums), late_qnums)
+            for event in cancel_events.values():
+                event.set()
+        
+        grading_latency.record_submission(len(prompts), len(hedged_qnums), hedge_wins)
+        hedge_info = {"hedges_fired": len(hedged_qnums), "hedge_wins": hedge_wins}
+        return results, late_qnums, hedge_info
+    finally:
+        # Never block the caller on calls that overran the deadline or lost a hedge
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class LateGradingRegistry:
+    """Re-grades questions that missed the submission deadline and holds the results until the UI picks them up."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}  # {exec_id: {q_num: result}}
+        self._pending = {}  # {exec_id: set(q_num)}
+        self._updated = {}  # {exec_id: last time a retry started or finished}
+    
+    def _prune(self):
+        """Forget executions untouched past the retention, e.g. sessions that closed before collecting (caller holds the lock)."""
+        cutoff = time.time() - BACKGROUND_GRADING_DEADLINE_SECONDS - BACKGROUND_GRADING_RETENTION_SECONDS
+        for exec_id in [exec_id for exec_id, updated in self._updated.items() if updated < cutoff]:
+            del self._updated[exec_id]
+            self._results.pop(exec_id, None)
+            self._pending.pop(exec_id, None)
+    
+    def retry_async(self, exec_id: str, prompts: List[tuple], attribution: Optional[Dict[str, Any]] = None,
+                    row: Optional[Dict[str, Any]] = None):
+        """
+        Start a background thread that re-grades the given (q_num, prompt) pairs.
+        row is the submission's grading row with pending placeholders; once re-grading finishes, the completed
+        row is written to the grading sheet (placeholder rows are never persisted) and the new grades to memory.
+        """
+        with self._lock:
+            self._prune()
+            self._pending.setdefault(exec_id, set()).update(q_num for q_num, _ in prompts)
+            self._updated[exec_id] = time.time()
+        
+        parent_span = tracer.current()
+        
+        def retry_worker():
+            try:
+                with tracer.span("grading.background_retry", parent=parent_span, questions=len(prompts)):
+                    results, still_late, _ = _schedule_grading(prompts, BACKGROUND_GRADING_DEADLINE_SECONDS, max_workers=min(len(prompts), 5), attribution=attribution)
+            except Exception as e:
+                grading_log.error("Background re-grading failed for exec_id=%s: %s", exec_id, e)
+                results, still_late = {}, [q_num for q_num, _ in prompts]
+            
+            for q_num in still_late:
+                results[q_num] = {
+                    f"score{q_num}": 5,
+                    f"feedback{q_num}": "Grading failed: the grading service did not respond in time. Please resubmit."
+                }
+            with self._lock:
+                self._prune()
+                self._results.setdefault(exec_id, {}).update(results)
+                pending = self._pending.get(exec_id, set())
+                pending.difference_update(results.keys())
+                if not pending:
+                    self._pending.pop(exec_id, None)
+                self._updated[exec_id] = time.time()
+            grading_log.info("[SCHEDULER] Background re-grading finished for exec_id=%s: %s", exec_id, sorted(results.keys()))
+            if row is not None:
+                completed = dict(row)
+                for result in results.values():
+                    completed.update(result)
+                completed["pending_questions"] = []
+                completed["timestamp"] = datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
+                background_writer.write_async('grading', completed)
+                try:
+                    record_grading_in_memory(exec_id, row["student_id"], row["assignment_id"], {}, completed, sorted(results))
+                except Exception as e:
+                    grading_log.error("Failed to record background grading in memory for exec_id=%s: %s", exec_id, e)
+        
+        thread = threading.Thread(target=retry_worker, daemon=True)
+        thread.start()
+    
+    def has_pending(self, exec_id: str) -> bool:
+        with self._lock:
+            return bool(self._pending.get(exec_id))
+    
+    def has_results(self, exec_id: str) -> bool:
+        with self._lock:
+            return bool(self._results.get(exec_id))
+    
+    def collect(self, exec_id: str) -> Dict[int, Dict[str, Any]]:
+        """Pop any finished background results for this execution."""
+        with self._lock:
+            if exec_id not in self._pending:
+                self._updated.pop(exec_id, None)
+            return self._results.pop(exec_id, {})
+
+
+@st.cache_resource
+def get_late_grading_registry():
+    return LateGradingRegistry()
+
+late_grading = get_late_grading_registry()
+
+
+def pending_grading_result(question_num: int) -> Dict[str, Any]:
+    """Placeholder result for a question that missed the grading deadline. The score stays empty until it is graded."""
+    return {
+        f"score{question_num}": "",
+        f"feedback{question_num}": "⏳ Pending — grading is taking longer than usual and will retry in the background. Your feedback will appear here shortly."
+    }
+
+
+def build_grading_prompts(aid: str, answers: Dict[str, str], all_questions: Dict[str, str], previous_feedback: Optional[Dict[str, Any]]) -> List[tuple]:
+    """One (question_num, prompt) pair per non-empty answer. Reads no session state, so it can run on a worker thread."""
+    # Determine which questions to grade based on provided answers
+    questions_to_grade = []
+    for q_key, answer in answers.items():
+        if answer.strip():  # Only grade questions with answers
+            # Extract question number from key (e.g., "q3" -> 3)
+            q_num = int(q_key.replace('q', ''))
+            questions_to_grade.append((q_num, q_key, answer))
+    
+    grading_log.debug("Grading %s questions: %s", len(questions_to_grade), [q[0] for q in questions_to_grade])
     
-    # Check if feedback is not just error text or placeholder
-    if len(feedback.strip()) < 10:  # Too short to be real feedback
-        return False
+    # Try to get prompt from assignments sheet based on assignment_id
+    prompt_template = prompt_manager.get_prompt_cached(aid, "grading")
     
-    return True
-
-
-def run_grading_streaming(exec_id: str, sid: str, aid: str, answers: Dict[str, str]) -> Dict[str, Any]:
-    """True parallel grading - all API calls made simultaneously. Supports variable number of questions (1-25)."""
-    try:
-        # Get active questions from session state
-        all_questions = st.session_state.get('active_questions', {})
-        
-        # Get previous feedback from session state (if any)
-        previous_feedback = st.session_state.get('feedback', {})
-        
-        # Determine which questions to grade based on provided answers
-        questions_to_grade = []
-        for q_key, answer in answers.items():
-            if answer.strip():  # Only grade questions with answers
-                # Extract question number from key (e.g., "q3" -> 3)
-                q_num = int(q_key.replace('q', ''))
-                questions_to_grade.append((q_num, q_key, answer))
-        
-        num_questions = len(questions_to_grade)
-        print(f"[DEBUG] Grading {num_questions} questions: {[q[0] for q in questions_to_grade]}")
+    # Fall back to default if not found in sheet
+    if not prompt_template:
+        grading_log.debug("No prompt found in sheet for assignment %s, using default grading prompt", aid)
+        prompt_template = get_default_prompts()["grading_prompt"]
+    else:
+        grading_log.debug("Using custom grading prompt from sheet for assignment %s", aid)
+    
+    # Print the actual prompt template being used
+    grading_log.debug("===== GRADING PROMPT TEMPLATE =====")
+    grading_log.debug("%.500s", prompt_template)
+    grading_log.debug("=====================================")
+    
+    # Prepare question-specific prompts for each LLM
+    prompts = []
+    for q_num, q_key, answer in questions_to_grade:
+        # Get question text
+        question_text = all_questions.get(q_key, f"Question {q_num}")
         
-        # Try to get prompt from assignments sheet based on assignment_id
-        prompt_template = prompt_manager.get_prompt_cached(aid, "grading")
+        # Build metadata block for this question
+        metadata = build_grading_metadata(
+            question_num=q_num,
+            question_text=question_text,
+            answer=answer,
+            all_questions=all_questions,
+            all_answers=answers,
+            previous_feedbacks=previous_feedback if previous_feedback else None,
+            previous_scores=previous_feedback if previous_feedback else None
+        )
         
-        # Fall back to default if not found in sheet
-        if not prompt_template:
-            print(f"[DEBUG] No prompt found in sheet for assignment {aid}, using default grading prompt")
-            prompt_template = get_default_prompts()["grading_prompt"]
-        else:
-            print(f"[DEBUG] Using custom grading prompt from sheet for assignment {aid}")
+        # Build the structured prompt with admin orchestration
+        orchestration_texts = get_orchestration_text()
+        admin_section = orchestration_texts["grading_evaluation"]
+        output_format = render_output_format(get_grading_output_format(q_num))
         
-        # Print the actual prompt template being used
-        print(f"[DEBUG] ===== GRADING PROMPT TEMPLATE =====")
-        print(f"[DEBUG] {prompt_template[:500]}..." if len(prompt_template) > 500 else f"[DEBUG] {prompt_template}")
-        print(f"[DEBUG] =====================================")
-        
-        # Prepare question-specific prompts for each LLM
-        prompts = []
-        for q_num, q_key, answer in questions_to_grade:
-            # Get question text
-            question_text = all_questions.get(q_key, f"Question {q_num}")
-            
-            # Build metadata block for this question
-            metadata = build_grading_metadata(
-                question_num=q_num,
-                question_text=question_text,
-                answer=answer,
-                all_questions=all_questions,
-                all_answers=answers,
-                previous_feedbacks=previous_feedback if previous_feedback else None,
-                previous_scores=previous_feedback if previous_feedback else None
-            )
-            
-            # Build the structured prompt with admin orchestration
-            orchestration_texts = get_orchestration_text()
-            admin_section = orchestration_texts["grading_evaluation"]
-            output_format = get_grading_output_format(q_num)
-            
-            question_prompt = f"""<data>
+        question_prompt = f"""<data>
 {metadata}
 </data>
 
@@ -1738,169 +4033,221 @@ def run_grading_streaming(exec_id: str, sid: str, aid: str, answers: Dict[str, s
 <instructions>
 {prompt_template}
 </instructions>"""
-            
-            prompts.append((q_num, question_prompt))
-        
-        # Execute all API calls simultaneously (dynamic number of workers based on question count)
-        with st.spinner(f"Grading your {num_questions} answer{'s' if num_questions != 1 else ''}..."):
-            start_time = time.time()
-            # Use min to ensure we don't create more threads than questions
-            max_workers = min(num_questions, 10)  # Cap at 10 concurrent threads
-            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="grading") as executor:
-                # Submit all API calls at once
-                futures = []
-                for question_num, prompt in prompts:
-                    future = executor.submit(_make_single_api_call, question_num, prompt)
-                    futures.append(future)
-                
-                print(f"[BENCHMARK] All {num_questions} API calls submitted at {time.time() - start_time:.3f}s")
-                
-                # Wait for ALL responses to complete
-                results = []
-                for i, future in enumerate(futures):
-                    try:
-                        result = future.result(timeout=60)  # 60 second timeout per question
-                        results.append(result)
-                        print(f"[BENCHMARK] Q{prompts[i][0]} API call completed at {time.time() - start_time:.3f}s")
-                    except Exception as e:
-                        q_num = prompts[i][0]
-                        print(f"[ERROR] Q{q_num} API call failed: {e}")
-                        results.append({
-                            "execution_id": exec_id,
-                            "student_id": sid,
-                            f"score{q_num}": 5,
-                            f"feedback{q_num}": f"API call failed: {str(e)}"
-                        })
-            
-            total_time = time.time() - start_time
-            print(f"[BENCHMARK] Total parallel grading time: {total_time:.3f}s")
-            print(f"[BENCHMARK] Average time per question: {total_time/num_questions:.3f}s")
-            print(f"[BENCHMARK] Questions completed: {len(results)}/{num_questions}")
-        
-        # Merge results from all questions
-        merged_result = {
-            "execution_id": exec_id,
-            "assignment_id": aid,
-            "student_id": sid,
-            "timestamp": datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
-        }
         
-        # Initialize all possible scores and feedback to empty/0
+        prompts.append((q_num, question_prompt))
+    return prompts
+
+
+def grade_submission(exec_id: str, sid: str, aid: str, prompts: List[tuple], on_result=None) -> tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Grade every prompt against one deadline and merge the results into a grading row.
+    Questions that miss the deadline get a pending result and are re-graded by late_grading.
+    on_result(q_num, result, elapsed) is called from worker threads as each question completes.
+    Returns (merged_result, metrics).
+    """
+    num_questions = len(prompts)
+    first_feedback = {}
+    
+    def record_result(q_num: int, result: Dict[str, Any], elapsed: float):
+        if not first_feedback:
+            first_feedback['time'] = elapsed
+            grading_log.info("[BENCHMARK] Time to first feedback: %.3fs (Q%s)", elapsed, q_num)
+        grading_log.info("[BENCHMARK] Q%s API call completed at %.3fs", q_num, elapsed)
+        if on_result:
+            on_result(q_num, result, elapsed)
+    
+    start_time = time.time()
+    # Threads for every question; the shared AIMD controller limits how many call the provider at once
+    max_workers = min(num_questions, AIMD_MAX_LIMIT)
+    grading_log.info("[AIMD] Current grading concurrency limit: %s", int(grading_concurrency.limit))
+    attribution = {"execution_id": exec_id, "student_id": sid, "assignment_id": aid}
+    results_by_qnum, late_qnums, hedge_info = _schedule_grading(prompts, GRADING_DEADLINE_SECONDS, max_workers, on_result=record_result, attribution=attribution)
+    
+    # Questions that missed the deadline get a pending status and are re-graded in the background (below)
+    for q_num in late_qnums:
+        results_by_qnum[q_num] = pending_grading_result(q_num)
+    results = list(results_by_qnum.values())
+    completed_count = num_questions - len(late_qnums)
+    
+    total_time = time.time() - start_time
+    grading_log.info("[BENCHMARK] Total parallel grading time: %.3fs", total_time)
+    # The summaries below are computed, so skip them entirely when INFO is off
+    if grading_log.isEnabledFor(logging.INFO):
+        grading_log.info("[BENCHMARK] LLM usage for this execution: %s", llm_metrics.totals(exec_id))
+        grading_log.info("[BENCHMARK] Average time per question: %.3fs", total_time/max(num_questions, 1))
+        grading_log.info("[BENCHMARK] Questions completed: %s/%s", completed_count, num_questions)
+        grading_log.info("[BENCHMARK] Parse failure/retry rates: %s", parse_stats.summary())
+        if ENABLE_HEDGED_REQUESTS:
+            grading_log.info("[BENCHMARK] Hedges this submission: %s, overall: %s", hedge_info, grading_latency.summary())
+    
+    # Keep time-to-first-feedback as its own metric alongside the total grading time
+    metrics = {
+        "num_questions": num_questions,
+        "time_to_first_feedback": first_feedback.get('time'),
+        "total_time": total_time,
+        "completed": completed_count,
+        "late": len(late_qnums),
+        "concurrency_limit": int(grading_concurrency.limit),
+        **hedge_info
+    }
+    
+    # Merge results from all questions
+    merged_result = {
+        "execution_id": exec_id,
+        "assignment_id": aid,
+        "student_id": sid,
+        "timestamp": datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
+    }
+    
+    # Initialize all possible scores and feedback to empty/0
+    for i in range(1, 26):
+        merged_result[f"score{i}"] = 0
+        merged_result[f"feedback{i}"] = ""
+    
+    # Fill in actual results
+    for result in results:
         for i in range(1, 26):
-            merged_result[f"score{i}"] = 0
-            merged_result[f"feedback{i}"] = ""
+            score_key = f"score{i}"
+            feedback_key = f"feedback{i}"
+            if score_key in result:
+                merged_result[score_key] = result[score_key]
+            if feedback_key in result:
+                merged_result[feedback_key] = result[feedback_key]
+    merged_result["pending_questions"] = late_qnums
+    if late_qnums:
+        # The re-grading thread writes the completed row, so the placeholder row is not persisted
+        late_grading.retry_async(exec_id, [(q_num, prompt) for q_num, prompt in prompts if q_num in late_qnums], attribution,
+                                 row=dict(merged_result))
+    
+    if grading_log.isEnabledFor(logging.DEBUG):
+        grading_log.debug("Parallel API grading result: %s", {k: v for k, v in merged_result.items() if v})
+    return merged_result, metrics
+
+
+def grading_error_result(exec_id: str, sid: str, aid: str) -> Dict[str, Any]:
+    """Grading row used when grading fails outright."""
+    error_result = {
+        "execution_id": exec_id,
+        "assignment_id": aid,
+        "student_id": sid,
+        "timestamp": datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
+    }
+    for i in range(1, 26):
+        error_result[f"score{i}"] = 5
+        error_result[f"feedback{i}"] = "Grading error"
+    return error_result
+
+
+@tracer.traced("phase.grading")
+def run_grading_streaming(exec_id: str, sid: str, aid: str, answers: Dict[str, str]) -> Dict[str, Any]:
+    """True parallel grading on the script thread, with live per-question status. Supports variable number of questions (1-25)."""
+    try:
+        prompts = build_grading_prompts(aid, answers, st.session_state.get('active_questions', {}), st.session_state.get('feedback', {}))
+        num_questions = len(prompts)
         
-        # Fill in actual results
-        for result in results:
-            for i in range(1, 26):
-                score_key = f"score{i}"
-                feedback_key = f"feedback{i}"
-                if score_key in result:
-                    merged_result[score_key] = result[score_key]
-                if feedback_key in result:
-                    merged_result[feedback_key] = result[feedback_key]
+        # Execute all API calls against one deadline and show each result as soon as it completes
+        with st.status(f"Grading your {num_questions} answer{'s' if num_questions != 1 else ''}...", expanded=True) as grading_status:
+            # One placeholder per question so results can be pushed into the page in completion order
+            status_placeholders = {}
+            for question_num, _ in prompts:
+                status_placeholders[question_num] = st.empty()
+                status_placeholders[question_num].markdown(f"⏳ Q{question_num}: grading...")
+            
+            def show_result(q_num: int, result: Dict[str, Any], elapsed: float):
+                status_placeholders[q_num].markdown(f"✅ Q{q_num}: graded — score {result.get(f'score{q_num}', '?')}/10")
+            
+            merged_result, metrics = grade_submission(exec_id, sid, aid, prompts, on_result=show_result)
+            for q_num in merged_result["pending_questions"]:
+                status_placeholders[q_num].markdown(f"🕒 Q{q_num}: pending, will retry in background")
+            grading_status.update(label=f"Graded {metrics['completed']}/{num_questions} answer{'s' if num_questions != 1 else ''}", state="complete", expanded=False)
         
-        print("[DEBUG] Parallel API grading result:", {k: v for k, v in merged_result.items() if v})
+        st.session_state['grading_metrics'] = metrics
         return merged_result
         
     except Exception as e:
-        print(f"[ERROR] Parallel grading failed: {e}")
+        grading_log.error("Parallel grading failed: %s", e)
         st.error(f"Grading failed: {e}")
         # Return error result for all questions that were attempted
-        error_result = {
-            "execution_id": exec_id,
-            "assignment_id": aid,
-            "student_id": sid,
-            "timestamp": datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
-        }
-        for i in range(1, 26):
-            error_result[f"score{i}"] = 5
-            error_result[f"feedback{i}"] = "Grading error"
-        return error_result
+        return grading_error_result(exec_id, sid, aid)
 
 
-def _make_single_api_call(question_num: int, prompt: str, max_retries: int = 3) -> Dict[str, Any]:
-    """Make a single API call to the configured LLM for grading with dedicated agent instance and retry logic."""
+def _make_single_api_call(question_num: int, prompt: str, max_retries: int = 3, cancel_event: Optional[threading.Event] = None) -> Dict[str, Any]:
+    """Make a single API call for grading with a dedicated agent instance, provider failover and retry logic.
     
-    # Create a dedicated agent instance for this thread to avoid conflicts
-    if LLM_PROVIDER == "gemini" and GEMINI_API_KEY:
-        thread_agent = ChatGoogleGenerativeAI(
-            model=DEFAULT_MODEL["gemini"],
-            temperature=1,
-            google_api_key=GEMINI_API_KEY,
-            streaming=True,
-            max_output_tokens=4000,
-            request_timeout=60
-        )
-    else:
-        thread_agent = ChatOpenAI(
-            model_name=DEFAULT_MODEL["openai"], 
-            temperature=1,
-            openai_api_key=OPENAI_API_KEY,
-            streaming=True,
-            max_tokens=4000,
-            request_timeout=60
-        )
+    If cancel_event is set (e.g. the submission deadline ran out), the call stops streaming and gives up early."""
     
     # Retry loop for malformed responses
+    output_schema = get_grading_output_format(question_num)
+    
+    def grading_call(llm):
+        # Stream and stop as soon as a complete JSON object has arrived
+        if USE_STRUCTURED_OUTPUT:
+            return _stream_structured(llm, output_schema, prompt, "grading", cancel_event=cancel_event)
+        raw_text, stopped_early = _stream_json_object(llm, prompt, "grading", cancel_event=cancel_event)
+        return None, raw_text, stopped_early
+    
     for attempt in range(max_retries):
+        if cancel_event is not None and cancel_event.is_set():
+            grading_log.info("[SCHEDULER] Q%s cancelled before attempt %s", question_num, attempt + 1)
+            return {}
         try:
-            # Use streaming for faster response
-            response_text = ""
-            for chunk in thread_agent.stream(prompt):
-                if hasattr(chunk, 'content'):
-                    response_text += chunk.content
+            mode = "structured" if USE_STRUCTURED_OUTPUT else "text"
+            
+            # Each attempt gets a dedicated model instance on the healthiest provider
+            result, response_text, stopped_early = call_with_failover("grading", grading_call, temperature=1, retries=attempt, cancel_event=cancel_event)
+            if cancel_event is not None and cancel_event.is_set():
+                grading_log.info("[SCHEDULER] Q%s cancelled", question_num)
+                return {}
+            if stopped_early:
+                grading_log.debug("Q%s stream stopped once the JSON object was complete", question_num)
             
             response_preview = response_text[:50] + "..." if len(response_text) > 50 else response_text
-            print(f"[DEBUG] Q{question_num} API response received (attempt {attempt + 1}): {response_preview}")
+            grading_log.debug("Q%s API response received (attempt %s, %s): %s", question_num, attempt + 1, mode, response_preview)
             
-            # Parse JSON response
-            result = {}
-            try:
-                import re
-                json_match = re.search(r'\{.*?\}', response_text, re.DOTALL)
-                if json_match:
-                    result = json.loads(json_match.group())
-                else:
-                    result = json.loads(response_text.strip())
-            except json.JSONDecodeError:
-                print(f"[WARNING] Q{question_num} JSON parse failed on attempt {attempt + 1}")
-                # Create fallback result
-                clean_feedback = response_text
-                # Remove common JSON artifacts
-                clean_feedback = re.sub(r'```json\s*', '', clean_feedback)
-                clean_feedback = re.sub(r'```\s*', '', clean_feedback)
-                clean_feedback = re.sub(r'\{[^}]*\}', '', clean_feedback)
-                clean_feedback = re.sub(r'"[^"]*":\s*"[^"]*"', '', clean_feedback)
-                clean_feedback = clean_feedback.strip()
-                
-                result = {
-                    f"score{question_num}": 5,
-                    f"feedback{question_num}": clean_feedback if clean_feedback else "Malformed response"
-                }
+            # Parse JSON response (free-text mode, or structured mode that did not match the schema)
+            parse_failed = False
+            repair_strategy = "structured"
+            if result is None:
+                # In structured mode a missing parse means the output did not match the schema
+                parse_failed = USE_STRUCTURED_OUTPUT
+                result, repair_strategy = repair_json_response(response_text, [(f"score{question_num}", f"feedback{question_num}")])
+                if result is None:
+                    parse_failed = True
+                    grading_log.warning("Q%s response unusable after local repair on attempt %s", question_num, attempt + 1)
+                    result = {}
+                elif repair_strategy != "direct":
+                    grading_log.info("[REPAIR] Q%s response recovered locally (%s) on attempt %s", question_num, repair_strategy, attempt + 1)
+            
+            valid = is_valid_grading_response(result, question_num)
+            parse_stats.record(
+                "grading", mode,
+                parse_failed=parse_failed,
+                retried=not valid and attempt < max_retries - 1,
+                repaired=valid and repair_strategy in ("repaired", "extracted")
+            )
             
             # Validate the response
-            if is_valid_grading_response(result, question_num):
-                print(f"[SUCCESS] Q{question_num} received valid response on attempt {attempt + 1}")
+            if valid:
+                grading_log.debug("Q%s received valid response on attempt %s", question_num, attempt + 1)
                 return result
             else:
-                print(f"[WARNING] Q{question_num} response validation failed on attempt {attempt + 1}")
+                grading_log.warning("Q%s response validation failed on attempt %s", question_num, attempt + 1)
                 if attempt < max_retries - 1:
-                    print(f"[RETRY] Q{question_num} retrying LLM call...")
+                    grading_log.info("[RETRY] Q%s retrying LLM call...", question_num)
                     time.sleep(0.5)  # Brief delay before retry
                     continue
                 else:
                     # Final attempt failed
-                    print(f"[ERROR] Q{question_num} failed validation after {max_retries} attempts")
+                    grading_log.error("Q%s failed validation after %s attempts", question_num, max_retries)
                     return {
                         f"score{question_num}": 5,
                         f"feedback{question_num}": "Grading failed: Unable to generate valid feedback after multiple attempts"
                     }
             
         except Exception as e:
-            print(f"[ERROR] Q{question_num} API call failed on attempt {attempt + 1}: {e}")
+            grading_log.error("Q%s API call failed on attempt %s: %s", question_num, attempt + 1, e)
             if attempt < max_retries - 1:
-                print(f"[RETRY] Q{question_num} retrying after error...")
+                grading_log.info("[RETRY] Q%s retrying after error...", question_num)
                 time.sleep(0.5)
                 continue
             else:
@@ -1921,16 +4268,165 @@ def run_grading(exec_id: str, sid: str, aid: str, answers: Dict[str, str]) -> Di
     return run_grading_streaming(exec_id, sid, aid, answers)
 
 
+class GradingJobQueue:
+    """
+    Process-wide queue of grading jobs served by a worker pool, so a submission does not block the script thread.
+    Jobs are found by job_id, by execution_id and by (student_id, assignment_id), so a session that reconnects
+    can pick up a job still in flight, or one that finished while no page was there to show it. A worker persists the grading row, the started flag and the
+    memory checkpoint itself; the page shows the result when it sees the job finish.
+    """
+    
+    def __init__(self, workers: int = GRADING_JOB_WORKERS):
+        self._lock = threading.Lock()
+        self._jobs = {}  # {job_id: job}
+        self._done = {}  # {job_id: threading.Event}
+        self._by_exec = {}  # {exec_id: latest job_id}
+        self._by_student = {}  # {(student_id, assignment_id): latest job_id}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="grading-job")
+    
+    def submit(self, exec_id: str, sid: str, aid: str, answers: Dict[str, str], all_questions: Dict[str, str],
+               previous_feedback: Optional[Dict[str, Any]]) -> str:
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "execution_id": exec_id,
+            "student_id": sid,
+            "assignment_id": aid,
+            "answers": dict(answers),
+            "status": "queued",  # queued -> running -> done | failed
+            "total": sum(1 for answer in answers.values() if answer.strip()),
+            "graded": {},  # {q_num: score}, filled in as questions complete
+            "result": None,
+            "metrics": None,
+            "error": None,
+            "submitted_at": time.time(),
+            "finished_at": None,
+            "shown": False  # Set once a page session has applied the result
+        }
+        with self._lock:
+            self._prune()
+            self._jobs[job_id] = job
+            self._done[job_id] = threading.Event()
+            self._by_exec[exec_id] = job_id
+            self._by_student[(sid.strip(), aid.strip())] = job_id
+        self._executor.submit(self._run, job, dict(all_questions), dict(previous_feedback or {}), tracer.current())
+        grading_log.info("[JOBS] Queued grading job %s for exec_id=%s (%s questions)", job_id, exec_id, job["total"])
+        return job_id
+    
+    def _run(self, job: Dict[str, Any], all_questions: Dict[str, str], previous_feedback: Dict[str, Any], parent_span):
+        exec_id, sid, aid = job["execution_id"], job["student_id"], job["assignment_id"]
+        with self._lock:
+            job["status"] = "running"
+        
+        def on_result(q_num: int, result: Dict[str, Any], elapsed: float):
+            with self._lock:
+                job["graded"][q_num] = result.get(f"score{q_num}", "?")
+        
+        try:
+            with tracer.span("grading.job", parent=parent_span, questions=job["total"],
+                             queued_ms=round((time.time() - job["submitted_at"]) * 1000, 1)):
+                prompts = build_grading_prompts(aid, job["answers"], all_questions, previous_feedback)
+                result, metrics = grade_submission(exec_id, sid, aid, prompts, on_result=on_result)
+            status, error = "done", None
+        except Exception as e:
+            grading_log.error("Grading job %s failed: %s", job["job_id"], e)
+            result, metrics, status, error = grading_error_result(exec_id, sid, aid), None, "failed", str(e)
+        
+        if status == "done":
+            # Persist here rather than in the page, so the result survives a refresh or a closed tab.
+            # With pending questions, late_grading writes the row once they are graded.
+            if not result["pending_questions"]:
+                background_writer.write_async('grading', result)
+            try:
+                # Answers to pending questions are recorded now, their grades by late_grading
+                graded = [int(q_key.replace('q', '')) for q_key, answer in job["answers"].items()
+                          if answer.strip() and int(q_key.replace('q', '')) not in result["pending_questions"]]
+                record_grading_in_memory(exec_id, sid, aid, {q_key: job["answers"].get(q_key, '') for q_key in all_questions}, result, graded)
+            except Exception as e:
+                grading_log.error("Failed to record grading job %s in memory: %s", job["job_id"], e)
+            try:
+                entry = sheets.student_assignments.lookup(sid, aid)
+                if entry and str(entry["record"].get("started", "FALSE")).upper() != "TRUE":
+                    sheets.update_started_status(sid, aid, 'TRUE')
+            except Exception as e:
+                grading_log.error("Failed to update started status: %s", e)
+        
+        with self._lock:
+            job.update(status=status, result=result, metrics=metrics, error=error, finished_at=time.time())
+            done = self._done.get(job["job_id"])
+        if done:
+            done.set()
+        grading_log.info("[JOBS] Grading job %s %s in %.3fs", job["job_id"], status, job["finished_at"] - job["submitted_at"])
+    
+    def _prune(self):
+        """Forget finished jobs past their retention (caller holds the lock)."""
+        cutoff = time.time() - GRADING_JOB_RETENTION_SECONDS
+        expired = [job_id for job_id, job in self._jobs.items() if job["finished_at"] and job["finished_at"] < cutoff]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            self._done.pop(job_id, None)
+            if self._by_exec.get(job["execution_id"]) == job_id:
+                del self._by_exec[job["execution_id"]]
+            key = (job["student_id"].strip(), job["assignment_id"].strip())
+            if self._by_student.get(key) == job_id:
+                del self._by_student[key]
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """A copy of the job, safe to read while the worker updates it."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return {**job, "graded": dict(job["graded"])} if job else None
+    
+    def for_execution(self, exec_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job_id = self._by_exec.get(exec_id)
+        return self.get(job_id) if job_id else None
+    
+    def unseen(self, sid: str, aid: str) -> Optional[Dict[str, Any]]:
+        """The student's latest job for this assignment, if it is unfinished or no page has shown its result yet."""
+        with self._lock:
+            job_id = self._by_student.get((sid.strip(), aid.strip()))
+        job = self.get(job_id) if job_id else None
+        return job if job and not job["shown"] else None
+    
+    def mark_shown(self, job_id: str):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id]["shown"] = True
+    
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> bool:
+        with self._lock:
+            done = self._done.get(job_id)
+        return done.wait(timeout) if done else True
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+
+@st.cache_resource
+def get_grading_job_queue():
+    return GradingJobQueue()
+
+grading_jobs = get_grading_job_queue()
+
+
+@tracer.traced("phase.evaluation")
 def run_evaluation_streaming(grade_res: Dict[str, Any]) -> Dict[str, Any]:
     """Optimized evaluation with streaming."""
     try:
         # Get assignment_id from grade_res
         aid = grade_res.get('assignment_id', '')
+        llm_metrics.attribute(execution_id=st.session_state.get('exec_id'), student_id=st.session_state.get('sid'), assignment_id=aid)
         
         # Get active questions from session state
         all_questions = st.session_state.get('active_questions', {})
         
         # Get current answers from assignment memory
+        assignment_memory = current_session_memory()
         all_answers = {}
         if assignment_memory.current_state:
             all_answers = assignment_memory.current_state.get('answers', {})
@@ -1959,15 +4455,15 @@ def run_evaluation_streaming(grade_res: Dict[str, Any]) -> Dict[str, Any]:
         
         # Fall back to default if not found in sheet
         if not prompt_template:
-            print(f"[DEBUG] No prompt found in sheet for assignment {aid}, using default evaluation prompt")
+            grading_log.debug("No prompt found in sheet for assignment %s, using default evaluation prompt", aid)
             prompt_template = get_default_prompts()["evaluation_prompt"]
         else:
-            print(f"[DEBUG] Using custom evaluation prompt from sheet for assignment {aid}")
+            grading_log.debug("Using custom evaluation prompt from sheet for assignment %s", aid)
         
         # Print the actual prompt template being used
-        print(f"[DEBUG] ===== EVALUATION PROMPT TEMPLATE =====")
-        print(f"[DEBUG] {prompt_template[:500]}..." if len(prompt_template) > 500 else f"[DEBUG] {prompt_template}")
-        print(f"[DEBUG] ========================================")
+        grading_log.debug("===== EVALUATION PROMPT TEMPLATE =====")
+        grading_log.debug("%.500s", prompt_template)
+        grading_log.debug("========================================")
         
         # Build metadata block for evaluation
         metadata = build_evaluation_metadata(
@@ -1977,13 +4473,14 @@ def run_evaluation_streaming(grade_res: Dict[str, Any]) -> Dict[str, Any]:
             current_scores=current_scores
         )
         
-        # Determine number of questions for output format
-        num_questions = len(all_questions)
+        # Determine which questions the output schema covers
+        question_nums = tuple(sorted(int(q_key.replace('q', '')) for q_key in all_questions.keys()))
+        output_schema = get_evaluation_output_format(question_nums)
         
         # Build the structured prompt with admin orchestration
         orchestration_texts = get_orchestration_text()
         admin_section = orchestration_texts["grading_evaluation"]
-        output_format = get_evaluation_output_format(num_questions)
+        output_format = render_output_format(output_schema)
         
         prompt = f"""<data>
 {metadata}
@@ -2001,67 +4498,45 @@ def run_evaluation_streaming(grade_res: Dict[str, Any]) -> Dict[str, Any]:
 {prompt_template}
 </instructions>"""
 
-        # Use streaming for faster response
+        # Validate against the schema when structured output is enabled, otherwise parse the streamed text
         response_text = ""
+        structured_result = None
+        mode = "structured" if USE_STRUCTURED_OUTPUT else "text"
         start_time = time.time()
         with st.spinner("Evaluating feedback..."):
-            for chunk in agent.stream(prompt):
-                if hasattr(chunk, 'content'):
-                    response_text += chunk.content
+            if USE_STRUCTURED_OUTPUT:
+                structured_result, response_text, _ = call_with_failover("evaluation", lambda llm: _stream_structured(llm, output_schema, prompt, "evaluation"))
+            else:
+                response_text, _ = call_with_failover("evaluation", lambda llm: _stream_json_object(llm, prompt, "evaluation"))
         
         eval_time = time.time() - start_time
         response_preview = response_text[:50] + "..." if len(response_text) > 50 else response_text
-        print(f"[BENCHMARK] Evaluation completed in {eval_time:.3f}s")
-        print(f"[DEBUG] run_evaluation_streaming LLM response: {response_preview}")
+        grading_log.info("[BENCHMARK] Evaluation completed in %.3fs", eval_time)
+        grading_log.debug("run_evaluation_streaming LLM response: %s", response_preview)
         
-        # Improved JSON parsing with multiple fallback strategies
-        result = {}
-        try:
-            import re
-            # Strategy 1: Look for JSON object with simpler pattern
-            json_match = re.search(r'\{.*?\}', response_text, re.DOTALL)
-            if json_match:
-                result = json.loads(json_match.group())
-            else:
-                # Strategy 2: Look for JSON array
-                json_match = re.search(r'\[.*\]', response_text, re.DOTALL)
-                if json_match:
-                    result = json.loads(json_match.group())
-                else:
-                    # Strategy 3: Try to parse the entire response as JSON
-                    result = json.loads(response_text.strip())
-        except json.JSONDecodeError:
-            # Strategy 4: If all JSON parsing fails, try to extract fields manually
-            print("[WARNING] Could not parse JSON from evaluation response, attempting manual extraction")
-            result = {
-                "execution_id": grade_res.get('execution_id', ''),
-                "student_id": grade_res.get('student_id', ''),
-            }
-            
-            # Dynamically populate fallback for all questions in the assignment
-            for i in range(1, num_questions + 1):
-                result[f"new_score{i}"] = grade_res.get(f'score{i}', 0)
-                result[f"new_feedback{i}"] = grade_res.get(f'feedback{i}', '')
-            
-            # Try to extract individual feedback fields from the response text
-            try:
-                import re
-                # Look for new_feedback patterns for all questions dynamically
-                for i in range(1, num_questions + 1):
-                    feedback_pattern = rf'"new_feedback{i}":\s*"([^"]*)"'
-                    score_pattern = rf'"new_score{i}":\s*(\d+)'
-                    
-                    feedback_match = re.search(feedback_pattern, response_text)
-                    score_match = re.search(score_pattern, response_text)
-                    
-                    if feedback_match:
-                        result[f"new_feedback{i}"] = feedback_match.group(1)
-                    if score_match:
-                        result[f"new_score{i}"] = int(score_match.group(1))
-                        
-            except Exception as e:
-                print(f"[WARNING] Manual extraction failed: {e}")
-                # Keep the original feedback as fallback
+        # Parse the reply, repairing it locally if needed
+        parse_failed = structured_result is None and USE_STRUCTURED_OUTPUT
+        repaired = False
+        field_pairs = [(f"new_score{i}", f"new_feedback{i}") for i in question_nums]
+        if structured_result is not None:
+            result = structured_result
+        else:
+            result, repair_strategy = repair_json_response(response_text, field_pairs)
+            if result is None:
+                parse_failed = True
+                grading_log.warning("Could not recover JSON from evaluation response, keeping original feedback")
+                result = {}
+            elif repair_strategy != "direct":
+                repaired = True
+                grading_log.info("[REPAIR] Evaluation response recovered locally (%s)", repair_strategy)
+        
+        # Any field the model did not return keeps the original grading
+        for score_key, feedback_key in field_pairs:
+            i = score_key.replace('new_score', '')
+            result.setdefault(score_key, grade_res.get(f'score{i}', 0))
+            result.setdefault(feedback_key, grade_res.get(f'feedback{i}', ''))
+        
+        parse_stats.record("evaluation", mode, parse_failed=parse_failed, repaired=repaired)
         
         # Ensure all required fields are present for sheet writing
         complete_result = {
@@ -2081,11 +4556,12 @@ def run_evaluation_streaming(grade_res: Dict[str, Any]) -> Dict[str, Any]:
             if key.startswith(('new_score', 'new_feedback')):
                 complete_result[key] = value
         
-        print("[DEBUG] run_evaluation_streaming complete result:", {k: v for k, v in complete_result.items() if v and k.startswith('new_')})
+        if grading_log.isEnabledFor(logging.DEBUG):
+            grading_log.debug("run_evaluation_streaming complete result: %s", {k: v for k, v in complete_result.items() if v and k.startswith('new_')})
         return complete_result
         
     except Exception as e:
-        print(f"[ERROR] run_evaluation_streaming failed: {e}")
+        grading_log.error("run_evaluation_streaming failed: %s", e)
         st.error(f"Evaluation failed: {e}")
         # Return error result with all required fields
         error_result = {
@@ -2098,6 +4574,8 @@ def run_evaluation_streaming(grade_res: Dict[str, Any]) -> Dict[str, Any]:
             error_result[f"new_score{i}"] = 0
             error_result[f"new_feedback{i}"] = "Evaluation error"
         return error_result
+    finally:
+        llm_metrics.clear_attribution()
 
 
 def run_evaluation(grade_res: Dict[str, Any]) -> Dict[str, Any]:
@@ -2105,16 +4583,19 @@ def run_evaluation(grade_res: Dict[str, Any]) -> Dict[str, Any]:
     return run_evaluation_streaming(grade_res)
 
 
+@tracer.traced("phase.conversation")
 def run_conversation_streaming(exec_id: str, sid: str, user_msg: str) -> Dict[str, Any]:
     """Optimized conversation with streaming and context cache integration."""
     try:
         # Get assignment_id from session state
         aid = st.session_state.get('assignment_id', '')
+        llm_metrics.attribute(execution_id=exec_id, student_id=sid, assignment_id=aid)
         
         # Get active questions from session state
         all_questions = st.session_state.get('active_questions', {})
         
         # Get current answers from assignment memory
+        assignment_memory = current_session_memory()
         all_answers = {}
         if assignment_memory.current_state:
             all_answers = assignment_memory.current_state.get('answers', {})
@@ -2149,25 +4630,28 @@ def run_conversation_streaming(exec_id: str, sid: str, user_msg: str) -> Dict[st
                     except (ValueError, TypeError):
                         current_scores[score_key] = 0
         
-        # Get conversation history from assignment memory
+        # Get conversation history from assignment memory, windowed to the token budget
         conversation_history = []
+        conversation_summary = ""
         if assignment_memory.current_state:
-            conversation_history = assignment_memory.current_state.get('messages', [])
+            conversation_history, conversation_summary, context_stats = conversation_context.build_window(assignment_memory.current_state, assignment_memory.lock)
+            st.session_state['conversation_metrics'] = context_stats
+            conversation_log.info("[BENCHMARK] Conversation history: ~%s tokens sent, ~%s saved of ~%s", context_stats['history_tokens_sent'], context_stats['history_tokens_saved'], context_stats['history_tokens_full'])
         
         # Try to get prompt from assignments sheet based on assignment_id
         prompt_template = prompt_manager.get_prompt_cached(aid, "conversation")
         
         # Fall back to default if not found in sheet
         if not prompt_template:
-            print(f"[DEBUG] No prompt found in sheet for assignment {aid}, using default conversation prompt")
+            conversation_log.debug("No prompt found in sheet for assignment %s, using default conversation prompt", aid)
             prompt_template = get_default_prompts()["conversation_prompt"]
         else:
-            print(f"[DEBUG] Using custom conversation prompt from sheet for assignment {aid}")
+            conversation_log.debug("Using custom conversation prompt from sheet for assignment %s", aid)
         
         # Print the actual prompt template being used
-        print(f"[DEBUG] ===== CONVERSATION PROMPT TEMPLATE =====")
-        print(f"[DEBUG] {prompt_template[:500]}..." if len(prompt_template) > 500 else f"[DEBUG] {prompt_template}")
-        print(f"[DEBUG] ==========================================")
+        conversation_log.debug("===== CONVERSATION PROMPT TEMPLATE =====")
+        conversation_log.debug("%.500s", prompt_template)
+        conversation_log.debug("==========================================")
         
         # Build metadata block for conversation
         metadata = build_conversation_metadata(
@@ -2175,7 +4659,8 @@ def run_conversation_streaming(exec_id: str, sid: str, user_msg: str) -> Dict[st
             all_answers=all_answers,
             current_feedbacks=current_feedbacks if current_feedbacks else None,
             current_scores=current_scores if current_scores else None,
-            conversation_history=conversation_history if conversation_history else None
+            conversation_history=conversation_history if conversation_history else None,
+            conversation_summary=conversation_summary if conversation_summary else None
         )
         
         # Build the structured prompt with conversation orchestration
@@ -2195,18 +4680,41 @@ def run_conversation_streaming(exec_id: str, sid: str, user_msg: str) -> Dict[st
 {prompt_template}
 </instructions>"""
 
-        # Use streaming for faster response
-        response_text = ""
-        start_time = time.time()
-        with st.spinner("Processing your question..."):
-            for chunk in agent.stream(prompt):
-                if hasattr(chunk, 'content'):
-                    response_text += chunk.content
+        # Stream the reply into the page as tokens arrive; the caller persists it once complete.
+        # A failover to the other provider restarts the stream in the same placeholder.
+        placeholder = st.empty()
+        timing = {"start": time.time(), "first_token": None}
+        
+        def conversation_call(llm):
+            def tokens():
+                for chunk in llm.stream(prompt, stop=STOP_SEQUENCES["conversation"]):
+                    text = getattr(chunk, 'content', '')
+                    if text:
+                        if timing["first_token"] is None:
+                            timing["first_token"] = time.time()
+                        yield text
+            
+            with placeholder.container():
+                st.write("**AI Response:**")
+                if hasattr(st, "write_stream"):
+                    return st.write_stream(tokens())
+                text, box = "", st.empty()
+                for token in tokens():
+                    text += token
+                    box.markdown(text)
+                return text
+        
+        response_text = call_with_failover("conversation", conversation_call)
         
-        conv_time = time.time() - start_time
+        conv_time = time.time() - timing["start"]
+        first_token_time = (timing["first_token"] or time.time()) - timing["start"]
+        tracer.annotate(time_to_first_token_ms=round(first_token_time * 1000, 1))
+        st.session_state.setdefault('conversation_metrics', {}).update(
+            time_to_first_token=first_token_time, total_seconds=conv_time
+        )
         response_preview = response_text[:50] + "..." if len(response_text) > 50 else response_text
-        print(f"[BENCHMARK] Conversation completed in {conv_time:.3f}s")
-        print(f"[DEBUG] run_conversation_streaming LLM response: {response_preview}")
+        conversation_log.info("[BENCHMARK] Conversation first token after %.3fs, completed in %.3fs", first_token_time, conv_time)
+        conversation_log.debug("run_conversation_streaming LLM response: %s", response_preview)
         
         result = {
             "execution_id": exec_id,
@@ -2218,11 +4726,11 @@ def run_conversation_streaming(exec_id: str, sid: str, user_msg: str) -> Dict[st
             "winner": None
         }
         
-        print("[DEBUG] run_conversation_streaming extracted:", result)
+        conversation_log.debug("run_conversation_streaming extracted: %s", result)
         return result
         
     except Exception as e:
-        print(f"[ERROR] run_conversation_streaming failed: {e}")
+        conversation_log.error("run_conversation_streaming failed: %s", e)
         st.error(f"Conversation failed: {e}")
         aid = st.session_state.get('assignment_id', '')
         return {
@@ -2234,18 +4742,256 @@ def run_conversation_streaming(exec_id: str, sid: str, user_msg: str) -> Dict[st
             "timestamp": datetime.datetime.now().isoformat(sep=' ', timespec='seconds'),
             "winner": None
         }
+    finally:
+        llm_metrics.clear_attribution()
 
 
 def run_conversation(exec_id: str, sid: str, user_msg: str) -> Dict[str, Any]:
     """Legacy function - now calls the optimized streaming version."""
     return run_conversation_streaming(exec_id, sid, user_msg)
 
+@tracer.traced("phase.apply_late_grading")
+def apply_late_grading_results(exec_id: str, sid: str, aid: str) -> bool:
+    """Merge any background re-grading results into the current feedback. Returns True if feedback changed."""
+    late_results = late_grading.collect(exec_id)
+    if not late_results:
+        return False
+    
+    fb = dict(st.session_state.get('feedback') or {})
+    pending = [q_num for q_num in fb.get('pending_questions', []) if q_num not in late_results]
+    for q_num, result in late_results.items():
+        fb[f"score{q_num}"] = result.get(f"score{q_num}", 5)
+        fb[f"feedback{q_num}"] = result.get(f"feedback{q_num}", "")
+    fb['pending_questions'] = pending
+    fb['timestamp'] = datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
+    # The re-grading thread has already persisted the completed row and recorded it in memory
+    st.session_state['feedback'] = fb
+    grading_log.info("[SCHEDULER] Applied background grading results for Q%s, still pending: %s", sorted(late_results.keys()), pending)
+    return True
+
+def submit_grading_job(exec_id: str, sid: str, aid: str, answers: Dict[str, str], active_questions: Dict[str, str]) -> str:
+    """Record the answers and queue them for grading; the page shows progress until the job finishes."""
+    record_answers(exec_id, sid, aid, answers)
+    # Earlier feedback goes into the grading prompts, so capture it before it is cleared for the new round
+    job_id = grading_jobs.submit(exec_id, sid, aid, answers, active_questions, st.session_state.get('feedback'))
+    st.session_state['grading_job'] = job_id
+    st.session_state['feedback'] = None
+    st.session_state['submitted'] = False
+    st.session_state['awaiting_resubmit'] = False
+    st.session_state['submit_error'] = None
+    return job_id
+
+
+def apply_grading_job(job: Dict[str, Any], active_questions: Dict[str, str]):
+    """Show a finished grading job in this session. The worker already persisted it and recorded it in memory."""
+    st.session_state.pop('grading_job', None)
+    grading_jobs.mark_shown(job["job_id"])
+    if job["status"] == "failed":
+        st.session_state['submit_error'] = 'Failed to grade your answers. Please try again.'
+        return
+    
+    grade_res = job["result"]
+    for q_key in active_questions.keys():
+        # A session that reconnected mid-grading shows the answers that were submitted
+        st.session_state[f'{q_key}_val'] = job["answers"].get(q_key, '')
+    
+    st.session_state['feedback'] = grade_res
+    st.session_state['submitted'] = True
+    st.session_state['awaiting_resubmit'] = False
+    st.session_state['submit_error'] = None
+    if job["metrics"]:
+        st.session_state['grading_metrics'] = job["metrics"]
+    grading_log.info("[JOBS] Applied grading job %s to exec_id=%s", job["job_id"], st.session_state.get('exec_id'))
+
+
+@fragment(run_every=GRADING_POLL_SECONDS)
+def grading_progress(job_id: str):
+    """Live progress of a queued grading job; reruns the page once the job has finished."""
+    job = grading_jobs.get(job_id)
+    if job is None or job["status"] in ("done", "failed"):
+        rerun()
+        return
+    graded, total = len(job["graded"]), max(job["total"], 1)
+    label = "Waiting for a grader..." if job["status"] == "queued" else f"Grading your answers... {graded}/{job['total']}"
+    st.progress(graded / total, text=label)
+    for q_num, score in sorted(job["graded"].items()):
+        st.markdown(f"✅ Q{q_num}: graded — score {score}/10")
+
+@fragment(run_every=GRADING_POLL_SECONDS)
+def late_grading_progress(exec_id: str):
+    """Waits on background re-grading; reruns the page once results are ready to merge into the feedback."""
+    if late_grading.has_results(exec_id) or not late_grading.has_pending(exec_id):
+        rerun()
+        return
+    st.info('Some answers are still being graded in the background. Their feedback will appear here shortly.')
+
 # --- Legacy Context Gathering Functions Removed ---
 # These functions are no longer needed since we use the ContextCache system
 # which provides better performance and more structured context management
 
 # Main UI loop
 
+def render_feedback_card(q_num: int):
+    """Score and feedback for one question, read from st.session_state['feedback']."""
+    fb = st.session_state.get('feedback') or {}
+    score = fb.get(f'new_score{q_num}', fb.get(f'score{q_num}', 0))
+    text = fb.get(f'new_feedback{q_num}', fb.get(f'feedback{q_num}', ''))
+    try:
+        score = float(score) if score else 0
+    except (ValueError, TypeError):
+        score = 0
+    score_label = f"{score}/10"
+    if q_num in fb.get('pending_questions', []):
+        score_label = 'pending'
+        score_class = 'score-mid'
+        emoji = '⏳'
+    elif score >= THRESHOLD_SCORE:
+        score_class = 'score-high'
+        emoji = '✅'
+    elif score >= THRESHOLD_SCORE - 2:
+        score_class = 'score-mid'
+        emoji = '⚠️'
+    else:
+        score_class = 'score-low'
+        emoji = '❌'
+    st.markdown(f"""
+        <div class='feedback-score-card' style='background:rgba(180,255,80,0.18); color:inherit; border-radius:8px 8px 0 0; padding:1rem; margin-bottom:0; font-size:1.08rem;'>
+            <span class='{score_class}'>{emoji} Score: {score_label}</span>
+        </div>
+    """, unsafe_allow_html=True)
+    if text:
+        st.markdown(
+            f"""
+            <div style='background:rgba(180,255,80,0.18); color:inherit; border-radius:0 0 8px 8px; padding:1rem; margin-bottom:0.7rem; font-size:1.08rem; margin-top:0;'>
+                <b>Feedback:</b><br>{text}
+            </div>
+            """, unsafe_allow_html=True
+        )
+    else:
+        st.info(f"No feedback available for Q{q_num}")
+
+
+@fragment
+def conversation_panel(exec_id: str, sid: str, latest_conversation_response: str):
+    """Follow-up question box and the latest response; asking a question reruns only this panel."""
+    assignment_memory = memory_registry.get(exec_id)
+
+    # Use a counter-based key to force clearing
+    conv_counter = st.session_state.get('conv_counter', 0)
+    user_q = st.text_input('Ask a follow-up question:', key=f'conv_{conv_counter}')
+
+    # Only process if there's a new question and it hasn't been processed yet
+    if user_q and user_q != st.session_state.get('last_processed_question', ''):
+        try:
+            conv_res = run_conversation(exec_id, sid, user_q)
+            if conv_res:
+                # Queue conversation data for background writing
+                background_writer.write_async('conversations', conv_res)
+                agent_msg = conv_res.get('agent_msg', conv_res.get('content', 'No response available'))
+
+                # Add to conversation memory (context_cache wraps the same manager)
+                assignment_memory.add_conversation(user_q, agent_msg)
+                assignment_memory.save_checkpoint()
+
+                # Store the response in session state to persist it
+                st.session_state['last_conversation_response'] = agent_msg
+
+                # Mark this question as processed and increment counter to clear input
+                st.session_state['last_processed_question'] = user_q
+                st.session_state['conv_counter'] = conv_counter + 1
+
+                # Show success message and rerun just this panel to clear input
+                st.success("Response generated!")
+                rerun_fragment()
+            else:
+                st.error("Failed to get a response. Please try again.")
+        except Exception as e:
+            st.error(f"Error during conversation: {e}")
+
+    # Display the stored conversation response (from session state or previous data)
+    conversation_response = st.session_state.get('last_conversation_response') or latest_conversation_response
+    if conversation_response:
+        st.write("**AI Response:**")
+        st.write(conversation_response)
+
+
+@fragment
+def retry_section(exec_id: str, sid: str, aid: str, active_questions: Dict[str, str]):
+    """New answer boxes for a retry; typing here reruns only this section, submitting reruns the page."""
+    # Place scroll anchor at the beginning of retry section
+    if SCROLL_AVAILABLE and st.session_state.get('scroll_to_retry', False):
+        scroll_to_here(0, key='retry_section_anchor')
+        st.session_state['scroll_to_retry'] = False
+
+    st.markdown("<div style='height:2rem;'></div>", unsafe_allow_html=True)
+    st.markdown("---")
+    st.markdown(f"<h2 style='text-align: center; margin-bottom: 1.5rem;'>🔄 Retry Assignment</h2>", unsafe_allow_html=True)
+    st.markdown(f"<p style='text-align: center; color: #666; margin-bottom: 2rem;'>Fill in your new answers below and click Resubmit when ready.</p>", unsafe_allow_html=True)
+
+    retry_answers: dict[str, str] = {}
+
+    # Show retry question blocks - dynamically render based on active questions
+    for q_key, q_text in active_questions.items():
+        q_num = int(q_key.replace('q', ''))
+        st.markdown(f"<div class='question-card' style='margin-bottom:0.3rem; font-size:1.08rem;'><b>Q{q_num}:</b> {q_text}</div>", unsafe_allow_html=True)
+        retry_key = f'retry_a{q_num}_counter{st.session_state.get("retry_counter", 0)}'
+        retry_val_key = f'retry_{q_key}_val'
+        retry_answers[q_key] = st.text_area("Your New Answer", value=st.session_state.get(retry_val_key, ''), key=retry_key, on_change=None)
+        st.session_state[retry_val_key] = retry_answers[q_key]
+
+    # Retry submission buttons
+    col1, col2 = st.columns(2)
+    with col1:
+        retry_submit = st.button('Resubmit New Answers', key='retry_submit_btn', use_container_width=True)
+    with col2:
+        cancel_retry = st.button('Cancel Retry', key='cancel_retry_btn', use_container_width=True)
+
+    if retry_submit:
+        # Prevent submission if any answer is empty - check all active questions
+        empty_answers = [q_key for q_key in active_questions.keys() if not retry_answers.get(q_key, '').strip()]
+        if empty_answers:
+            st.toast('Please fill in all answers before resubmitting.', icon='⚠️')
+        else:
+            # Queue the new answers for grading; feedback appears when the job finishes
+            submit_grading_job(exec_id, sid, aid, retry_answers, active_questions)
+
+            # FIX 1: Replace text in answer boxes at the top with new answers
+            for q_key in active_questions.keys():
+                st.session_state[f'{q_key}_val'] = retry_answers[q_key]
+                ui_log.debug("[RETRY] Updated session state %s_val with: %s...", q_key, retry_answers[q_key][:50])
+
+            # FIX 2: Erase any conversation text and reset conversation state
+            st.session_state['conversation_text'] = ''
+            st.session_state['last_processed_question'] = ''
+            st.session_state['conv_counter'] = 0
+            st.session_state['last_conversation_response'] = ''
+
+            # Clear retry mode; the grading progress replaces the old feedback
+            st.session_state['retry_mode'] = False
+
+            # Clear retry answer values for all active questions
+            for q_key in active_questions.keys():
+                st.session_state[f'retry_{q_key}_val'] = ''
+
+            # FIX 3: Force a complete rerun to ensure updates are visible
+            st.session_state['retry_completed'] = True
+            st.session_state['reset_counter'] = st.session_state.get('reset_counter', 0) + 1
+
+            # FIX 4: Trigger scroll to top
+            if SCROLL_AVAILABLE:
+                st.session_state['scroll_to_top'] = True
+
+            st.success('New answers submitted successfully!')
+            st.rerun()
+
+    if cancel_retry:
+        # Clear retry mode
+        st.session_state['retry_mode'] = False
+        # Clear retry answer values for all active questions
+        for q_key in active_questions.keys():
+            st.session_state[f'retry_{q_key}_val'] = ''
+        rerun()
+
 def main() -> None:
     # Handle scroll to top
     if SCROLL_AVAILABLE and st.session_state.get('scroll_to_top', False):
@@ -2283,15 +5029,42 @@ def main() -> None:
         # Store active_questions in session state for use by agents
         st.session_state['active_questions'] = active_questions
         
-        print(f"[DEBUG] Active questions in main loop: {list(active_questions.keys())}")
-        print(f"[DEBUG] Number of questions: {num_questions}")
+        ui_log.debug("Active questions in main loop: %s", list(active_questions.keys()))
+        ui_log.debug("Number of questions: %s", num_questions)
         
         # Initialize assignment session with new memory system FIRST (before loading data)
+        assignment_memory = memory_registry.get(exec_id)
         if not assignment_memory.current_state:
-            assignment_memory.initialize_assignment_session(exec_id, sid, aid, active_questions)
-            print(f"[MEMORY] Initialized new assignment session for student {sid} with {num_questions} questions")
+            # Returning students resume from their checkpoint with one indexed read
+            resumed = (str(sa.get('started', 'FALSE')).upper() == 'TRUE' and
+                       assignment_memory.restore_checkpoint(exec_id, sid, aid, active_questions))
+            if not resumed:
+                assignment_memory.initialize_assignment_session(exec_id, sid, aid, active_questions)
+                memory_log.info("[MEMORY] Initialized new assignment session for student %s with %s questions", sid, num_questions)
+            # Grading workers record into the checkpoint as well, so a restored one is complete; a fresh (or
+            # evicted) session without a checkpoint needs its history loaded from the sheets
+            st.session_state['memory_loaded'] = resumed
         else:
-            print(f"[MEMORY] Using existing assignment session for student {sid}")
+            memory_log.debug("[MEMORY] Using existing assignment session for student %s", sid)
+        
+        # A submission being graded in the background: this session's own, or one from before a refresh/reconnect
+        # that is still in flight or finished unseen. Finished jobs are applied here, before anything renders.
+        grading_job_id = st.session_state.get('grading_job')
+        job_applied = False
+        if not grading_job_id:
+            unseen_job = grading_jobs.unseen(sid, aid)
+            if unseen_job:
+                grading_job_id = st.session_state['grading_job'] = unseen_job["job_id"]
+                ui_log.info("[JOBS] Session for student %s picked up %s grading job %s", sid, unseen_job["status"], grading_job_id)
+        if grading_job_id:
+            job = grading_jobs.get(grading_job_id)
+            if job is None:
+                st.session_state.pop('grading_job', None)
+                grading_job_id = None
+            elif job["status"] in ("done", "failed"):
+                apply_grading_job(job, active_questions)
+                grading_job_id = None
+                job_applied = job["status"] == "done"
         
         # Check if assignment has been started and load previous session data if needed
         started_status = sa.get('started', 'FALSE').upper()
@@ -2302,14 +5075,14 @@ def main() -> None:
         
         # Only load previous data if the assignment has been started (started == 'TRUE')
         if started_status == 'TRUE':
-            # Check if there's previous data (answers or conversations) - use cached function
-            previous_answers, previous_feedback, latest_conversation_response = load_previous_session_data(sid, aid)
+            # Check if there's previous data (answers or conversations) - memoized per session until a write or max age
+            previous_answers, previous_feedback, latest_conversation_response = restore_previous_session(sid, aid)
             
             if previous_answers or previous_feedback or latest_conversation_response:
                 has_previous_data = True
-                print(f"[SESSION RESTORE] Found previous data for student {sid}, assignment {aid}")
-                print(f"[SESSION RESTORE] previous_answers keys: {list(previous_answers.keys())}")
-                print(f"[SESSION RESTORE] previous_feedback keys: {list(previous_feedback.keys())}")
+                ui_log.debug("[SESSION RESTORE] Found previous data for student %s, assignment %s", sid, aid)
+                ui_log.debug("[SESSION RESTORE] previous_answers keys: %s", list(previous_answers.keys()))
+                ui_log.debug("[SESSION RESTORE] previous_feedback keys: %s", list(previous_feedback.keys()))
                 
                 # Load all previous session data into memory (only once per session)
                 # This now works because assignment_memory.current_state is initialized above
@@ -2319,26 +5092,27 @@ def main() -> None:
                 
                 # Always update session state with latest data from Google Sheets
                 # This ensures refreshing the page loads the most recent submissions
-                print(f"[SESSION RESTORE] Updating session state with latest data from Google Sheets")
+                ui_log.debug("[SESSION RESTORE] Updating session state with latest data from Google Sheets")
                 
                 # Populate answer values
                 for q_key, answer_value in previous_answers.items():
                     val_key = f'{q_key}_val'
                     st.session_state[val_key] = answer_value
-                    print(f"[SESSION RESTORE] Updated {val_key} = {answer_value[:50]}...")
+                    ui_log.debug("[SESSION RESTORE] Updated %s = %s...", val_key, answer_value[:50])
                 
-                # Populate feedback
-                if previous_feedback:
+                # Populate feedback (unless a newer submission is still being graded or was just applied;
+                # its grading row may still be queued for writing)
+                if previous_feedback and not grading_job_id and not job_applied:
                     st.session_state['feedback'] = previous_feedback
                     st.session_state['submitted'] = True
-                    print(f"[SESSION RESTORE] Updated feedback with keys: {list(previous_feedback.keys())}")
+                    ui_log.debug("[SESSION RESTORE] Updated feedback with keys: %s", list(previous_feedback.keys()))
                 
                 # Populate conversation
                 if latest_conversation_response:
                     st.session_state['last_conversation_response'] = latest_conversation_response
-                    print(f"[SESSION RESTORE] Updated conversation response")
+                    ui_log.debug("[SESSION RESTORE] Updated conversation response")
         else:
-            print(f"[SESSION] Assignment not started yet (started={started_status}) - loading fresh form")
+            ui_log.info("[SESSION] Assignment not started yet (started=%s) - loading fresh form", started_status)
         
         # Initialize question caches with question text (backward compatibility) - dynamic based on active questions
         for q_key, q_text in active_questions.items():
@@ -2351,17 +5125,25 @@ def main() -> None:
 
         answers: dict[str, str] = {}
         # If we have previous feedback AND no current session state feedback, populate session state with it
-        if previous_feedback and not st.session_state.get('feedback'):
+        if previous_feedback and not st.session_state.get('feedback') and not grading_job_id:
             st.session_state['feedback'] = previous_feedback
             st.session_state['submitted'] = True
-            print(f"[DEBUG] Feedback populated from previous session: {previous_feedback}")
+            ui_log.debug("Feedback populated from previous session: %s", previous_feedback)
         elif st.session_state.get('feedback'):
-            print(f"[DEBUG] Using existing session state feedback: {st.session_state.get('feedback')}")
+            ui_log.debug("Using existing session state feedback: %s", st.session_state.get('feedback'))
         
         # If we have a previous conversation response, populate session state with it
         if latest_conversation_response:
             st.session_state['last_conversation_response'] = latest_conversation_response
-            print(f"[DEBUG] Conversation response populated from previous session: {latest_conversation_response[:100]}...")
+            ui_log.debug("Conversation response populated from previous session: %s...", latest_conversation_response[:100])
+        
+        # Pick up questions that were re-graded in the background after missing the deadline
+        apply_late_grading_results(exec_id, sid, aid)
+        if late_grading.has_pending(exec_id):
+            if FRAGMENTS_AVAILABLE:
+                late_grading_progress(exec_id)
+            else:
+                st.info('Some answers are still being graded in the background. Their feedback will appear when you interact with the page again.')
         
         # Use session state feedback (which now contains previous feedback if available)
         fb = st.session_state.get('feedback')
@@ -2371,84 +5153,66 @@ def main() -> None:
         # Clear retry completion flag if it exists
         if st.session_state.get('retry_completed', False):
             st.session_state['retry_completed'] = False
-            print("[RETRY] Cleared retry_completed flag")
+            ui_log.debug("[RETRY] Cleared retry_completed flag")
         
-        print(f"[DEBUG] Main function - fb exists: {bool(fb)}, submitted: {submitted}")
-        print(f"[DEBUG] Previous answers: {previous_answers}")
-        print(f"[DEBUG] Previous feedback: {previous_feedback}")
-        print(f"[DEBUG] Latest conversation response: {latest_conversation_response[:100]}..." if latest_conversation_response else "[DEBUG] No conversation response")
+        ui_log.debug("Main function - fb exists: %s, submitted: %s", bool(fb), submitted)
+        ui_log.debug("Previous answers: %s", previous_answers)
+        ui_log.debug("Previous feedback: %s", previous_feedback)
+        ui_log.debug("Latest conversation response: %.100s", latest_conversation_response or "(none)")
         
-        # Debug: Show memory system status
-        if assignment_memory.current_state:
-            memory_state = assignment_memory.current_state
-            print(f"[MEMORY DEBUG] Session active for student {memory_state['student_id']}")
-            print(f"[MEMORY DEBUG] Messages count: {len(memory_state.get('messages', []))}")
-            print(f"[MEMORY DEBUG] Scores: {memory_state.get('scores', {})}")
-            print(f"[MEMORY DEBUG] Answers: {len([k for k, v in memory_state.get('answers', {}).items() if v])}/3")
-        else:
-            print("[MEMORY DEBUG] No active assignment session")
+        # Debug: Show memory system status (stats() walks every session, so only when enabled)
+        if memory_log.isEnabledFor(logging.DEBUG):
+            memory_log.debug("Registry: %s", memory_registry.stats())
+            if assignment_memory.current_state:
+                memory_state = assignment_memory.current_state
+                memory_log.debug("Session active for student %s", memory_state['student_id'])
+                memory_log.debug("Messages count: %s", len(memory_state.get('messages', [])))
+                memory_log.debug("Scores: %s", memory_state.get('scores', {}))
+                memory_log.debug("Answers: %s/3", len([k for k, v in memory_state.get('answers', {}).items() if v]))
+            else:
+                memory_log.debug("No active assignment session")
 
         # --- Questions and Answers (dynamically rendered based on active questions) ---
-        for q_key, q_text in active_questions.items():
-            # Extract question number from key (e.g., "q3" -> 3)
-            q_num = int(q_key.replace('q', ''))
+        with tracer.span("phase.render_questions", questions=len(active_questions)):
+            for q_key, q_text in active_questions.items():
+                # Extract question number from key (e.g., "q3" -> 3)
+                q_num = int(q_key.replace('q', ''))
             
-            st.markdown(f"<div class='question-card' style='margin-bottom:0.3rem; font-size:1.08rem;'><b>Q{q_num}:</b> {q_text}</div>", unsafe_allow_html=True)
-            key = f'a{q_num}_r{round_no}_reset{reset_counter}'
-            val_key = f'{q_key}_val'
+                st.markdown(f"<div class='question-card' style='margin-bottom:0.3rem; font-size:1.08rem;'><b>Q{q_num}:</b> {q_text}</div>", unsafe_allow_html=True)
+                key = f'a{q_num}_r{round_no}_reset{reset_counter}'
+                val_key = f'{q_key}_val'
             
-            # If we have previous answers AND no current session state value, populate session state with them
-            if previous_answers and q_key in previous_answers and not st.session_state.get(val_key):
-                st.session_state[val_key] = previous_answers[q_key]
-                print(f"[DEBUG] Q{q_num} populated from previous session: {previous_answers[q_key][:50]}...")
-            elif st.session_state.get(val_key):
-                print(f"[DEBUG] Q{q_num} using existing session state value: {st.session_state.get(val_key)[:50]}...")
+                # If we have previous answers AND no current session state value, populate session state with them
+                if previous_answers and q_key in previous_answers and not st.session_state.get(val_key):
+                    st.session_state[val_key] = previous_answers[q_key]
+                    ui_log.debug("Q%s populated from previous session: %s...", q_num, previous_answers[q_key][:50])
+                elif st.session_state.get(val_key):
+                    ui_log.debug("Q%s using existing session state value: %s...", q_num, st.session_state.get(val_key)[:50])
             
-            # Use session state value (which now contains previous answer if available, or retry answer if updated)
-            current_value = st.session_state.get(val_key, '')
-            print(f"[DEBUG] Q{q_num} current_value: {current_value[:50]}..." if current_value else f"[DEBUG] Q{q_num} current_value: (empty)")
-            answers[q_key] = st.text_area("Your Answer", value=current_value, key=key, on_change=None)
-            st.session_state[val_key] = answers[q_key]
+                # Use session state value (which now contains previous answer if available, or retry answer if updated)
+                current_value = st.session_state.get(val_key, '')
+                ui_log.debug("Q%s current_value: %.50s", q_num, current_value or "(empty)")
+                answers[q_key] = st.text_area("Your Answer", value=current_value, key=key, on_change=None)
+                st.session_state[val_key] = answers[q_key]
             
-            # After submission, show feedback/score under each answer
-            if fb and submitted:
-                score = fb.get(f'new_score{q_num}', fb.get(f'score{q_num}', 0))
-                text = fb.get(f'new_feedback{q_num}', fb.get(f'feedback{q_num}', ''))
-                try:
-                    score = float(score) if score else 0
-                except (ValueError, TypeError):
-                    score = 0
-                if score >= THRESHOLD_SCORE:
-                    score_class = 'score-high'
-                    emoji = '✅'
-                elif score >= THRESHOLD_SCORE - 2:
-                    score_class = 'score-mid'
-                    emoji = '⚠️'
-                else:
-                    score_class = 'score-low'
-                    emoji = '❌'
-                st.markdown(f"""
-                    <div class='feedback-score-card' style='background:rgba(180,255,80,0.18); color:inherit; border-radius:8px 8px 0 0; padding:1rem; margin-bottom:0; font-size:1.08rem;'>
-                        <span class='{score_class}'>{emoji} Score: {score}/10</span>
-                    </div>
-                """, unsafe_allow_html=True)
-                if text:
-                    st.markdown(
-                        f"""
-                        <div style='background:rgba(180,255,80,0.18); color:inherit; border-radius:0 0 8px 8px; padding:1rem; margin-bottom:0.7rem; font-size:1.08rem; margin-top:0;'>
-                            <b>Feedback:</b><br>{text}
-                        </div>
-                        """, unsafe_allow_html=True
-                    )
-                else:
-                    st.info(f"No feedback available for Q{q_num}")
+                # After submission, show feedback/score under each answer
+                if fb and submitted:
+                    render_feedback_card(q_num)
 
         # --- Submission logic ---
         st.markdown("<div style='height:1.2rem;'></div>", unsafe_allow_html=True)
         fb = st.session_state.get('feedback')
         awaiting_resubmit = st.session_state.get('awaiting_resubmit', False)
         
-        if not fb and not awaiting_resubmit:
+        if grading_job_id:
+            # Grading runs in the job queue; the progress panel polls it and reruns the page when it finishes
+            if FRAGMENTS_AVAILABLE:
+                grading_progress(grading_job_id)
+            else:
+                with st.spinner('Grading your answers...'):
+                    grading_jobs.wait(grading_job_id, GRADING_DEADLINE_SECONDS + BACKGROUND_GRADING_DEADLINE_SECONDS)
+                rerun()
+        elif not fb and not awaiting_resubmit:
             # Define callback function for submission
             def handle_submit():
                 # Prevent submission if any answer is empty (check all active questions)
@@ -2457,43 +5221,8 @@ def main() -> None:
                     st.session_state['submit_error'] = 'Please fill in all answers before submitting.'
                     return
                 
-                # Process submission
-                with st.spinner('Submitting your answers...'):
-                    record_answers(exec_id, sid, aid, answers)
-                    grade_res = run_grading(exec_id, sid, aid, answers)
-                    if grade_res:
-                        # Queue grading data for background writing
-                        background_writer.write_async('grading', grade_res)
-                        
-                        # Populate context cache with responses and feedback for all active questions
-                        for q_key in active_questions.keys():
-                            q_num = q_key.replace('q', '')
-                            response = answers.get(q_key, '')
-                            feedback = grade_res.get(f'feedback{q_num}', '')
-                            score = grade_res.get(f'score{q_num}', '')
-                            
-                            # Add to new memory system
-                            assignment_memory.add_student_answer(q_num, response)
-                            assignment_memory.add_grading_result(q_num, int(score) if score else 0, feedback)
-                            
-                            # Also add to backward compatibility cache
-                            context_cache.add_response_and_feedback(q_num, response, feedback, score)
-                        
-                        # Update started status to TRUE if it was FALSE
-                        if started_status == 'FALSE':
-                            try:
-                                sheets.update_started_status(sid, aid, 'TRUE')
-                                print(f"[SESSION] Updated started status to TRUE for student {sid}, assignment {aid}")
-                            except Exception as e:
-                                print(f"[ERROR] Failed to update started status: {e}")
-                        
-                        # Store in session state for the rest of the app
-                        st.session_state['feedback'] = grade_res
-                        st.session_state['submitted'] = True
-                        st.session_state['awaiting_resubmit'] = False
-                        st.session_state['submit_error'] = None
-                    else:
-                        st.session_state['submit_error'] = 'Failed to grade your answers. Please try again.'
+                # Queue the submission; the script thread is free again as soon as it is recorded
+                submit_grading_job(exec_id, sid, aid, answers, active_questions)
             
             # Show Submit Answers button with callback
             submit = st.button('Submit Answers', use_container_width=True, on_click=handle_submit)
@@ -2504,10 +5233,13 @@ def main() -> None:
         # --- Completion/Follow-up logic ---
         if fb:
             st.markdown("<div style='height:0.7rem;'></div>", unsafe_allow_html=True)
-            # Check scores for all active questions
+            # Check scores for all active questions; questions still being graded count as neither pass nor fail
+            pending_qnums = fb.get('pending_questions', [])
             scores = []
             for q_key in active_questions.keys():
                 q_num = int(q_key.replace('q', ''))
+                if q_num in pending_qnums:
+                    continue
                 score_value = fb.get(f'new_score{q_num}', fb.get(f'score{q_num}', 0))
                 try:
                     score = float(score_value) if score_value else 0
@@ -2515,7 +5247,7 @@ def main() -> None:
                     score = 0
                 scores.append(score)
             
-            if all(score >= THRESHOLD_SCORE for score in scores):
+            if not pending_qnums and all(score >= THRESHOLD_SCORE for score in scores):
                 st.success(f'🎉 You have successfully completed this assignment! All {num_questions} questions passed!')
                 
                 # Update completed status to TRUE if not already set
@@ -2524,12 +5256,15 @@ def main() -> None:
                 if current_completed != 'TRUE':
                     try:
                         sheets.update_completed_status(sid, aid, 'TRUE')
-                        print(f"[COMPLETION] Marked assignment {aid} as completed for student {sid}")
+                        ui_log.info("[COMPLETION] Marked assignment %s as completed for student %s", aid, sid)
                     except Exception as e:
-                        print(f"[ERROR] Failed to update completed status: {e}")
+                        ui_log.error("Failed to update completed status: %s", e)
             else:
                 passed = sum(1 for score in scores if score >= THRESHOLD_SCORE)
-                st.warning(f'You need scores of {THRESHOLD_SCORE} or higher on all questions to complete this assignment. ({passed}/{num_questions} passed)')
+                if pending_qnums:
+                    st.info(f'⏳ {len(pending_qnums)} question{"s are" if len(pending_qnums) != 1 else " is"} still being graded. ({passed}/{num_questions} passed so far)')
+                else:
+                    st.warning(f'You need scores of {THRESHOLD_SCORE} or higher on all questions to complete this assignment. ({passed}/{num_questions} passed)')
                 # If awaiting_resubmit, show resubmit button above conversation
                 if awaiting_resubmit:
                     resubmit = st.button('Resubmit', key='resubmit_btn', use_container_width=True)
@@ -2539,17 +5274,8 @@ def main() -> None:
                         if empty_answers:
                             st.toast('Please fill in all answers before resubmitting.', icon='⚠️')
                         else:
-                            with st.spinner('Submitting your answers...'):
-                                record_answers(exec_id, sid, aid, answers)
-                                grade_res = run_grading(exec_id, sid, aid, answers)
-                                if grade_res:
-                                    sheets.grading.append_row(grade_res)
-                                    # Skip evaluation for faster response - use grading directly
-                                    st.session_state['feedback'] = grade_res
-                                    st.session_state['submitted'] = True
-                                    st.session_state['awaiting_resubmit'] = False
-                                else:
-                                    st.error("Failed to grade your answers. Please try again.")
+                            # Same path as Submit Answers: queued, with the progress panel shown on the next run
+                            submit_grading_job(exec_id, sid, aid, answers, active_questions)
                             rerun()
                 # Enhanced feedback button is disabled for now
                 # col1, col2 = st.columns(2)
@@ -2568,43 +5294,7 @@ def main() -> None:
                 #                 st.error("Failed to get enhanced feedback.")
                 
                 # Follow-up question (full width now that enhanced feedback is hidden)
-                # Use a counter-based key to force clearing
-                conv_counter = st.session_state.get('conv_counter', 0)
-                user_q = st.text_input('Ask a follow-up question:', key=f'conv_{conv_counter}')
-                
-                # Only process if there's a new question and it hasn't been processed yet
-                if user_q and user_q != st.session_state.get('last_processed_question', ''):
-                    try:
-                        conv_res = run_conversation(exec_id, sid, user_q)
-                        if conv_res:
-                            # Queue conversation data for background writing
-                            background_writer.write_async('conversations', conv_res)
-                            agent_msg = conv_res.get('agent_msg', conv_res.get('content', 'No response available'))
-                            
-                            # Add to conversation cache (both new and old systems)
-                            assignment_memory.add_conversation(user_q, agent_msg)
-                            context_cache.add_conversation(user_q, agent_msg)
-                            
-                            # Store the response in session state to persist it
-                            st.session_state['last_conversation_response'] = agent_msg
-                            
-                            # Mark this question as processed and increment counter to clear input
-                            st.session_state['last_processed_question'] = user_q
-                            st.session_state['conv_counter'] = conv_counter + 1
-                            
-                            # Show success message and trigger rerun to clear input
-                            st.success("Response generated!")
-                            rerun()
-                        else:
-                            st.error("Failed to get a response. Please try again.")
-                    except Exception as e:
-                        st.error(f"Error during conversation: {e}")
-                
-                # Display the stored conversation response (from session state or previous data)
-                conversation_response = st.session_state.get('last_conversation_response') or latest_conversation_response
-                if conversation_response:
-                    st.write("**AI Response:**")
-                    st.write(conversation_response)
+                conversation_panel(exec_id, sid, latest_conversation_response)
                 # Show Retry button at the bottom if not awaiting_resubmit
                 if not awaiting_resubmit:
                     retry = st.button('Retry', key='retry_btn', use_container_width=True)
@@ -2621,104 +5311,7 @@ def main() -> None:
 
         # --- Retry Mode: Show new question blocks below everything ---
         if st.session_state.get('retry_mode', False):
-            # Place scroll anchor at the beginning of retry section
-            if SCROLL_AVAILABLE and st.session_state.get('scroll_to_retry', False):
-                scroll_to_here(0, key='retry_section_anchor')
-                st.session_state['scroll_to_retry'] = False
-            
-            st.markdown("<div style='height:2rem;'></div>", unsafe_allow_html=True)
-            st.markdown("---")
-            st.markdown(f"<h2 style='text-align: center; margin-bottom: 1.5rem;'>🔄 Retry Assignment</h2>", unsafe_allow_html=True)
-            st.markdown(f"<p style='text-align: center; color: #666; margin-bottom: 2rem;'>Fill in your new answers below and click Resubmit when ready.</p>", unsafe_allow_html=True)
-            
-            retry_answers: dict[str, str] = {}
-            
-            # Show retry question blocks - dynamically render based on active questions
-            for q_key, q_text in active_questions.items():
-                q_num = int(q_key.replace('q', ''))
-                st.markdown(f"<div class='question-card' style='margin-bottom:0.3rem; font-size:1.08rem;'><b>Q{q_num}:</b> {q_text}</div>", unsafe_allow_html=True)
-                retry_key = f'retry_a{q_num}_counter{st.session_state.get("retry_counter", 0)}'
-                retry_val_key = f'retry_{q_key}_val'
-                retry_answers[q_key] = st.text_area("Your New Answer", value=st.session_state.get(retry_val_key, ''), key=retry_key, on_change=None)
-                st.session_state[retry_val_key] = retry_answers[q_key]
-            
-            # Retry submission buttons
-            col1, col2 = st.columns(2)
-            with col1:
-                retry_submit = st.button('Resubmit New Answers', key='retry_submit_btn', use_container_width=True)
-            with col2:
-                cancel_retry = st.button('Cancel Retry', key='cancel_retry_btn', use_container_width=True)
-            
-            if retry_submit:
-                # Prevent submission if any answer is empty - check all active questions
-                empty_answers = [q_key for q_key in active_questions.keys() if not retry_answers.get(q_key, '').strip()]
-                if empty_answers:
-                    st.toast('Please fill in all answers before resubmitting.', icon='⚠️')
-                else:
-                    with st.spinner('Submitting your new answers...'):
-                        # Record new answers
-                        record_answers(exec_id, sid, aid, retry_answers)
-                        # Grade new answers
-                        grade_res = run_grading(exec_id, sid, aid, retry_answers)
-                        if grade_res:
-                            # Queue grading data for background writing
-                            background_writer.write_async('grading', grade_res)
-                            
-                            # Populate context cache with retry responses and feedback for all active questions
-                            for q_key in active_questions.keys():
-                                q_num = q_key.replace('q', '')
-                                response = retry_answers.get(q_key, '')
-                                feedback = grade_res.get(f'feedback{q_num}', '')
-                                score = grade_res.get(f'score{q_num}', '')
-                                
-                                # Add to new memory system
-                                assignment_memory.add_student_answer(q_num, response)
-                                assignment_memory.add_grading_result(q_num, int(score) if score else 0, feedback)
-                                
-                                # Also add to backward compatibility cache
-                                context_cache.add_response_and_feedback(q_num, response, feedback, score)
-                            
-                            # FIX 1: Replace text in answer boxes at the top with new answers
-                            for q_key in active_questions.keys():
-                                st.session_state[f'{q_key}_val'] = retry_answers[q_key]
-                                print(f"[RETRY] Updated session state {q_key}_val with: {retry_answers[q_key][:50]}...")
-                            
-                            # FIX 2: Erase any conversation text and reset conversation state
-                            st.session_state['conversation_text'] = ''
-                            st.session_state['last_processed_question'] = ''
-                            st.session_state['conv_counter'] = 0
-                            st.session_state['last_conversation_response'] = ''
-                            
-                            # Clear retry mode and reset to show new feedback
-                            st.session_state['retry_mode'] = False
-                            st.session_state['feedback'] = grade_res
-                            st.session_state['submitted'] = True
-                            st.session_state['awaiting_resubmit'] = False
-                            
-                            # Clear retry answer values for all active questions
-                            for q_key in active_questions.keys():
-                                st.session_state[f'retry_{q_key}_val'] = ''
-                            
-                            # FIX 3: Force a complete rerun to ensure updates are visible
-                            st.session_state['retry_completed'] = True
-                            st.session_state['reset_counter'] = st.session_state.get('reset_counter', 0) + 1
-                            
-                            # FIX 4: Trigger scroll to top
-                            if SCROLL_AVAILABLE:
-                                st.session_state['scroll_to_top'] = True
-                            
-                            st.success('New answers submitted successfully!')
-                            st.rerun()
-                        else:
-                            st.error("Failed to grade your new answers. Please try again.")
-            
-            if cancel_retry:
-                # Clear retry mode
-                st.session_state['retry_mode'] = False
-                # Clear retry answer values for all active questions
-                for q_key in active_questions.keys():
-                    st.session_state[f'retry_{q_key}_val'] = ''
-                rerun()
+            retry_section(exec_id, sid, aid, active_questions)
 
     # --- Footer ---
     st.markdown("""
@@ -2731,17 +5324,19 @@ def main() -> None:
 def run_app():
     """Run the app with proper cleanup."""
     try:
-        main()
+        # Root span for the whole rerun; every phase below nests under it
+        with tracer.span("rerun", exec_id=st.session_state.get('exec_id')):
+            main()
     except KeyboardInterrupt:
-        print("\n🛑 App interrupted by user")
+        ui_log.warning("🛑 App interrupted by user")
         st.warning("App interrupted by user")
     except Exception as e:
-        print(f"❌ App error: {e}")
+        ui_log.exception("❌ App error: %s", e)
         st.error(f"App error: {e}")
         import traceback
         st.code(traceback.format_exc())
     finally:
-        print("🔄 Ensuring all writes complete before shutdown...")
+        ui_log.debug("🔄 Ensuring all writes complete before shutdown...")
         # Note: background_writer.shutdown() is only called on actual app shutdown, not on reruns
         # Streamlit reruns don't trigger the finally block in the way we expect
 
@@ -0,0 +1 @@
+"""Offline benchmarks and load tests for app.py (see bench/run_benchmarks.py)."""
@@ -0,0 +1,373 @@
+"""
+In-memory stand-ins for Google Sheets (gspread) and the chat models, for offline benchmarks and load tests.
+
+Select them with QUIZ_APP_BACKEND=bench.fakes; app.py then opens its sheets through sheets_client()
+and builds every model through chat_model(). Latency and failures are configurable and deterministic.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from types import SimpleNamespace
+
+import gspread
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+
+class CallCounter:
+    """Thread-safe counts of backend calls, e.g. {"sheets.get_all_records": 12, "llm.grading": 25}."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            self._counts[name] += n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+calls = CallCounter()
+
+
+# --- Sheets ---
+
+SHEETS_CONFIG = {
+    "read_latency": 0.0,  # Simulated round trip per read call, in seconds
+    "write_latency": 0.0  # Simulated round trip per write call, in seconds
+}
+
+
+def configure_sheets(**overrides):
+    SHEETS_CONFIG.update(overrides)
+
+
+class FakeWorksheet:
+    """The subset of gspread.Worksheet used by app.py, backed by a list of rows."""
+
+    def __init__(self, title: str, rows: int = 1000, cols: int = 26):
+        self.title = title
+        self._lock = threading.Lock()
+        self._rows = []  # row 1 is the header row
+
+    def _read(self, name: str):
+        calls.incr(f"sheets.{name}")
+        if SHEETS_CONFIG["read_latency"]:
+            time.sleep(SHEETS_CONFIG["read_latency"])
+
+    def _write(self, name: str):
+        calls.incr(f"sheets.{name}")
+        if SHEETS_CONFIG["write_latency"]:
+            time.sleep(SHEETS_CONFIG["write_latency"])
+
+    def row_values(self, row: int) -> list:
+        self._read("row_values")
+        with self._lock:
+            return list(self._rows[row - 1]) if row <= len(self._rows) else []
+
+    def get_all_values(self) -> list:
+        self._read("get_all_values")
+        with self._lock:
+            return [list(r) for r in self._rows]
+
+    def get_values(self, range_name: str) -> list:
+        # Only the open-ended "A<row>:<column>" ranges app.py reads
+        self._read("get_values")
+        start = int(re.match(r"[A-Z]+(\d+)", range_name).group(1))
+        with self._lock:
+            return [list(r) for r in self._rows[start - 1:]]
+
+    def get_all_records(self, expected_headers=None) -> list:
+        # Like gspread, every call rebuilds the dicts from the raw rows
+        self._read("get_all_records")
+        with self._lock:
+            if not self._rows:
+                return []
+            headers = self._rows[0]
+            return [dict(zip(headers, row + [""] * (len(headers) - len(row)))) for row in self._rows[1:]]
+
+    def append_row(self, values: list, **kwargs):
+        self._write("append_row")
+        with self._lock:
+            self._rows.append([str(v) if v is not None else "" for v in values])
+
+    def append_rows(self, rows: list, **kwargs):
+        self._write("append_rows")
+        with self._lock:
+            self._rows.extend([str(v) if v is not None else "" for v in values] for values in rows)
+
+    def update_cell(self, row: int, col: int, value):
+        self._write("update_cell")
+        with self._lock:
+            while len(self._rows) < row:
+                self._rows.append([])
+            target = self._rows[row - 1]
+            while len(target) < col:
+                target.append("")
+            target[col - 1] = str(value)
+
+
+class FakeSpreadsheet:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._worksheets = {}
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        with self._lock:
+            if title not in self._worksheets:
+                raise gspread.exceptions.WorksheetNotFound(title)
+            return self._worksheets[title]
+
+    def add_worksheet(self, title: str, rows="1000", cols="26") -> FakeWorksheet:
+        with self._lock:
+            ws = self._worksheets.setdefault(title, FakeWorksheet(title, int(rows), int(cols)))
+        return ws
+
+
+class FakeClient:
+    """Stands in for an authorized gspread.Client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spreadsheets = {}
+
+    def open(self, name: str) -> FakeSpreadsheet:
+        with self._lock:
+            return self._spreadsheets.setdefault(name, FakeSpreadsheet(name))
+
+
+_client = FakeClient()
+
+
+def sheets_client() -> FakeClient:
+    """The process-wide fake client, so benchmarks can seed the same sheets the app reads."""
+    return _client
+
+
+# --- Chat models ---
+
+LLM_CONFIG = {
+    "latency": 0.05,  # Seconds before the first token
+    "jitter": 0.0,  # Uniform +/- seconds added to latency
+    "chunk_delay": 0.0,  # Seconds between streamed chunks
+    "failure_rate": 0.0,  # Share of calls raising a generic provider error
+    "overload_rate": 0.0,  # Share of calls raising a 429 (drives the AIMD controller and circuit breaker)
+    "score_range": (5, 10),  # Inclusive range of grading scores; lower it to keep simulated students below the pass mark
+    "overrun_chars": 400,  # Text generated past the answer (an echoed prompt section) unless a stop sequence cuts it off
+    "seed": 0
+}
+
+
+def configure_llm(**overrides):
+    LLM_CONFIG.update(overrides)
+
+
+_FIELD_RE = re.compile(r'"((?:new_)?(?:score|feedback)\d+)"')
+_attempts = Counter()
+_attempts_lock = threading.Lock()
+
+
+class FakeProviderError(Exception):
+    pass
+
+
+class FakeChatModel:
+    """
+    Duck-typed chat model with the invoke / stream surface app.py uses.
+
+    Replies are derived from the prompt: grading and evaluation prompts get a JSON object with every
+    score/feedback field named in the prompt; other tasks get prose.
+    A call's latency and failure are drawn from a generator seeded by the prompt and how many times that
+    prompt has been sent, so a run replays identically regardless of thread scheduling.
+    """
+
+    def __init__(self, task: str, temperature: float = 0, provider: str = "openai", callbacks=None):
+        self.task = task
+        self.temperature = temperature
+        self.provider = provider
+        self.callbacks = callbacks or []
+
+    def _rng(self, prompt: str) -> random.Random:
+        key = zlib.crc32(prompt.encode("utf-8"))
+        with _attempts_lock:
+            _attempts[key] += 1
+            attempt = _attempts[key]
+        return random.Random(f"{LLM_CONFIG['seed']}:{key}:{attempt}")
+
+    def _begin(self, prompt: str) -> random.Random:
+        calls.incr(f"llm.{self.task}")
+        for callback in self.callbacks:
+            callback.on_llm_start(None, [prompt])
+        rng = self._rng(prompt)
+        delay = max(0.0, LLM_CONFIG["latency"] + rng.uniform(-1, 1) * LLM_CONFIG["jitter"])
+        time.sleep(delay)
+        roll = rng.random()
+        if roll < LLM_CONFIG["overload_rate"]:
+            calls.incr("llm.errors.overload")
+            raise FakeProviderError("429 Too Many Requests: rate limit exceeded")
+        if roll < LLM_CONFIG["overload_rate"] + LLM_CONFIG["failure_rate"]:
+            calls.incr("llm.errors.other")
+            raise FakeProviderError("500 Internal Server Error")
+        return rng
+
+    def _reply(self, prompt: str, rng: random.Random, fields=None, stop=None) -> str:
+        fields = fields or list(dict.fromkeys(_FIELD_RE.findall(prompt)))
+        if not fields:
+            text = "That's a good question. Think about how the key idea in your answer connects to the example, and try restating it in your own words."
+            section = "<current_student_question>"
+        else:
+            text = json.dumps(self._values(fields, rng))
+            section = "</output_format>"
+        # Like a real model, keep going into an echo of the prompt's sections; a stop sequence ends the reply there
+        overrun = "\n" + section + "\n" + "<instructions>Continue the response. " * (LLM_CONFIG["overrun_chars"] // 37 + 1)
+        text += overrun[:LLM_CONFIG["overrun_chars"]]
+        cut = min((text.find(s) for s in stop or [] if s in text), default=-1)
+        if cut >= 0:
+            calls.incr("llm.stopped")
+            text = text[:cut]
+        return text
+
+    def _values(self, fields, rng: random.Random) -> dict:
+        return {
+            name: rng.randint(*LLM_CONFIG["score_range"]) if "score" in name else f"Deterministic feedback for {name}: explain your reasoning in one more step."
+            for name in fields
+        }
+
+    def _end(self, prompt: str, text: str):
+        message = AIMessage(content=text, usage_metadata={
+            "input_tokens": len(prompt) // 4,
+            "output_tokens": len(text) // 4,
+            "total_tokens": (len(prompt) + len(text)) // 4
+        })
+        response = SimpleNamespace(generations=[[SimpleNamespace(message=message)]], llm_output=None)
+        for callback in self.callbacks:
+            callback.on_llm_end(response)
+        return message
+
+    def invoke(self, prompt, stop=None, **kwargs) -> AIMessage:
+        prompt = str(prompt)
+        rng = self._begin(prompt)
+        return self._end(prompt, self._reply(prompt, rng, stop=stop))
+
+    def stream(self, prompt, stop=None, response_format=None, generation_config=None, **kwargs):
+        prompt = str(prompt)
+        rng = self._begin(prompt)
+        # A provider-side schema (structured output) decides the fields instead of the prompt
+        fields = None
+        if response_format:
+            calls.incr("llm.structured")
+            fields = list(response_format["json_schema"]["schema"]["properties"])
+        elif generation_config and "response_schema" in generation_config:
+            calls.incr("llm.structured")
+            fields = list(generation_config["response_schema"]["properties"])
+        text = self._reply(prompt, rng, fields, stop)
+        for i in range(0, len(text), 16):
+            if i and LLM_CONFIG["chunk_delay"]:
+                time.sleep(LLM_CONFIG["chunk_delay"])
+            for callback in self.callbacks:
+                callback.on_llm_new_token(text[i:i + 16])
+            yield AIMessageChunk(content=text[i:i + 16])
+        self._end(prompt, text)
+
+
+def chat_model(task: str, temperature: float = 0, provider: str = "openai", callbacks=None) -> FakeChatModel:
+    return FakeChatModel(task, temperature, provider, callbacks)
+
+
+# --- Seeding ---
+
+SHEET_TITLES = {
+    "assignments": "assignments",
+    "student_assignments": "student_assignments",
+    "answers": "student_answers",
+    "grading": "feedback+grading",
+    "evaluation": "feedback_evaluation",
+    "conversations": "conversations"
+}
+
+
+def open_sheets(spreadsheet_name: str = None) -> SimpleNamespace:
+    """
+    Handles on the fake worksheets with the same attribute names as app.DataSheets, for seeding
+    without importing app (e.g. when the app only runs inside AppTest). The app must have run once
+    so the worksheets and their header rows exist; by default the spreadsheet it opened is used.
+    """
+    if spreadsheet_name is None:
+        with _client._lock:
+            spreadsheet_name = next(iter(_client._spreadsheets))
+    ss = _client.open(spreadsheet_name)
+    handles = {}
+    for attr, title in SHEET_TITLES.items():
+        ws = ss.worksheet(title)
+        with ws._lock:
+            headers = list(ws._rows[0]) if ws._rows else []
+        handles[attr] = SimpleNamespace(ws=ws, headers=headers, _cache={}, _cache_timestamp=0)
+    return SimpleNamespace(**handles)
+
+
+def clear_rows(sheets):
+    """Drop every data row (keeping the header row) from all of the app's sheets."""
+    for sheet in (sheets.assignments, sheets.student_assignments, sheets.answers,
+                  sheets.grading, sheets.evaluation, sheets.conversations):
+        with sheet.ws._lock:
+            del sheet.ws._rows[1:]
+        sheet._cache = {}
+        sheet._cache_timestamp = 0
+
+
+def seed_classroom(sheets, num_students: int, assignment_id: str = "bench_a1", num_questions: int = 5) -> list:
+    """Add one assignment with num_questions questions, assigned to num_students students. Returns the student ids."""
+    question_cells = {f"Question{i}": f"Question {i}: explain concept {i} in your own words." for i in range(1, num_questions + 1)}
+    assignment = {"date": "2026-01-05", "assignment_id": assignment_id, **question_cells}
+    sheets.assignments.ws.append_row([assignment.get(h, "") for h in sheets.assignments.headers])
+
+    student_ids = [f"s{i:04d}" for i in range(num_students)]
+    rows = []
+    for sid in student_ids:
+        record = {
+            "student_id": sid, "student_first_name": "Bench", "student_last_name": sid,
+            "assignment_id": assignment_id, "assignment_due": "2030-01-01",
+            "started": "FALSE", "completed": "FALSE", "priority": "1"
+        }
+        rows.append([record.get(h, "") for h in sheets.student_assignments.headers])
+    sheets.student_assignments.ws.append_rows(rows)
+    return student_ids
+
+
+def seed_history(sheets, total_rows: int, student_id: str, assignment_id: str, target_rows: int = 30, num_questions: int = 5):
+    """
+    Fill the answers, grading and conversations sheets with total_rows rows split evenly between them.
+    target_rows of them (per sheet, at most) belong to student_id/assignment_id; the rest to other students.
+    """
+    per_sheet = max(1, total_rows // 3)
+    for sheet, make in (
+        (sheets.answers, lambda i, eid: {**{f"q{q}_answer": f"answer {q} v{i}" for q in range(1, num_questions + 1)}}),
+        (sheets.grading, lambda i, eid: {**{f"score{q}": str(5 + (i + q) % 6) for q in range(1, num_questions + 1)},
+                                         **{f"feedback{q}": f"feedback {q} v{i}" for q in range(1, num_questions + 1)}}),
+        (sheets.conversations, lambda i, eid: {"user_msg": f"question {i}", "agent_msg": f"reply {i}", "winner": ""}),
+    ):
+        rows = []
+        for i in range(per_sheet):
+            mine = i >= per_sheet - min(target_rows, per_sheet)
+            eid = f"exec-{i // 10}"
+            record = {
+                "execution_id": eid,
+                "assignment_id": assignment_id if mine else f"other_{i % 7}",
+                "student_id": student_id if mine else f"x{i % 997:04d}",
+                "timestamp": f"2026-01-{1 + i * 27 // per_sheet:02d} {i % 24:02d}:{i % 60:02d}:{(i // 60) % 60:02d}",
+                **make(i, eid)
+            }
+            rows.append([record.get(h, "") for h in sheet.headers])
+        sheet.ws.append_rows(rows)
@@ -0,0 +1,370 @@
+"""
+Concurrent-student load test: drives simulated students through app.py with streamlit.testing.v1.AppTest
+against the in-memory fakes in bench/fakes.py.
+
+    python -m bench.load_test [--levels 1 5 10 25] [--output load_output.txt]
+
+Each student enters their IDs, submits answers (waiting for the queued grading job), asks follow-up
+questions and does a retry round, each in its own AppTest session; all students of a concurrency level run at once in one process, sharing
+the app's cached resources like sessions on one Streamlit server. Per level, one JSON line reports
+latency percentiles for every student step and every traced phase (from the app's span export),
+peak thread count and RSS, and Sheets / LLM call counts.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "app.py")
+
+# Spans reported from the trace export, grouped by span name
+TRACED_PREFIXES = ("rerun", "phase.", "grading.", "memory.", "llm.", "sheets.")
+
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {"count": len(ordered), "p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "max": ordered[-1]}
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        # ru_maxrss is the peak so far (KiB on Linux, bytes on macOS); the best available fallback
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class ResourceMonitor:
+    """Samples thread count and RSS on a background thread and keeps the peaks."""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak_threads = 0
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        self.peak_threads = max(self.peak_threads, threading.active_count())
+        self.peak_rss = max(self.peak_rss, _rss_bytes())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="load-monitor")
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def _by_key(elements, key: str):
+    return next((e for e in elements if e.key == key), None)
+
+
+def _by_key_prefix(elements, prefix: str) -> list:
+    return [e for e in elements if e.key and e.key.startswith(prefix)]
+
+
+def prepare_concurrent_apptest():
+    """
+    Make AppTest safe to run from several student threads in one process (students share the app's process-wide
+    state, as on a real server).
+    - Every run gets one process-wide ScriptCache, as a real server has. AppTest otherwise compiles app.py afresh
+      on every run, and compiling from several threads at once trips CPython's AST recursion-depth check
+      (SystemError), failing that run. With one cache the script is compiled once, under the cache's lock.
+    - Each run installs its own mock Runtime singleton and clears it when it finishes, leaving runs still going
+      with none for their end-of-script cleanup; they fall back to an inert one.
+    """
+    from unittest.mock import MagicMock
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import local_script_runner
+
+    shared = ScriptCache()
+    local_script_runner.ScriptCache = lambda: shared
+    inert = MagicMock(spec=Runtime)
+    Runtime.instance = classmethod(lambda cls: cls._instance or inert)
+
+
+class SimulatedStudent:
+    """One student's session, driven step by step through AppTest. Step wall times land in self.steps."""
+
+    def __init__(self, student_id: str, assignment_id: str, timeout: float):
+        from streamlit.testing.v1 import AppTest
+
+        self.student_id = student_id
+        self.assignment_id = assignment_id
+        self.timeout = timeout
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.at.secrets["logging"] = {"level": "WARNING"}  # Keep app logs out of the JSON output
+        self.steps = defaultdict(list)
+        self.errors = []
+
+    def _run(self, step: str, record: bool = True):
+        start = time.perf_counter()
+        try:
+            self.at.run()
+        except Exception as e:  # AppTest raises on script timeouts
+            self.errors.append(f"{step}: {e!r}")
+            return False
+        if record:
+            self.steps[step].append(time.perf_counter() - start)
+        if self.at.exception:
+            self.errors.extend(f"{step}: {ex.message}" for ex in self.at.exception)
+            return False
+        # A rejected submission or failed grading shows up as st.error / submit_error, not as an exception
+        failures = [e.value for e in self.at.error]
+        if "submit_error" in self.at.session_state and self.at.session_state["submit_error"]:
+            failures.append(f"submit_error: {self.at.session_state['submit_error']}")
+        if failures:
+            self.errors.extend(f"{step}: {message}" for message in failures)
+            return False
+        return True
+
+    def open(self) -> bool:
+        return self._run("open")
+
+    def enter_ids(self) -> bool:
+        self.at.text_input(key="sid").input(self.student_id)
+        if not self._run("enter_student_id"):
+            return False
+        self.at.text_input(key="aid_input").input(self.assignment_id)
+        return self._run("enter_assignment_id")
+
+    def submit(self) -> bool:
+        for i, area in enumerate(self.at.text_area, start=1):
+            area.input(f"My answer to question {i}: the key idea is that it depends on the example.")
+        # Typed text reaches the app on the next rerun, as in a browser; clicking in the same run would submit blanks
+        if not self._run("fill", record=False):
+            return False
+        submit = next((b for b in self.at.button if b.label == "Submit Answers"), None)
+        if submit is None:
+            self.errors.append("submit: no Submit Answers button")
+            return False
+        submit.click()
+        return self._run("submit") and self.await_grading()
+
+    def _grading_pending(self) -> bool:
+        try:
+            return bool(self.at.session_state["grading_job"])
+        except KeyError:
+            return False
+
+    def await_grading(self, poll: float = 0.25) -> bool:
+        """Rerun until the queued grading job has been applied (AppTest does not drive run_every fragments)."""
+        start = time.perf_counter()
+        while self._grading_pending():
+            if time.perf_counter() - start > self.timeout:
+                self.errors.append("grading: job did not finish in time")
+                return False
+            time.sleep(poll)
+            if not self._run("grading_poll", record=False):
+                return False
+        self.steps["grading_wait"].append(time.perf_counter() - start)
+        return True
+
+    def follow_up(self, n: int) -> bool:
+        inputs = _by_key_prefix(self.at.text_input, "conv_")
+        if not inputs:
+            return False  # All questions passed; no follow-up box
+        inputs[0].input(f"Follow-up {n}: why did I lose points on question 1?")
+        return self._run("follow_up")
+
+    def retry(self) -> bool:
+        retry = _by_key(self.at.button, "retry_btn")
+        if retry is None:
+            return False
+        retry.click()
+        if not self._run("open_retry"):
+            return False
+        for i, area in enumerate(_by_key_prefix(self.at.text_area, "retry_a"), start=1):
+            area.input(f"Revised answer {i}: the key idea holds because the example shows the general case.")
+        if not self._run("fill", record=False):
+            return False
+        _by_key(self.at.button, "retry_submit_btn").click()
+        return self._run("retry_submit") and self.await_grading()
+
+    def session(self, follow_ups: int, retries: int):
+        """Run the whole session; an unexpected error is recorded against this student instead of aborting the level."""
+        try:
+            self._session(follow_ups, retries)
+        except Exception as e:
+            self.errors.append(f"session: {e!r}")
+
+    def _session(self, follow_ups: int, retries: int):
+        if not (self.open() and self.enter_ids() and self.submit()):
+            return
+        for r in range(retries + 1):
+            for n in range(follow_ups):
+                if not self.follow_up(n):
+                    break
+            if r < retries and not self.retry():
+                break
+
+
+def _wait_for_quiet(fakes, trace_path: str, settle: float = 0.5, limit: float = 30.0):
+    """Wait until background writes and the trace exporter stop producing output."""
+    deadline = time.monotonic() + limit
+    last = None
+    while time.monotonic() < deadline:
+        size = os.path.getsize(trace_path) if os.path.exists(trace_path) else 0
+        current = (size, tuple(sorted(fakes.calls.snapshot().items())))
+        if current == last:
+            return
+        last = current
+        time.sleep(settle)
+
+
+def _read_spans(trace_path: str, offset: int) -> tuple:
+    if not os.path.exists(trace_path):
+        return [], offset
+    with open(trace_path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    # A batch may still be half-written; leave an unterminated last line for the next read
+    complete = data[:data.rfind(b"\n") + 1]
+    return [json.loads(line) for line in complete.decode("utf-8").splitlines() if line.strip()], offset + len(complete)
+
+
+def run_level(fakes, students: int, assignment_id: str, args, trace_path: str, trace_offset: int) -> tuple:
+    fakes.calls.reset()
+    simulated = [SimulatedStudent(f"s{i:04d}", assignment_id, args.timeout) for i in range(students)]
+
+    start = time.perf_counter()
+    with ResourceMonitor() as monitor, ThreadPoolExecutor(max_workers=students, thread_name_prefix="student") as pool:
+        list(pool.map(lambda s: s.session(args.follow_ups, args.retries), simulated))
+    wall = time.perf_counter() - start
+
+    _wait_for_quiet(fakes, trace_path)
+    spans, trace_offset = _read_spans(trace_path, trace_offset)
+
+    steps = defaultdict(list)
+    for student in simulated:
+        for step, samples in student.steps.items():
+            steps[step].extend(samples)
+    phases = defaultdict(list)
+    for span in spans:
+        if span["name"].startswith(TRACED_PREFIXES):
+            phases[span["name"]].append(span["durationMs"] / 1000)
+
+    counts = fakes.calls.snapshot()
+    errors = [e for student in simulated for e in student.errors]
+    result = {
+        "benchmark": "load_test",
+        "params": {
+            "students": students, "follow_ups": args.follow_ups, "retries": args.retries,
+            "llm_latency": args.llm_latency, "sheets_latency": args.sheets_latency
+        },
+        "metrics": {
+            "wall": wall,
+            "steps": {name: percentiles(samples) for name, samples in sorted(steps.items())},
+            "phases": {name: percentiles(samples) for name, samples in sorted(phases.items())},
+            "peak_threads": monitor.peak_threads,
+            "peak_rss_mb": round(monitor.peak_rss / 2 ** 20, 1),
+            "sheets_calls": sum(n for name, n in counts.items() if name.startswith("sheets.")),
+            "llm_calls": sum(n for name, n in counts.items() if name.startswith("llm.") and not name.startswith("llm.errors.")),
+            "calls": counts,
+            "students_failed": sum(1 for student in simulated if student.errors),
+            "errors": errors[:10]
+        }
+    }
+    if not counts.get("llm.grading"):
+        errors.append("no llm.grading calls: no submission was graded")
+        result["metrics"]["errors"] = errors[:10]
+    result["failed"] = bool(errors)
+    return result, trace_offset
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 5, 10, 25], help="concurrent students per run")
+    parser.add_argument("--follow-ups", type=int, default=2, help="follow-up questions per feedback round")
+    parser.add_argument("--retries", type=int, default=1, help="retry rounds per student")
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="fake model time to first token, seconds")
+    parser.add_argument("--sheets-latency", type=float, default=0.05, help="fake Sheets round trip, seconds")
+    parser.add_argument("--timeout", type=float, default=120, help="per-rerun AppTest timeout, seconds")
+    parser.add_argument("--output", help="also write the JSON lines to this file")
+    args = parser.parse_args()
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    prepare_concurrent_apptest()
+
+    # The app and its SQLite files / trace export live in a scratch directory
+    os.environ["QUIZ_APP_BACKEND"] = "bench.fakes"
+    os.environ["QUIZ_APP_LOG_STREAM"] = "stderr"  # stdout carries only the JSON records
+    os.environ["QUIZ_APP_TRACE_SAMPLE_RATE"] = "1.0"  # Every rerun traced, one unrotated export per run
+    os.environ["QUIZ_APP_TRACE_MAX_BYTES"] = "0"
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(tempfile.mkdtemp(prefix="quiz_load_"))
+    from bench import fakes
+
+    fakes.configure_llm(latency=args.llm_latency, jitter=args.llm_latency / 5,
+                        score_range=(4, 7))  # Below the pass mark, so every student reaches follow-ups and retry
+    fakes.configure_sheets(read_latency=args.sheets_latency, write_latency=args.sheets_latency)
+
+    # One warm-up session builds the cached resources and creates the sheets, then every level gets its own assignment
+    SimulatedStudent("warmup", "none", args.timeout).open()
+    sheets = fakes.open_sheets()
+    for level in args.levels:
+        fakes.seed_classroom(sheets, level, assignment_id=f"load_c{level}", num_questions=args.questions)
+
+    trace_path = os.path.abspath("traces.jsonl")
+    _wait_for_quiet(fakes, trace_path)
+    trace_offset = os.path.getsize(trace_path) if os.path.exists(trace_path) else 0
+
+    meta = {
+        "benchmark": "meta",
+        "params": {"levels": args.levels, "questions": args.questions},
+        "metrics": {"python": platform.python_version(), "platform": platform.platform(),
+                    "started_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    }
+    out = open(output_path, "w") if output_path else None
+
+    def emit(result):
+        line = json.dumps(result, default=str)
+        print(line, flush=True)
+        if out:
+            out.write(line + "\n")
+            out.flush()
+
+    failed = False
+    try:
+        emit(meta)
+        for level in args.levels:
+            result, trace_offset = run_level(fakes, level, f"load_c{level}", args, trace_path, trace_offset)
+            emit(result)
+            failed = failed or result["failed"]
+    finally:
+        if out:
+            out.close()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
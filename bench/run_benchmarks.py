@@ -0,0 +1,227 @@
+"""
+Offline performance benchmarks for app.py, run against the in-memory fakes in bench/fakes.py.
+
+    python -m bench.run_benchmarks [--quick] [--output bench_output.txt]
+
+Every result is printed (and optionally written) as one JSON object per line:
+    {"benchmark": "...", "params": {...}, "metrics": {...}}
+so runs can be diffed or loaded into a regression dashboard. Timings are in seconds.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(workdir: str):
+    """Import app.py on the fake backend, with its SQLite files (checkpoints, snapshots, metrics) in workdir."""
+    os.environ["QUIZ_APP_BACKEND"] = "bench.fakes"
+    os.environ["QUIZ_APP_LOG_STREAM"] = "stderr"  # stdout carries only the JSON records
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(workdir)
+    return importlib.import_module("app")
+
+
+def invalidate_caches(app):
+    for sheet in (app.sheets.assignments, app.sheets.student_assignments, app.sheets.answers,
+                  app.sheets.grading, app.sheets.evaluation, app.sheets.conversations):
+        sheet._cache = {}
+        sheet._cache_timestamp = 0
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def summarize(samples: list) -> dict:
+    ordered = sorted(samples)
+    return {
+        "median": statistics.median(ordered),
+        "min": ordered[0],
+        "max": ordered[-1],
+        "p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+    }
+
+
+def grading_prompts(app, num_questions: int, tag: str) -> list:
+    return [
+        (q, f"Grade answer {q} ({tag}).\n<output_format>{app.render_output_format(app.get_grading_output_format(q))}</output_format>")
+        for q in range(1, num_questions + 1)
+    ]
+
+
+# --- Benchmarks ---
+
+def bench_grading_throughput(app, fakes, question_counts, repeats: int, overload_rate: float = 0.0):
+    fakes.configure_llm(overload_rate=overload_rate)
+    for n in question_counts:
+        walls, late = [], 0
+        fakes.calls.reset()
+        for r in range(repeats):
+            prompts = grading_prompts(app, n, f"run {r} {uuid.uuid4().hex[:6]}")
+            wall, (results, late_qnums, _) = timed(
+                app._schedule_grading, prompts, app.GRADING_DEADLINE_SECONDS, max_workers=min(n, app.AIMD_MAX_LIMIT)
+            )
+            walls.append(wall)
+            late += len(late_qnums)
+        yield {
+            "benchmark": "grading_throughput",
+            "params": {"questions": n, "repeats": repeats, "llm_latency": fakes.LLM_CONFIG["latency"], "overload_rate": overload_rate},
+            "metrics": {
+                "wall": summarize(walls),
+                "questions_per_second": n / statistics.median(walls),
+                "late_questions": late,
+                "concurrency_limit": int(app.grading_concurrency.limit),
+                "llm_calls": fakes.calls.snapshot().get("llm.grading", 0)
+            }
+        }
+    fakes.configure_llm(overload_rate=0.0)
+
+
+def bench_session_restore(app, fakes, row_counts, num_questions: int = 5, delta_rows: int = 5):
+    sid, aid = "s_restore", "bench_restore"
+    questions = {f"q{i}": f"Question {i}" for i in range(1, num_questions + 1)}
+    for rows in row_counts:
+        fakes.clear_rows(app.sheets)
+        fakes.seed_history(app.sheets, rows, sid, aid, num_questions=num_questions)
+
+        invalidate_caches(app)
+        previous_wall, _ = timed(app.load_previous_session_data, sid, aid)
+
+        # Full replay of the sheet history (no snapshot yet), which also writes the snapshot
+        app.snapshot_store.delete(sid, aid)
+        manager = app.AssignmentMemoryManager()
+        manager.initialize_assignment_session(uuid.uuid4().hex, sid, aid, questions)
+        invalidate_caches(app)
+        replay_wall, _ = timed(app.load_session_data_into_memory, sid, aid, manager)
+
+        # Snapshot plus newer deltas: delta_rows rows per sheet appended after the snapshot was written
+        # (15 records by default, below MEMORY_COMPACT_AFTER_DELTAS, so this times replay without re-compaction)
+        fakes.seed_history(app.sheets, delta_rows * 3, sid, aid, target_rows=delta_rows, num_questions=num_questions)
+        manager = app.AssignmentMemoryManager()
+        manager.initialize_assignment_session(uuid.uuid4().hex, sid, aid, questions)
+        invalidate_caches(app)
+        snapshot_wall, _ = timed(app.load_session_data_into_memory, sid, aid, manager)
+
+        # Checkpoint restore (one indexed read)
+        manager = app.AssignmentMemoryManager()
+        checkpoint_wall, restored = timed(manager.restore_checkpoint, uuid.uuid4().hex, sid, aid, questions)
+
+        yield {
+            "benchmark": "session_restore",
+            "params": {"rows": rows, "questions": num_questions, "delta_rows": delta_rows},
+            "metrics": {
+                "load_previous_session_data": previous_wall,
+                "memory_full_replay": replay_wall,
+                "memory_snapshot_restore": snapshot_wall,
+                "checkpoint_restore": checkpoint_wall if restored else None,
+                "messages_after_restore": len(manager.current_state["messages"]) if restored else None
+            }
+        }
+
+
+def bench_sheet_get_all(app, fakes, row_counts, repeats: int):
+    for rows in row_counts:
+        fakes.clear_rows(app.sheets)
+        fakes.seed_history(app.sheets, rows * 3, "s_sheet", "bench_sheet")
+        sheet = app.sheets.answers
+        cold, warm = [], []
+        for _ in range(repeats):
+            invalidate_caches(app)
+            cold.append(timed(sheet.get_all)[0])
+            warm.append(timed(sheet.get_all)[0])
+        yield {
+            "benchmark": "sheet_get_all",
+            "params": {"rows": rows, "columns": len(sheet.headers), "repeats": repeats},
+            "metrics": {"refresh": summarize(cold), "cache_hit": summarize(warm)}
+        }
+
+
+def bench_conversation_prompt(app, message_counts, repeats: int, num_questions: int = 5):
+    questions = {f"q{i}": f"Question {i}" for i in range(1, num_questions + 1)}
+    for count in message_counts:
+        manager = app.AssignmentMemoryManager()
+        manager.initialize_assignment_session(uuid.uuid4().hex, "s_conv", "bench_conv", questions)
+        for i in range(count // 2):
+            manager.add_conversation(f"Student question {i} about concept {i % num_questions}? " * 3,
+                                     f"Tutor reply {i} explaining the idea step by step. " * 6)
+        state = manager.current_state
+        # Pretend the background summary has caught up, so the window build itself is measured
+        state["conversation_summary"] = {"text": "Earlier discussion summary.", "upto": max(1, len(state["messages"]) - 8)}
+        window, context_first, context_repeat = [], [], []
+        for _ in range(repeats):
+            window.append(timed(app.conversation_context.build_window, state)[0])
+            manager._rendered = {}
+            context_first.append(timed(manager.get_conversation_context)[0])
+            context_repeat.append(timed(manager.get_conversation_context)[0])
+        yield {
+            "benchmark": "conversation_prompt_build",
+            "params": {"messages": len(state["messages"]), "repeats": repeats},
+            "metrics": {
+                "build_window": summarize(window),
+                "conversation_context_cold": summarize(context_first),
+                "conversation_context_cached": summarize(context_repeat)
+            }
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="smaller sizes and fewer repeats (skips 100k-row restore)")
+    parser.add_argument("--output", help="also write the JSON lines to this file")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="fake model time to first token, seconds")
+    args = parser.parse_args()
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    workdir = tempfile.mkdtemp(prefix="quiz_bench_")
+    app = load_app(workdir)
+    fakes = importlib.import_module("bench.fakes")
+    fakes.configure_llm(latency=args.llm_latency, jitter=args.llm_latency / 5)
+
+    repeats = 2 if args.quick else 5
+    try:
+        revision = subprocess.run(["git", "-C", REPO_ROOT, "rev-parse", "--short", "HEAD"],
+                                  capture_output=True, text=True).stdout.strip()
+    except OSError:
+        revision = ""
+    meta = {
+        "benchmark": "meta",
+        "params": {"quick": args.quick, "llm_latency": args.llm_latency},
+        "metrics": {"python": platform.python_version(), "platform": platform.platform(),
+                    "revision": revision, "started_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    }
+
+    suites = [
+        bench_grading_throughput(app, fakes, [1, 5, 10, 15, 20, 25], repeats),
+        bench_grading_throughput(app, fakes, [25], repeats, overload_rate=0.1),
+        bench_session_restore(app, fakes, [1_000, 10_000] if args.quick else [1_000, 10_000, 100_000]),
+        bench_sheet_get_all(app, fakes, [1_000, 10_000], repeats),
+        bench_conversation_prompt(app, [50, 200, 400], repeats),
+    ]
+
+    out = open(output_path, "w") if output_path else None
+    try:
+        for result in [meta] + [r for suite in suites for r in suite]:
+            line = json.dumps(result, default=str)
+            print(line, flush=True)
+            if out:
+                out.write(line + "\n")
+    finally:
+        if out:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()